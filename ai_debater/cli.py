@@ -0,0 +1,129 @@
+from typing import List, Optional
+import argparse
+import multiprocessing
+from ai_debater.io_database import IODataBase
+from ai_debater.job_queue import JobQueue
+from ai_debater.models.response_log import ResponseLog
+from ai_debater.models.registry import CHATTERS
+from ai_debater.pipeline import Pipeline, STAGES, BATCH_STAGES
+
+MODELS_HELP = 'chatters as "Class" or "Class|model", classes: ' + ', '.join(CHATTERS)
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='ai-debater',
+                                     description='Run the debate flow as resumable jobs')
+    parser.add_argument('--db', default='results/dataset.db')
+    parser.add_argument('--env', default='.env', help='file of the api keys')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = subparsers.add_parser('enqueue', help='queue the work of a stage not done yet')
+    enqueue.add_argument('stage', choices=STAGES)
+    enqueue.add_argument('--models', nargs='+', required=True, help=MODELS_HELP)
+    enqueue.add_argument('--topic-creators', nargs='+', default=None,
+                         help='model entities whose topics are debated')
+
+    run = subparsers.add_parser('run', help='run the queued jobs')
+    run.add_argument('--models', nargs='+', required=True, help=MODELS_HELP)
+    run.add_argument('--stage', choices=STAGES, default=None)
+    run.add_argument('--max-jobs', type=int, default=None)
+    run.add_argument('--n-round', type=int, default=4)
+    run.add_argument('--tournament-id', default=None)
+    run.add_argument('--recover', action='store_true',
+                     help='release the running jobs first, when no other worker is alive')
+
+    worker = subparsers.add_parser('worker', help='run the jobs of stages along other workers')
+    worker.add_argument('--models', nargs='+', required=True, help=MODELS_HELP)
+    worker.add_argument('--stage', nargs='+', choices=STAGES, default=['debate', 'judge', 'vote'])
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--worker-id', default=None,
+                        help='suffixed by the process number, hostname-pid by default')
+    worker.add_argument('--lease', type=float, default=900., help='lease of a job in seconds')
+    worker.add_argument('--poll-interval', type=float, default=10.)
+    worker.add_argument('--max-idle', type=float, default=None)
+    worker.add_argument('--n-round', type=int, default=4)
+    worker.add_argument('--tournament-id', default=None)
+
+    batch = subparsers.add_parser('batch', help='run the queued jobs of a stage through the batch apis')
+    batch.add_argument('stage', choices=list(BATCH_STAGES))
+    batch.add_argument('--models', nargs='+', required=True, help=MODELS_HELP)
+    batch.add_argument('--max-jobs', type=int, default=None)
+    batch.add_argument('--poll-interval', type=float, default=60.)
+    batch.add_argument('--timeout', type=float, default=24*3600., help='seconds before giving up on a batch')
+    batch.add_argument('--lease', type=float, default=900., help='lease of a job in seconds')
+
+    subparsers.add_parser('status', help='number of jobs per stage and status')
+    subparsers.add_parser('workers', help='running jobs per worker')
+
+    retry = subparsers.add_parser('retry', help='queue the failed jobs again')
+    retry.add_argument('--stage', choices=STAGES, default=None)
+    return parser.parse_args(argv)
+
+def work(args: argparse.Namespace, worker_id: Optional[str] = None) -> int:
+    """One worker, with its own connection and its own clients"""
+    from dotenv import load_dotenv
+    load_dotenv(args.env)
+    pipeline = Pipeline(IODataBase(args.db), args.models,
+                        response_log=ResponseLog(args.db), n_round=args.n_round,
+                        tournament_id=args.tournament_id,
+                        worker_id=worker_id, lease_seconds=args.lease)
+    n_jobs = pipeline.work(args.stage, poll_interval=args.poll_interval, max_idle=args.max_idle)
+    print(f"{pipeline.queue.worker_id}: {n_jobs} jobs run")
+    return n_jobs
+
+def _work_process(args: argparse.Namespace, ith_process: int):
+    worker_id = None if args.worker_id is None else f"{args.worker_id}-{ith_process}"
+    work(args, worker_id)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    result_manager = IODataBase(args.db)
+    if args.command in ('status', 'retry', 'workers'):
+        queue = JobQueue(result_manager.connection)
+        if args.command == 'workers':
+            print(queue.workers().to_string(index=False))
+            return
+        if args.command == 'retry':
+            print(f"{queue.retry_failed(args.stage)} jobs queued again")
+        print(queue.status().to_string(index=False))
+        return
+    if args.command == 'worker':
+        if args.processes == 1:
+            work(args, args.worker_id)
+        else:
+            # Spawned, so that no process inherits the clients or connections of another
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=_work_process, args=(args, i))
+                         for i in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        print(JobQueue(result_manager.connection).status().to_string(index=False))
+        return
+    if args.command == 'enqueue':
+        # Models are only named, no chatter is created to enqueue
+        pipeline = Pipeline(result_manager, args.models)
+        kwargs = dict(topic_creators=args.topic_creators) if args.stage == 'debate' else {}
+        print(f"{pipeline.enqueue(args.stage, **kwargs)} {args.stage} jobs queued")
+    elif args.command == 'run':
+        from dotenv import load_dotenv
+        load_dotenv(args.env)
+        pipeline = Pipeline(result_manager, args.models, response_log=ResponseLog(args.db),
+                            n_round=args.n_round, tournament_id=args.tournament_id)
+        if args.recover:
+            print(f"{pipeline.queue.recover()} running jobs released")
+        n_jobs = pipeline.run(stage=args.stage, max_jobs=args.max_jobs)
+        print(f"{n_jobs} jobs run")
+        print(pipeline.queue.status().to_string(index=False))
+    elif args.command == 'batch':
+        from dotenv import load_dotenv
+        load_dotenv(args.env)
+        pipeline = Pipeline(result_manager, args.models, response_log=ResponseLog(args.db),
+                            lease_seconds=args.lease)
+        n_jobs = pipeline.run_batch(args.stage, max_jobs=args.max_jobs,
+                                    poll_interval=args.poll_interval, timeout=args.timeout)
+        print(f"{n_jobs} jobs done in batches")
+        print(pipeline.queue.status().to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+from typing import Dict
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Typed, denormalised rows of the analyses
+JUDGEMENTS_SCHEMA = pa.schema([
+    ("Categories", pa.string()),
+    ("Score", pa.float64()),
+    ("discourse_id", pa.string()),
+    ("judge_entity", pa.string()),
+    ("team_entity", pa.string()),
+    ("team_id", pa.string()),
+    ("team_proposing_id", pa.string()),
+    ("team_opposing_id", pa.string()),
+    ("topic_creator_entity", pa.string()),
+    ("opposing_entity", pa.string()),
+    ("proposing_entity", pa.string()),
+])
+VOTES_SCHEMA = pa.schema([
+    ("voted_for_judgement_id", pa.string()),
+    ("discourse_id", pa.string()),
+    ("judgement_ids", pa.list_(pa.string())),
+    ("public_model_entity", pa.string()),
+    ("voted_for_judgement_model_entity", pa.string()),
+    ("voted_for", pa.string()),
+])
+# Columns of the score stats joined to the judgements
+SCORE_STATS_SCHEMA = pa.schema([
+    ("judge_entity", pa.string()),
+    ("Categories", pa.string()),
+    ("mean_score", pa.float64()),
+    ("std_score", pa.float64()),
+    ("min_score", pa.float64()),
+    ("max_score", pa.float64()),
+])
+
+# Dimension table whose rowid tracks what is exported, per dataset
+DATASETS = {
+    "judgements": ("dim_judgements", JUDGEMENTS_SCHEMA),
+    "votes": ("dim_public", VOTES_SCHEMA),
+}
+
+_PART = re.compile(r"part-(\d+)-(\d+)\.parquet$")
+
+class ColumnarStore():
+    """Parquet export of the judgements and votes for analyses.
+
+    Each dataset is a directory of part files, one per refresh, named by
+    the range of rowids of its dimension table. A refresh only exports the
+    rows added since the last part, the saved results being append-only.
+    After results are rewritten in place, e.g. by reparse, rebuild the
+    export with refresh(result_manager, rebuild=True), which also merges
+    the parts into one.
+    """
+    def __init__(self, directory: str = 'results/columnar'):
+        self.directory = directory
+
+    def _dataset_dir(self, dataset: str) -> str:
+        return os.path.join(self.directory, dataset)
+
+    def exported_rowid(self, dataset: str) -> int:
+        """Last rowid of the dimension table exported"""
+        dataset_dir = self._dataset_dir(dataset)
+        if not os.path.isdir(dataset_dir):
+            return 0
+        return max((int(m.group(2)) for m in map(_PART.match, os.listdir(dataset_dir)) if m),
+                   default=0)
+
+    def _rows(self, result_manager, dataset: str, first: int, last: int) -> pd.DataFrame:
+        condition = "{}.rowid BETWEEN ? AND ?"
+        if dataset == "judgements":
+            return pd.read_sql(result_manager._enriched_judgements(condition.format("dim")),
+                               result_manager.connection, params=(first, last))
+        votes = pd.read_sql(result_manager._votes(condition.format("public")),
+                            result_manager.connection, params=(first, last))
+        votes = result_manager._add_voted_for(votes)
+        votes.judgement_ids = votes.judgement_ids.apply(lambda ids: [str(i) for i in np.ravel(ids)])
+        return votes
+
+    def _refresh(self, result_manager, dataset: str, rebuild: bool) -> int:
+        dim_table, schema = DATASETS[dataset]
+        dataset_dir = self._dataset_dir(dataset)
+        last = result_manager.connection.execute(
+            f"SELECT COALESCE(MAX(rowid), 0) FROM '{dim_table}'").fetchone()[0] \
+            if result_manager.has_table(dim_table) else 0
+        exported = self.exported_rowid(dataset)
+        # Fewer rows than exported: the database was replaced
+        if rebuild or exported > last:
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            exported = 0
+        if exported == last:
+            return 0
+        rows = self._rows(result_manager, dataset, exported + 1, last)
+        table = pa.Table.from_pandas(rows[schema.names], schema=schema, preserve_index=False)
+        os.makedirs(dataset_dir, exist_ok=True)
+        path = os.path.join(dataset_dir, f"part-{exported + 1:012d}-{last:012d}.parquet")
+        # Written aside then renamed, a part is complete once it is listed
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return table.num_rows
+
+    def refresh(self, result_manager, rebuild: bool = False) -> Dict[str, int]:
+        """Export the rows added since the last refresh, returns the number per dataset"""
+        return {dataset: self._refresh(result_manager, dataset, rebuild) for dataset in DATASETS}
+
+    def read(self, dataset: str) -> pa.Table:
+        _, schema = DATASETS[dataset]
+        dataset_dir = self._dataset_dir(dataset)
+        paths = sorted(os.path.join(dataset_dir, name) for name in os.listdir(dataset_dir)
+                       if _PART.match(name)) if os.path.isdir(dataset_dir) else []
+        if not paths:
+            return schema.empty_table()
+        return pa.concat_tables([pq.read_table(path, memory_map=True) for path in paths])
+
+    @staticmethod
+    def to_pandas(table: pa.Table) -> pd.DataFrame:
+        # Arrow backed columns, the buffers are not copied
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    @staticmethod
+    def normalise(judgements: pa.Table, stats: pd.DataFrame) -> pa.Table:
+        """Normalised_score and Z_score, by the stats of IODataBase.load_judge_score_stats"""
+        stats = pa.Table.from_pandas(stats, schema=SCORE_STATS_SCHEMA, preserve_index=False)
+        judgements = judgements.join(stats, keys=["judge_entity", "Categories"], join_type="left outer")
+        score_range = pc.subtract(judgements["max_score"], judgements["min_score"])
+        # As in sql, a division by zero is null
+        normalised = pc.if_else(pc.equal(score_range, 0), pa.scalar(None, pa.float64()),
+                                pc.divide(pc.subtract(judgements["Score"], judgements["min_score"]),
+                                          score_range))
+        z_score = pc.divide(pc.subtract(judgements["Score"], judgements["mean_score"]),
+                            judgements["std_score"])
+        return judgements.drop_columns(["mean_score", "std_score", "min_score", "max_score"]) \
+            .append_column("Normalised_score", normalised) \
+            .append_column("Z_score", z_score)
+
+    def load_judgements_for_analyses(self, result_manager) -> pd.DataFrame:
+        self.refresh(result_manager)
+        return self.to_pandas(self.normalise(self.read("judgements"), result_manager.load_judge_score_stats()))
+
+    def load_votes_for_analyses(self, result_manager) -> pd.DataFrame:
+        self.refresh(result_manager)
+        return self.to_pandas(self.read("votes"))
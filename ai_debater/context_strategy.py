@@ -0,0 +1,133 @@
+from typing import Dict, List, Optional
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import threading
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.rate_limiter import estimate_tokens
+from ai_debater.prompt_engineering import SummariserContext
+from ai_debater.prompt_interface import discourse2messages
+
+class ContextStrategy(ABC):
+    """Part of the discourse sent to the next speaker along the topic.
+
+    The oldest arguments are dropped two at a time, so that the remaining
+    messages keep alternating roles. With max_tokens, further arguments are
+    dropped until the estimated prompt size fits the budget; the last
+    argument is always kept.
+    """
+    def __init__(self, max_tokens: Optional[int] = None):
+        self.max_tokens = max_tokens
+
+    @abstractmethod
+    def n_dropped(self, discourse: List[str]) -> int: ...
+
+    def reserved_tokens(self) -> int:
+        """Tokens of the prompt taken by the strategy itself, e.g. a summary"""
+        return 0
+
+    def _fit(self, discourse: List[str], n_dropped: int, fixed_tokens: int) -> int:
+        n_dropped -= n_dropped%2
+        if self.max_tokens is None:
+            return n_dropped
+        tokens = fixed_tokens + sum(estimate_tokens(d) for d in discourse[n_dropped:])
+        while tokens > self.max_tokens and n_dropped + 2 < len(discourse):
+            tokens -= estimate_tokens(discourse[n_dropped]) + estimate_tokens(discourse[n_dropped+1])
+            n_dropped += 2
+        return n_dropped
+
+    def _topic_message(self, topic_message: Dict[str, str], dropped: List[str]) -> Dict[str, str]:
+        return topic_message
+
+    def messages(self, topic_message: Dict[str, str], discourse: List[str],
+                 for_opponent: bool = False, init_prompt: str = '') -> List[Dict[str, str]]:
+        fixed_tokens = estimate_tokens(init_prompt) + estimate_tokens(topic_message["content"]) \
+            + self.reserved_tokens()
+        n_dropped = self._fit(discourse, self.n_dropped(discourse), fixed_tokens)
+        messages = [self._topic_message(topic_message, discourse[:n_dropped])]
+        messages.extend(discourse2messages(discourse[n_dropped:], for_opponent=for_opponent))
+        return messages
+
+    async def amessages(self, topic_message: Dict[str, str], discourse: List[str],
+                        for_opponent: bool = False, init_prompt: str = '') -> List[Dict[str, str]]:
+        return self.messages(topic_message, discourse, for_opponent=for_opponent, init_prompt=init_prompt)
+
+class FullHistory(ContextStrategy):
+    """The whole discourse, as long as it fits max_tokens"""
+    def n_dropped(self, discourse: List[str]) -> int:
+        return 0
+
+class LastTurns(ContextStrategy):
+    """The last k arguments (k+1 when needed to keep the roles alternating)"""
+    def __init__(self, k: int = 4, max_tokens: Optional[int] = None):
+        super().__init__(max_tokens=max_tokens)
+        self.k = k
+
+    def n_dropped(self, discourse: List[str]) -> int:
+        return max(0, len(discourse) - self.k)
+
+class RollingSummary(LastTurns):
+    """The last k arguments, the earlier ones summarised by a (cheap) summariser.
+
+    Summaries are rolling: a new summary is made from the previous one and
+    the arguments dropped since. They are shared by both speakers.
+    """
+    def __init__(self, summariser: BaseAiChatter, k: int = 4,
+                 max_tokens: Optional[int] = None, summary_tokens: int = 600):
+        super().__init__(k=k, max_tokens=max_tokens)
+        summariser.initialise(SummariserContext())
+        self.summariser = summariser
+        self.summary_tokens = summary_tokens
+        self._summaries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def reserved_tokens(self) -> int:
+        return self.summary_tokens
+
+    @staticmethod
+    def _prefix_keys(dropped: List[str]) -> List[str]:
+        """Key of each even prefix of dropped, from the empty one"""
+        sha = hashlib.sha256()
+        keys = [sha.hexdigest()]
+        for i, argument in enumerate(dropped):
+            sha.update(argument.encode('utf-8') + b'\0')
+            if i%2 == 1:
+                keys.append(sha.hexdigest())
+        return keys
+
+    @staticmethod
+    def _summary_input(summary: Optional[str], arguments: List[str], first_argument: int) -> Dict[str, str]:
+        content = f"<Summary>{summary if summary is not None else ''}</Summary>\n"
+        for iii, argument in enumerate(arguments, start=first_argument):
+            team = "Proposing" if iii%2 == 0 else "Opposing"
+            content += f"<Argument><Team>{team}</Team><Text>{argument}</Text></Argument>\n"
+        return {"role": "user", "content": content}
+
+    def summary(self, dropped: List[str]) -> Optional[str]:
+        keys = self._prefix_keys(dropped)
+        with self._lock:
+            covered = max(i for i, key in enumerate(keys) if i == 0 or key in self._summaries)
+            previous = self._summaries.get(keys[covered]) if covered else None
+        if covered == len(keys) - 1:
+            return previous
+        summary = self.summariser.answer_until_valid(
+            [self._summary_input(previous, dropped[2*covered:], 2*covered)])
+        if summary is None:
+            # Debate on with the last summary rather than fail the debate
+            return previous
+        with self._lock:
+            self._summaries[keys[-1]] = summary
+        return summary
+
+    def _topic_message(self, topic_message: Dict[str, str], dropped: List[str]) -> Dict[str, str]:
+        summary = self.summary(dropped)
+        if summary is None:
+            return topic_message
+        return {"role": topic_message["role"],
+                "content": topic_message["content"] + f"; Summary of the previous arguments: {summary}"}
+
+    async def amessages(self, topic_message: Dict[str, str], discourse: List[str],
+                        for_opponent: bool = False, init_prompt: str = '') -> List[Dict[str, str]]:
+        # The summariser is called from a thread, not to block the event loop
+        return await asyncio.to_thread(self.messages, topic_message, discourse,
+                                       for_opponent=for_opponent, init_prompt=init_prompt)
@@ -1,23 +1,35 @@
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import sqlite3
 import pandas as pd
+from ai_debater.io_database import ResultsWriter, write_frames
 from ai_debater.models.abstractai_chatter import BaseAiChatter
 from ai_debater.prompt_interface import topic2message
-from ai_debater.prompt_interface import discourse2messages
+from ai_debater.context_strategy import ContextStrategy, FullHistory
 
-def run_debate(topic: pd.Series, 
-               prop: BaseAiChatter, oppo: BaseAiChatter,
-               connection,
-               n_round=4):
+def _discourse_id(topic: pd.Series, prop: BaseAiChatter, oppo: BaseAiChatter) -> str:
     assert "topic_id" in topic.index, "topic must have a unique id"
-    topic_message = topic2message(topic)
-    current_topic_id = topic.topic_id
-    discourse_id = current_topic_id+':'+prop.model_id()+'-vs-'+oppo.model_id()
-    discourse = []
-    for _ in range(n_round):
-        for is_opponent, model_speaking in zip([False, True], [prop, oppo]):
-            messages = [topic_message]
-            messages.extend(discourse2messages(discourse, for_opponent=is_opponent))
-            discourse.append(model_speaking.answer_until_valid(messages))
+    return topic.topic_id+':'+prop.model_id()+'-vs-'+oppo.model_id()
+
+def _argument_id(discourse_id: str, ith_argument: int) -> str:
+    return discourse_id+str(ith_argument)
+
+# Statistics of each turn saved along the arguments
+TURN_STATISTICS = ['latency', 'time_to_first_token', 'tokens_per_second',
+                   'prompt_tokens', 'completion_tokens']
+# Statistics of a judgement or a vote saved along its dim row
+CALL_STATISTICS = ['latency', 'prompt_tokens', 'completion_tokens']
+
+def call_statistics(model: BaseAiChatter) -> Dict:
+    """CALL_STATISTICS of the last call of model in the current thread"""
+    last_call = model.last_call
+    return {key: last_call.get(key) for key in CALL_STATISTICS}
+
+def _discourse2frames(discourse: List[str], turn_stats: List[Dict], discourse_id: str, topic_id: str,
+                      prop: BaseAiChatter, oppo: BaseAiChatter,
+                      tournament_id: Optional[str] = None) -> Tuple[pd.Series, pd.DataFrame]:
     fact_discourse = pd.DataFrame(discourse, columns=['Argument'])
+    turn_stats = pd.DataFrame(turn_stats, columns=TURN_STATISTICS, index=fact_discourse.index, dtype=float)
+    fact_discourse = fact_discourse.join(turn_stats)
     fact_discourse['ith_argument'] = fact_discourse.index
     fact_discourse['discourse_id'] = discourse_id
     fact_discourse['argument_id']  =discourse_id + fact_discourse['ith_argument'].astype(str)
@@ -28,6 +40,98 @@ def run_debate(topic: pd.Series,
     dim_discourse = pd.Series(dict(discourse_id=discourse_id,
                                     model_proposing = prop.model_id(),
                                     model_opposing = oppo.model_id(),
-                                    topic_id = current_topic_id))
-    dim_discourse.to_frame().transpose().to_sql("dim_discourse", connection, if_exists='append')
-    fact_discourse.to_sql("fact_discourse", connection, if_exists='append')
\ No newline at end of file
+                                    topic_id = topic_id,
+                                    tournament_id = tournament_id))
+    return dim_discourse, fact_discourse
+
+def debate(topic: pd.Series,
+           prop: BaseAiChatter, oppo: BaseAiChatter,
+           n_round=4, stream=False,
+           on_token: Optional[Callable[[str, int, str], None]] = None,
+           tournament_id: Optional[str] = None,
+           context: Optional[ContextStrategy] = None,
+           past_arguments: Optional[List[str]] = None,
+           past_turn_stats: Optional[List[Dict]] = None,
+           on_turn: Optional[Callable[[int, str, Dict], None]] = None) -> Tuple[pd.Series, pd.DataFrame]:
+    """Let prop and oppo debate over n_round.
+
+    With stream (implied by on_token), the arguments are streamed and
+    on_token(discourse_id, ith_argument, token) is called for each token
+    as it arrives. context selects the part of the discourse sent to each
+    speaker, by default all of it.
+
+    A debate interrupted is resumed from its past_arguments (and their
+    past_turn_stats); on_turn(ith_argument, argument, turn_stats) is called
+    after each turn, e.g. to checkpoint it.
+    """
+    if context is None:
+        context = FullHistory()
+    discourse_id = _discourse_id(topic, prop, oppo)
+    topic_message = topic2message(topic)
+    discourse = list(past_arguments) if past_arguments is not None else []
+    turn_stats = list(past_turn_stats) if past_turn_stats is not None else [{} for _ in discourse]
+    for ith_argument in range(len(discourse), 2*n_round):
+        is_opponent = ith_argument%2 == 1
+        model_speaking = oppo if is_opponent else prop
+        messages = context.messages(topic_message, discourse, for_opponent=is_opponent,
+                                    init_prompt=model_speaking.init_prompt)
+        turn_on_token = None
+        if on_token is not None:
+            turn_on_token = lambda token: on_token(discourse_id, ith_argument, token)
+        argument = model_speaking.answer_until_valid(messages, stream=stream, on_token=turn_on_token,
+                                                     request_id=_argument_id(discourse_id, ith_argument))
+        discourse.append(argument)
+        turn_stats.append(model_speaking.last_call)
+        if on_turn is not None:
+            on_turn(ith_argument, argument, model_speaking.last_call)
+    return _discourse2frames(discourse, turn_stats, discourse_id, topic.topic_id, prop, oppo,
+                             tournament_id=tournament_id)
+
+async def adebate(topic: pd.Series,
+                  prop: BaseAiChatter, oppo: BaseAiChatter,
+                  n_round=4, tournament_id: Optional[str] = None,
+                  context: Optional[ContextStrategy] = None) -> Tuple[pd.Series, pd.DataFrame]:
+    if context is None:
+        context = FullHistory()
+    discourse_id = _discourse_id(topic, prop, oppo)
+    topic_message = topic2message(topic)
+    discourse = []
+    turn_stats = []
+    for _ in range(n_round):
+        for is_opponent, model_speaking in zip([False, True], [prop, oppo]):
+            messages = await context.amessages(topic_message, discourse, for_opponent=is_opponent,
+                                               init_prompt=model_speaking.init_prompt)
+            discourse.append(await model_speaking.aanswer_until_valid(
+                messages, request_id=_argument_id(discourse_id, len(discourse))))
+            turn_stats.append(model_speaking.last_call)
+    return _discourse2frames(discourse, turn_stats, discourse_id, topic.topic_id, prop, oppo,
+                             tournament_id=tournament_id)
+
+def save_debate(dim_discourse: pd.Series, fact_discourse: pd.DataFrame,
+                connection: Union[sqlite3.Connection, ResultsWriter],
+                on_saved: Optional[Callable[[Optional[BaseException]], None]] = None):
+    """Write the debate, on_saved is called once it is committed or failed to be"""
+    tables = {"dim_discourse": dim_discourse.to_frame().transpose(),
+              "fact_discourse": fact_discourse}
+    if isinstance(connection, ResultsWriter):
+        connection.write(tables, on_flushed=on_saved)
+        return
+    try:
+        write_frames(connection, tables)
+    except Exception as error:
+        if on_saved is not None:
+            on_saved(error)
+        raise
+    if on_saved is not None:
+        on_saved(None)
+
+def run_debate(topic: pd.Series,
+               prop: BaseAiChatter, oppo: BaseAiChatter,
+               connection,
+               n_round=4, stream=False, on_token=None, tournament_id=None,
+               context=None):
+    dim_discourse, fact_discourse = debate(topic, prop, oppo, n_round=n_round,
+                                           stream=stream, on_token=on_token,
+                                           tournament_id=tournament_id,
+                                           context=context)
+    save_debate(dim_discourse, fact_discourse, connection)
@@ -1,8 +1,13 @@
 
+from typing import Callable, Dict, List, Optional, Tuple
 import sqlite3 
 import pandas as pd
 import numpy as np
 from io import BytesIO
+import atexit
+import threading
+import time
+import warnings
 
 def adapt_array(arr):
     """
@@ -24,11 +29,571 @@ sqlite3.register_adapter(np.ndarray, adapt_array)
 # Converts TEXT to np.array when selecting
 sqlite3.register_converter("array", convert_array)
 
+# Same text format as DataFrame.to_sql for timestamps
+sqlite3.register_adapter(pd.Timestamp, lambda timestamp: timestamp.isoformat(sep=' '))
+for np_type in (np.int32, np.int64):
+    sqlite3.register_adapter(np_type, int)
+for np_type in (np.float32, np.float64):
+    sqlite3.register_adapter(np_type, float)
+
+
+# Version of the schema below, stored in the database as PRAGMA user_version.
+# Version 0 are databases created implicitly through DataFrame.to_sql
+SCHEMA_VERSION = 7
+
+# Tables in dependency order
+TABLES = {
+    "model_infos":
+    """
+    CREATE TABLE model_infos (
+        model_id TEXT PRIMARY KEY,
+        model_class TEXT,
+        model TEXT,
+        model_entity TEXT,
+        creation_date TIMESTAMP
+    )
+    """,
+    "topics":
+    """
+    CREATE TABLE topics (
+        topic_id TEXT PRIMARY KEY,
+        model_id TEXT REFERENCES model_infos (model_id),
+        ith_topic INTEGER,
+        Subject TEXT,
+        Rational TEXT
+    )
+    """,
+    "dim_discourse":
+    """
+    CREATE TABLE dim_discourse (
+        discourse_id TEXT PRIMARY KEY,
+        model_proposing TEXT REFERENCES model_infos (model_id),
+        model_opposing TEXT REFERENCES model_infos (model_id),
+        topic_id TEXT REFERENCES topics (topic_id),
+        tournament_id TEXT
+    )
+    """,
+    "fact_discourse":
+    """
+    CREATE TABLE fact_discourse (
+        argument_id TEXT PRIMARY KEY,
+        discourse_id TEXT REFERENCES dim_discourse (discourse_id),
+        ith_argument INTEGER,
+        Argument TEXT,
+        model_speaking TEXT REFERENCES model_infos (model_id),
+        latency REAL,
+        time_to_first_token REAL,
+        tokens_per_second REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER
+    )
+    """,
+    "dim_judgements":
+    """
+    CREATE TABLE dim_judgements (
+        judgement_id TEXT PRIMARY KEY,
+        discourse_id TEXT REFERENCES dim_discourse (discourse_id),
+        model_id_judging TEXT REFERENCES model_infos (model_id),
+        latency REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER
+    )
+    """,
+    "fact_judgements":
+    """
+    CREATE TABLE fact_judgements (
+        judgement_id TEXT REFERENCES dim_judgements (judgement_id),
+        Categories TEXT,
+        Team_ID TEXT,
+        Score REAL,
+        Rational TEXT,
+        PRIMARY KEY (judgement_id, Categories, Team_ID)
+    )
+    """,
+    # Aggregates of the scores of each judge and category, kept up to date by
+    # the TRIGGERS below so that normalising the scores needs no full scan
+    "judge_score_stats":
+    """
+    CREATE TABLE judge_score_stats (
+        model_id_judging TEXT REFERENCES model_infos (model_id),
+        Categories TEXT,
+        n_scores INTEGER,
+        sum_score REAL,
+        sum_sq_score REAL,
+        min_score REAL,
+        max_score REAL,
+        PRIMARY KEY (model_id_judging, Categories)
+    )
+    """,
+    "dim_public":
+    """
+    CREATE TABLE dim_public (
+        public_voting_id TEXT PRIMARY KEY,
+        discourse_id TEXT REFERENCES dim_discourse (discourse_id),
+        public_model_id TEXT REFERENCES model_infos (model_id),
+        judgement_ids array,
+        latency REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER
+    )
+    """,
+    "fact_public":
+    """
+    CREATE TABLE fact_public (
+        public_voting_id TEXT PRIMARY KEY REFERENCES dim_public (public_voting_id),
+        Judgement_ID TEXT
+    )
+    """,
+    "pipeline_jobs":
+    """
+    CREATE TABLE pipeline_jobs (
+        job_id TEXT PRIMARY KEY,
+        stage TEXT,
+        payload TEXT,
+        status TEXT,
+        attempts INTEGER,
+        error TEXT,
+        created_at REAL,
+        updated_at REAL,
+        worker_id TEXT,
+        lease_expires REAL
+    )
+    """,
+    # Arguments of the debates in progress, moved to fact_discourse once complete
+    "debate_checkpoints":
+    """
+    CREATE TABLE debate_checkpoints (
+        discourse_id TEXT,
+        ith_argument INTEGER,
+        Argument TEXT,
+        latency REAL,
+        time_to_first_token REAL,
+        tokens_per_second REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        PRIMARY KEY (discourse_id, ith_argument)
+    )
+    """,
+}
+
+# Indexes covering the joins of the load_* queries and the "already done" lookups
+INDEXES = {
+    "model_infos": {
+        "idx_model_infos_model_entity": ["model_entity", "model_id"],
+    },
+    "topics": {
+        "idx_topics_model_id": ["model_id"],
+    },
+    "dim_discourse": {
+        "idx_dim_discourse_topic_pairing": ["topic_id", "model_proposing", "model_opposing"],
+        "idx_dim_discourse_model_proposing": ["model_proposing"],
+        "idx_dim_discourse_model_opposing": ["model_opposing"],
+        "idx_dim_discourse_tournament_id": ["tournament_id"],
+    },
+    "fact_discourse": {
+        "idx_fact_discourse_discourse_id": ["discourse_id", "ith_argument"],
+    },
+    "dim_judgements": {
+        "idx_dim_judgements_discourse_judge": ["discourse_id", "model_id_judging"],
+        "idx_dim_judgements_model_id_judging": ["model_id_judging"],
+    },
+    "fact_judgements": {
+        "idx_fact_judgements_team_id": ["Team_ID"],
+    },
+    "dim_public": {
+        "idx_dim_public_discourse_public": ["discourse_id", "public_model_id"],
+    },
+    "fact_public": {
+        "idx_fact_public_judgement_id": ["Judgement_ID"],
+    },
+    "pipeline_jobs": {
+        "idx_pipeline_jobs_status_stage": ["status", "stage", "created_at"],
+        "idx_pipeline_jobs_lease_expires": ["status", "lease_expires"],
+    },
+}
+
+# Statements upgrading a database from version i to i+1, for i >= 1
+MIGRATIONS = {
+    1: [
+        "ALTER TABLE fact_discourse ADD COLUMN latency REAL",
+        "ALTER TABLE fact_discourse ADD COLUMN time_to_first_token REAL",
+        "ALTER TABLE fact_discourse ADD COLUMN tokens_per_second REAL",
+    ],
+    2: [
+        "ALTER TABLE dim_discourse ADD COLUMN tournament_id TEXT",
+        "ALTER TABLE fact_discourse ADD COLUMN prompt_tokens INTEGER",
+        "ALTER TABLE fact_discourse ADD COLUMN completion_tokens INTEGER",
+        "ALTER TABLE dim_judgements ADD COLUMN latency REAL",
+        "ALTER TABLE dim_judgements ADD COLUMN prompt_tokens INTEGER",
+        "ALTER TABLE dim_judgements ADD COLUMN completion_tokens INTEGER",
+        "ALTER TABLE dim_public ADD COLUMN latency REAL",
+        "ALTER TABLE dim_public ADD COLUMN prompt_tokens INTEGER",
+        "ALTER TABLE dim_public ADD COLUMN completion_tokens INTEGER",
+    ],
+    3: [
+        """
+        CREATE TABLE pipeline_jobs (
+            job_id TEXT PRIMARY KEY,
+            stage TEXT,
+            payload TEXT,
+            status TEXT,
+            attempts INTEGER,
+            error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+        """,
+        TABLES["debate_checkpoints"],
+    ],
+    4: [
+        "ALTER TABLE pipeline_jobs ADD COLUMN worker_id TEXT",
+        "ALTER TABLE pipeline_jobs ADD COLUMN lease_expires REAL",
+    ],
+    5: [
+        TABLES["judge_score_stats"],
+    ],
+    # New triggers only, created and accounted below as on every migration
+    6: [],
+}
+
+_ADD_JUDGE_SCORE_STATS = \
+"""
+ON CONFLICT (model_id_judging, Categories) DO UPDATE SET
+    n_scores = n_scores + excluded.n_scores,
+    sum_score = sum_score + excluded.sum_score,
+    sum_sq_score = sum_sq_score + excluded.sum_sq_score,
+    min_score = MIN(min_score, excluded.min_score),
+    max_score = MAX(max_score, excluded.max_score)
+"""
+
+# Scores of fact_judgements aggregated by judge and category
+_JUDGE_SCORE_STATS = \
+"""
+SELECT
+    dim.model_id_judging,
+    fact.Categories,
+    COUNT(fact.Score),
+    SUM(fact.Score),
+    SUM(fact.Score*fact.Score),
+    MIN(fact.Score),
+    MAX(fact.Score)
+FROM 'fact_judgements' AS fact
+JOIN 'dim_judgements' AS dim
+    USING (judgement_id)
+WHERE {condition}
+GROUP BY
+    dim.model_id_judging,
+    fact.Categories
+"""
+
+# Min and max of the scores of a judge and category, looked up again when a
+# score leaving the aggregates may have been one of them
+_JUDGE_SCORE_MIN_MAX = \
+"""
+UPDATE judge_score_stats SET (min_score, max_score) = (
+    SELECT MIN(fact.Score), MAX(fact.Score)
+    FROM 'fact_judgements' AS fact
+    JOIN 'dim_judgements' AS dim
+        USING (judgement_id)
+    WHERE dim.model_id_judging = judge_score_stats.model_id_judging
+        AND fact.Categories = judge_score_stats.Categories)
+WHERE {condition};
+DELETE FROM judge_score_stats WHERE n_scores <= 0;
+"""
+
+# Trigger bodies accounting a fact_judgements row (NEW) or taking it out (OLD)
+_ADD_SCORE = \
+f"""
+INSERT INTO judge_score_stats
+SELECT model_id_judging, NEW.Categories, 1, NEW.Score, NEW.Score*NEW.Score, NEW.Score, NEW.Score
+FROM 'dim_judgements'
+WHERE judgement_id = NEW.judgement_id
+    AND NEW.Score IS NOT NULL
+{_ADD_JUDGE_SCORE_STATS};
+"""
+
+_OLD_SCORE_STATS = \
+"""
+Categories = OLD.Categories
+    AND model_id_judging = (SELECT model_id_judging FROM 'dim_judgements'
+                            WHERE judgement_id = OLD.judgement_id)
+"""
+
+_SUBTRACT_SCORE = \
+f"""
+UPDATE judge_score_stats SET
+    n_scores = n_scores - 1,
+    sum_score = sum_score - OLD.Score,
+    sum_sq_score = sum_sq_score - OLD.Score*OLD.Score
+WHERE OLD.Score IS NOT NULL
+    AND {_OLD_SCORE_STATS};
+{_JUDGE_SCORE_MIN_MAX.format(condition=f"{_OLD_SCORE_STATS} AND OLD.Score IN (min_score, max_score)")}
+"""
+
+# Trigger bodies accounting the scores of a dim_judgements row (NEW) or taking them out (OLD)
+_ADD_JUDGEMENT = \
+f"""
+INSERT INTO judge_score_stats
+{_JUDGE_SCORE_STATS.format(condition="judgement_id = NEW.judgement_id AND fact.Score IS NOT NULL")}
+{_ADD_JUDGE_SCORE_STATS};
+"""
+
+_OLD_JUDGEMENT_SCORES = \
+"""
+SELECT {aggregate} FROM 'fact_judgements'
+WHERE judgement_id = OLD.judgement_id
+    AND Categories = judge_score_stats.Categories
+"""
+
+_OLD_JUDGEMENT_STATS = \
+"""
+model_id_judging = OLD.model_id_judging
+    AND Categories IN (SELECT Categories FROM 'fact_judgements'
+                       WHERE judgement_id = OLD.judgement_id AND Score IS NOT NULL)
+"""
+
+_SUBTRACT_JUDGEMENT = \
+f"""
+UPDATE judge_score_stats SET
+    n_scores = n_scores - ({_OLD_JUDGEMENT_SCORES.format(aggregate="COUNT(Score)")}),
+    sum_score = sum_score - ({_OLD_JUDGEMENT_SCORES.format(aggregate="TOTAL(Score)")}),
+    sum_sq_score = sum_sq_score - ({_OLD_JUDGEMENT_SCORES.format(aggregate="TOTAL(Score*Score)")})
+WHERE {_OLD_JUDGEMENT_STATS};
+{_JUDGE_SCORE_MIN_MAX.format(condition=_OLD_JUDGEMENT_STATS)}
+"""
+
+# Triggers, created again on each migration. A score is accounted once both
+# its fact_judgements and dim_judgements rows exist, whichever comes first.
+# Re-parsed judgements are deleted then inserted again; updates take the old
+# row out and account the new one.
+TRIGGERS = {
+    "judge_score_stats_insert_score":
+    f"""
+    CREATE TRIGGER judge_score_stats_insert_score
+    AFTER INSERT ON fact_judgements
+    BEGIN
+        {_ADD_SCORE}
+    END
+    """,
+    "judge_score_stats_delete_score":
+    f"""
+    CREATE TRIGGER judge_score_stats_delete_score
+    AFTER DELETE ON fact_judgements
+    BEGIN
+        {_SUBTRACT_SCORE}
+    END
+    """,
+    "judge_score_stats_update_score":
+    f"""
+    CREATE TRIGGER judge_score_stats_update_score
+    AFTER UPDATE OF judgement_id, Categories, Score ON fact_judgements
+    BEGIN
+        {_SUBTRACT_SCORE}
+        {_ADD_SCORE}
+    END
+    """,
+    "judge_score_stats_insert_judgement":
+    f"""
+    CREATE TRIGGER judge_score_stats_insert_judgement
+    AFTER INSERT ON dim_judgements
+    BEGIN
+        {_ADD_JUDGEMENT}
+    END
+    """,
+    "judge_score_stats_delete_judgement":
+    f"""
+    CREATE TRIGGER judge_score_stats_delete_judgement
+    AFTER DELETE ON dim_judgements
+    BEGIN
+        {_SUBTRACT_JUDGEMENT}
+    END
+    """,
+    "judge_score_stats_update_judgement":
+    f"""
+    CREATE TRIGGER judge_score_stats_update_judgement
+    AFTER UPDATE OF judgement_id, model_id_judging ON dim_judgements
+    BEGIN
+        {_SUBTRACT_JUDGEMENT}
+        {_ADD_JUDGEMENT}
+    END
+    """,
+}
+
+# Views, created again on each migration
+VIEWS = {
+    # One row per call to a model: the debate turns, judgements and votes
+    "usage_calls":
+    """
+    CREATE VIEW usage_calls AS
+    SELECT
+        'debate' AS stage,
+        dim.tournament_id,
+        fact.discourse_id,
+        model.model_entity,
+        fact.latency,
+        fact.prompt_tokens,
+        fact.completion_tokens
+    FROM 'fact_discourse' AS fact
+    LEFT JOIN 'dim_discourse' AS dim
+        USING (discourse_id)
+    LEFT JOIN 'model_infos' AS model
+        ON fact.model_speaking = model.model_id
+    UNION ALL
+    SELECT
+        'judgement' AS stage,
+        dim.tournament_id,
+        judg.discourse_id,
+        model.model_entity,
+        judg.latency,
+        judg.prompt_tokens,
+        judg.completion_tokens
+    FROM 'dim_judgements' AS judg
+    LEFT JOIN 'dim_discourse' AS dim
+        USING (discourse_id)
+    LEFT JOIN 'model_infos' AS model
+        ON judg.model_id_judging = model.model_id
+    UNION ALL
+    SELECT
+        'public' AS stage,
+        dim.tournament_id,
+        public.discourse_id,
+        model.model_entity,
+        public.latency,
+        public.prompt_tokens,
+        public.completion_tokens
+    FROM 'dim_public' AS public
+    LEFT JOIN 'dim_discourse' AS dim
+        USING (discourse_id)
+    LEFT JOIN 'model_infos' AS model
+        ON public.public_model_id = model.model_id
+    """,
+}
+
+# Columns usage may be aggregated by
+USAGE_KEYS = ('stage', 'model_entity', 'tournament_id', 'discourse_id')
+
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000, # in KiB
+    "mmap_size": 268435456,
+    "busy_timeout": 5000, # in ms
+}
+
+def frame2rows(frame: pd.DataFrame) -> List[tuple]:
+    # Plain python objects, as sqlite3 can not bind numpy scalars
+    values = frame.astype(object).where(frame.notna(), None)
+    return list(values.itertuples(index=False, name=None))
+
+def insert_frame(connection, table_name: str, frame: pd.DataFrame):
+    columns = ', '.join(f'"{c}"' for c in frame.columns)
+    placeholders = ', '.join('?'*frame.shape[1])
+    connection.executemany(
+        f"INSERT INTO '{table_name}' ({columns}) VALUES ({placeholders})",
+        frame2rows(frame))
+
+def write_frames(connection, tables: Dict[str, pd.DataFrame]):
+    """Insert all frames in a single transaction"""
+    with connection:
+        for table_name, frame in tables.items():
+            insert_frame(connection, table_name, frame)
+
+class ResultsWriter():
+    """Buffer results and write them in batched transactions.
+
+    The frames given to one write call, e.g. the dim and fact tables of a
+    debate, are always committed together. Buffered results are flushed
+    once batch_size rows are pending or flush_interval seconds went by,
+    on close and at interpreter exit. Both are only checked on write: an
+    idle writer keeps its rows in memory until the next write or flush.
+    on_flushed of a write call is given None once its frames are
+    committed, or the error of their transaction.
+    """
+    def __init__(self, connection, batch_size: int = 500, flush_interval: Optional[float] = 10.):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[Tuple[Dict[str, pd.DataFrame], Optional[Callable]]] = []
+        self._n_rows = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    def write(self, tables: Dict[str, pd.DataFrame],
+              on_flushed: Optional[Callable[[Optional[BaseException]], None]] = None):
+        with self._lock:
+            self._pending.append((tables, on_flushed))
+            self._n_rows += sum(frame.shape[0] for frame in tables.values())
+            if self._n_rows >= self.batch_size:
+                self.flush()
+            elif self.flush_interval is not None \
+                    and time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._n_rows = self._pending, [], 0
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            merged = {}
+            for tables, _ in pending:
+                for table_name, frame in tables.items():
+                    merged.setdefault(table_name, []).append(frame)
+            try:
+                write_frames(self.connection, {t: pd.concat(f) for t, f in merged.items()})
+            except sqlite3.DatabaseError:
+                # Keep the valid results of the batch, one write call per transaction
+                errors = []
+                for tables, on_flushed in pending:
+                    try:
+                        write_frames(self.connection, tables)
+                    except sqlite3.DatabaseError as error:
+                        errors.append(error)
+                        self._flushed(on_flushed, error)
+                    else:
+                        self._flushed(on_flushed, None)
+                if errors:
+                    raise errors[0]
+                return
+            except Exception as error:
+                for _, on_flushed in pending:
+                    self._flushed(on_flushed, error)
+                raise
+            for _, on_flushed in pending:
+                self._flushed(on_flushed, None)
+
+    @staticmethod
+    def _flushed(on_flushed: Optional[Callable], error: Optional[BaseException]):
+        if on_flushed is not None:
+            on_flushed(error)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 class IODataBase():
-    def __init__(self, db_name = 'results/dataset.db'):
+    def __init__(self, db_name = 'results/dataset.db', enforce_foreign_keys=False,
+                 columnar_dir: Optional[str] = None):
         self.connection = sqlite3.connect(db_name)
-
+        for pragma, value in PRAGMAS.items():
+            self.connection.execute(f"PRAGMA {pragma} = {value}")
+        # Off by default: rows upgraded from unversioned databases were copied
+        # unchecked, and judgement scores may be written before their judgement
+        self.connection.execute(f"PRAGMA foreign_keys = {int(enforce_foreign_keys)}")
+        self.migrate()
+        # Analyses read from the parquet export, refreshed on each load
+        self.columnar = None
+        if columnar_dir is not None:
+            from ai_debater.columnar import ColumnarStore
+            self.columnar = ColumnarStore(columnar_dir)
 
     @property
     def connection(self):
@@ -37,6 +602,9 @@ class IODataBase():
     def connection(self, cnx):
         self._cnx = cnx
 
+    def writer(self, batch_size: int = 500, flush_interval: Optional[float] = 10.) -> ResultsWriter:
+        return ResultsWriter(self.connection, batch_size=batch_size, flush_interval=flush_interval)
+
     @property
     def table_names(self):
         tables_names = pd.read_sql(
@@ -44,6 +612,162 @@ class IODataBase():
             self.connection)
         return tables_names
     
+    def has_table(self, table_name) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND tbl_name=?",
+            (table_name,)).fetchone()
+        return row is not None
+
+    @property
+    def schema_version(self) -> int:
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def table_columns(self, table_name) -> list:
+        return [row[1] for row in self.connection.execute(f"PRAGMA table_info('{table_name}')")]
+
+    def migrate(self):
+        version = self.schema_version
+        if version == SCHEMA_VERSION:
+            return
+        if version > SCHEMA_VERSION:
+            raise NameError(f"Database schema {version} is newer than supported {SCHEMA_VERSION}")
+        self.connection.execute("BEGIN")
+        try:
+            if version == 0:
+                self._upgrade_unversioned()
+            else:
+                for from_version in range(version, SCHEMA_VERSION):
+                    for sql_statement in MIGRATIONS[from_version]:
+                        self.connection.execute(sql_statement)
+            self._create_indexes()
+            self._create_views()
+            self._create_triggers()
+            # The rows copied or inserted before the triggers are accounted
+            self._rebuild_judge_score_stats()
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def _upgrade_unversioned(self):
+        # Tables created by DataFrame.to_sql are moved aside first, so that
+        # renaming them does not rewrite the foreign keys of the new tables.
+        legacy_tables = [t for t in TABLES if self.has_table(t)]
+        for table_name in legacy_tables:
+            self.connection.execute(f"ALTER TABLE '{table_name}' RENAME TO '{table_name}_legacy'")
+        for sql_statement in TABLES.values():
+            self.connection.execute(sql_statement)
+        for table_name in legacy_tables:
+            legacy_columns = set(self.table_columns(f"{table_name}_legacy"))
+            columns = ', '.join(c for c in self.table_columns(table_name) if c in legacy_columns)
+            # Duplicated keys, e.g. a model_infos saved twice, are kept once
+            n_legacy = self.connection.execute(f"SELECT COUNT(*) FROM '{table_name}_legacy'").fetchone()[0]
+            n_kept = self.connection.execute(
+                f"""
+                INSERT OR IGNORE INTO '{table_name}' ({columns})
+                SELECT {columns} FROM '{table_name}_legacy'
+                """).rowcount
+            if n_kept < n_legacy:
+                warnings.warn(f"{n_legacy - n_kept} rows of {table_name} duplicating a key were dropped")
+            self.connection.execute(f"DROP TABLE '{table_name}_legacy'")
+
+    def _create_indexes(self):
+        for table_name, indexes in INDEXES.items():
+            for index_name, columns in indexes.items():
+                self.connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} ON '{table_name}' ({', '.join(columns)})")
+
+    def _create_views(self):
+        for view_name, sql_statement in VIEWS.items():
+            self.connection.execute(f"DROP VIEW IF EXISTS {view_name}")
+            self.connection.execute(sql_statement)
+
+    def _create_triggers(self):
+        for trigger_name, sql_statement in TRIGGERS.items():
+            self.connection.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+            self.connection.execute(sql_statement)
+
+    def _rebuild_judge_score_stats(self):
+        self.connection.execute("DELETE FROM judge_score_stats")
+        self.connection.execute(
+            "INSERT INTO judge_score_stats " + _JUDGE_SCORE_STATS.format(condition="fact.Score IS NOT NULL"))
+
+    def rebuild_judge_score_stats(self):
+        """Recompute judge_score_stats from fact_judgements, e.g. after writes with the triggers dropped"""
+        with self.connection:
+            self._rebuild_judge_score_stats()
+
+    def _exists(self, sql_statement, parameters) -> bool:
+        return self.connection.execute(sql_statement, parameters).fetchone() is not None
+
+    def register_model(self, model) -> str:
+        """Reuse the model_id of the model_entity, saving the model_infos of a new one"""
+        # Under the write lock, for all workers to agree on the model_id
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute(
+                "SELECT model_id FROM model_infos WHERE model_entity = ? ORDER BY creation_date, model_id LIMIT 1",
+                (model.model_entity,)).fetchone()
+            if row is not None:
+                model._model_id = row[0]
+            else:
+                insert_frame(self.connection, "model_infos",
+                             pd.DataFrame([dict(model_id=model.model_id(), **model.metainfo)]))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        return model.model_id()
+
+    def is_debated(self, topic_id, model_proposing_entity, model_opposing_entity) -> bool:
+        sql_statement = \
+        """
+        SELECT 1
+        FROM 'dim_discourse' AS discourse
+        JOIN 'model_infos' AS model_infos_prop
+            ON discourse.model_proposing = model_infos_prop.model_id
+        JOIN 'model_infos' AS model_infos_oppo
+            ON discourse.model_opposing = model_infos_oppo.model_id
+        WHERE
+            discourse.topic_id = ?
+            AND model_infos_prop.model_entity = ?
+            AND model_infos_oppo.model_entity = ?
+        LIMIT 1
+        """
+        return self._exists(sql_statement,
+                            (topic_id, model_proposing_entity, model_opposing_entity))
+
+    def is_judged(self, discourse_id, judge_model_entity) -> bool:
+        sql_statement = \
+        """
+        SELECT 1
+        FROM 'dim_judgements' AS judg
+        JOIN 'model_infos' AS model_infos
+            ON judg.model_id_judging = model_infos.model_id
+        WHERE
+            judg.discourse_id = ?
+            AND model_infos.model_entity = ?
+        LIMIT 1
+        """
+        return self._exists(sql_statement,
+                            (discourse_id, judge_model_entity))
+
+    def has_voted(self, discourse_id, public_model_entity) -> bool:
+        sql_statement = \
+        """
+        SELECT 1
+        FROM 'dim_public' AS public
+        JOIN 'model_infos' AS model_infos
+            ON public.public_model_id = model_infos.model_id
+        WHERE
+            public.discourse_id = ?
+            AND model_infos.model_entity = ?
+        LIMIT 1
+        """
+        return self._exists(sql_statement,
+                            (discourse_id, public_model_entity))
+
     def table2pandas(self, table_name, condition="True"):
         sql_statement = \
         f"""
@@ -108,6 +832,37 @@ class IODataBase():
         """.format(discourse_id)
         return pd.read_sql(sql_statement, self.connection)
 
+    def _select_discourses(self, discourse_ids) -> str:
+        """Join condition restricting a query to discourse_ids, None for all"""
+        if discourse_ids is None:
+            return ""
+        # A temporary table rather than an IN clause, as there may be more
+        # discourses than sqlite allows parameters
+        with self.connection:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS selected_discourses (discourse_id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM selected_discourses")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO selected_discourses VALUES (?)",
+                [(str(d),) for d in discourse_ids])
+        return "JOIN selected_discourses USING (discourse_id)"
+
+    def load_discourses(self, discourse_ids=None) -> pd.DataFrame:
+        sql_statement = \
+        f"""
+        SELECT
+            fact.*,
+            model.model_entity AS model_speaking_entity
+        FROM 'fact_discourse' AS fact
+        {self._select_discourses(discourse_ids)}
+        LEFT JOIN 'model_infos' AS model
+            ON fact.model_speaking = model.model_id
+        ORDER BY
+            fact.discourse_id,
+            fact.ith_argument
+        """
+        return pd.read_sql(sql_statement, self.connection)
+
     def load_enriched_judgements(self):
         dim_judgements = None
         if 'dim_judgements' in self.table_names.tbl_name.values:
@@ -140,10 +895,11 @@ class IODataBase():
             dim_public = pd.read_sql(sql_statement, self.connection)
         return dim_public
 
-    def load_judgements_for_analyses(self):
-        sql_statement = \
-        """
-        WITH enriched_judegement AS (
+    @staticmethod
+    def _enriched_judgements(condition="True") -> str:
+        """One row per score, with the entities of the judge, teams and topic creator"""
+        return \
+            f"""
             SELECT
                 fact.Categories,
                 fact.Score,
@@ -173,35 +929,98 @@ class IODataBase():
                 ON dim_discourse.model_proposing = proposing.model_id
             LEFT JOIN 'model_infos' AS opposing
                 ON dim_discourse.model_opposing = opposing.model_id
-        ),
+            WHERE {condition}
+            """
 
-        minmax_judges AS (
-            SELECT
-                judge_entity,
-                Categories,
-                MIN(Score) AS min_score,
-                MAX(Score) AS max_score
-            FROM enriched_judegement
-            GROUP BY
-                judge_entity,
-                Categories
-        ),
-
-        normalised_score AS (
-            SELECT
-                src.*,
-                (src.Score-mm.min_score)/(mm.max_score - mm.min_score) AS Normalised_score
-            FROM enriched_judegement AS src
-            LEFT JOIN minmax_judges AS mm
-                USING ( judge_entity, Categories)
-        )
+    def load_judge_score_stats(self) -> pd.DataFrame:
+        """Number, mean, standard deviation, min and max of the scores of each judge_entity and category"""
+        sql_statement = \
+        """
+        SELECT
+            judge.model_entity AS judge_entity,
+            stats.Categories,
+            SUM(stats.n_scores) AS n_scores,
+            SUM(stats.sum_score) AS sum_score,
+            SUM(stats.sum_sq_score) AS sum_sq_score,
+            MIN(stats.min_score) AS min_score,
+            MAX(stats.max_score) AS max_score
+        FROM 'judge_score_stats' AS stats
+        LEFT JOIN 'model_infos' AS judge
+            ON stats.model_id_judging = judge.model_id
+        GROUP BY
+            judge.model_entity,
+            stats.Categories
+        """
+        stats = pd.read_sql(sql_statement, self.connection,
+                            dtype={c: float for c in ['sum_score', 'sum_sq_score', 'min_score', 'max_score']})
+        stats['mean_score'] = stats.sum_score/stats.n_scores
+        mean_sq_score = stats.pop('sum_sq_score')/stats.n_scores
+        variance = mean_sq_score - stats.mean_score**2
+        # Below the rounding errors of the sums, the scores are all equal
+        stats['std_score'] = np.sqrt(variance.where(variance > 1e-12*mean_sq_score))
+        return stats.drop(columns='sum_score')[
+            ['judge_entity', 'Categories', 'n_scores', 'mean_score', 'std_score', 'min_score', 'max_score']]
+
+    def load_judgements_for_analyses(self):
+        """Scores with Normalised_score, rescaled by the min and max of their judge and category,
+        and Z_score, standardised by the mean and standard deviation of their judge and category"""
+        if self.columnar is not None:
+            return self.columnar.load_judgements_for_analyses(self)
+        judgements = pd.read_sql(self._enriched_judgements(), self.connection)
+        stats = self.load_judge_score_stats()
+        judgements = judgements.merge(stats, how='left', on=['judge_entity', 'Categories'])
+        # As in sql, a division by zero is null
+        judgements['Normalised_score'] = (judgements.Score - judgements.min_score) \
+            / (judgements.max_score - judgements.min_score).replace(0, np.nan)
+        judgements['Z_score'] = (judgements.Score - judgements.mean_score)/judgements.std_score
+        return judgements.drop(columns=[c for c in stats.columns if c not in ('judge_entity', 'Categories')])
+
+    def load_usage(self, by=('model_entity', 'stage'),
+                   prices: Optional[Dict[str, Tuple[float, float]]] = None) -> pd.DataFrame:
+        """Calls, tokens and latency aggregated by any of USAGE_KEYS.
 
-        SELECT * FROM normalised_score
+        prices maps a model_entity to its (prompt, completion) price per
+        million tokens; the cost column is then added.
         """
-        return pd.read_sql(sql_statement, self.connection)
+        by = [by] if isinstance(by, str) else list(by)
+        unknown = set(by) - set(USAGE_KEYS)
+        if unknown:
+            raise NameError(f"Can not aggregate usage by {unknown}, expected some of {USAGE_KEYS}")
+        # Always by model_entity first, as prices are per model
+        keys = list(dict.fromkeys(by + ['model_entity']))
+        sql_statement = \
+        f"""
+        SELECT
+            {', '.join(keys)},
+            COUNT(*) AS n_calls,
+            SUM(prompt_tokens) AS prompt_tokens,
+            SUM(completion_tokens) AS completion_tokens,
+            SUM(latency) AS total_latency,
+            MAX(latency) AS max_latency
+        FROM usage_calls
+        GROUP BY {', '.join(keys)}
+        """
+        usage = pd.read_sql(sql_statement, self.connection,
+                            dtype={c: float for c in ['prompt_tokens', 'completion_tokens',
+                                                      'total_latency', 'max_latency']})
+        if prices is not None:
+            prompt_price = usage.model_entity.map({k: v[0] for k, v in prices.items()})
+            completion_price = usage.model_entity.map({k: v[1] for k, v in prices.items()})
+            usage['cost'] = (usage.prompt_tokens*prompt_price
+                             + usage.completion_tokens*completion_price)/1e6
+        grouped = usage.groupby(by, dropna=False)
+        # Unknown token counts or prices stay unknown rather than summing to 0
+        aggregated = grouped[[c for c in usage.columns
+                              if c not in keys and c != 'max_latency']].sum(min_count=1)
+        aggregated['max_latency'] = grouped.max_latency.max()
+        usage = aggregated.reset_index()
+        usage['mean_latency'] = usage.total_latency/usage.n_calls
+        return usage
 
-    def load_votes_for_analyses(self):
-        sql_statement = """
+    @staticmethod
+    def _votes(condition="True") -> str:
+        return \
+        f"""
         SELECT
             fact_public.Judgement_ID AS voted_for_judgement_id,
             public.discourse_id,
@@ -217,8 +1036,11 @@ class IODataBase():
             ON fact_public.Judgement_ID = judg.judgement_id
         LEFT JOIN 'model_infos' as model_judgement
             ON judg.model_id_judging = model_judgement.model_id
+        WHERE {condition}
         """
-        public_voting = pd.read_sql(sql_statement, self.connection)
+
+    @staticmethod
+    def _add_voted_for(public_voting: pd.DataFrame) -> pd.DataFrame:
         public_voting.judgement_ids = public_voting.judgement_ids.apply(convert_array)
         public_voting.loc[public_voting.voted_for_judgement_model_entity.isna(), 
             "voted_for_judgement_model_entity"] = "Failed to vote"
@@ -234,14 +1056,21 @@ class IODataBase():
             }
             ith = nth[voted_for_ith]
             return f'{ith}_judgement'
-        public_voting['voted_for'] = public_voting.apply(voted_for, axis=1)
+        public_voting['voted_for'] = public_voting.apply(voted_for, axis=1) \
+            if len(public_voting) else pd.Series(dtype=object)
         return public_voting
+
+    def load_votes_for_analyses(self):
+        if self.columnar is not None:
+            return self.columnar.load_votes_for_analyses(self)
+        public_voting = pd.read_sql(self._votes(), self.connection)
+        return self._add_voted_for(public_voting)
     
-    def load_judgements(self):
+    def load_judgements(self, discourse_ids=None):
         judgements = None
         if 'fact_judgements' in self.table_names.tbl_name.values:
             sql_statement = \
-            """
+            f"""
             SELECT
                 fact.Categories,
                 fact.Team_ID,
@@ -255,6 +1084,7 @@ class IODataBase():
             FROM 'fact_judgements' AS fact
             LEFT JOIN 'dim_judgements' as dim
                 USING (judgement_id)
+            {self._select_discourses(discourse_ids)}
             LEFT JOIN 'model_infos' as model_infos
                 ON dim.model_id_judging = model_infos.model_id
             LEFT JOIN 'model_infos' AS team
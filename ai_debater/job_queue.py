@@ -0,0 +1,198 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from contextlib import contextmanager
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+# Status of a job along its life
+JOB_STATUSES = ('pending', 'running', 'done', 'failed')
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class JobQueue():
+    """Work items of the pipeline, persisted in the pipeline_jobs table.
+
+    A job is identified by its stage and payload, so that enqueuing the same
+    work twice is a no-op. A job is claimed by one worker at a time with a
+    lease, that the worker renews while it runs the job. The job is marked
+    done in the transaction writing its results. A job whose lease expired,
+    e.g. its worker died, is claimed again by another worker.
+
+    Workers may be processes of several machines as long as they share the
+    database file, which requires a filesystem with working sqlite locks.
+    """
+    def __init__(self, connection, max_attempt: int = 3,
+                 worker_id: Optional[str] = None, lease_seconds: float = 900.):
+        self.connection = connection
+        self.max_attempt = max_attempt
+        self.worker_id = default_worker_id() if worker_id is None else worker_id
+        self.lease_seconds = lease_seconds
+
+    @staticmethod
+    def job_id(stage: str, payload: Dict) -> str:
+        return stage + ':' + json.dumps(payload, sort_keys=True)
+
+    def enqueue(self, stage: str, payloads: List[Dict]) -> int:
+        """Add the jobs not queued yet, returns the number added"""
+        now = time.time()
+        with self.connection:
+            n_jobs = self.connection.total_changes
+            self.connection.executemany(
+                """
+                INSERT OR IGNORE INTO pipeline_jobs (job_id, stage, payload, status, attempts, created_at, updated_at)
+                VALUES (?, ?, ?, 'pending', 0, ?, ?)
+                """,
+                [(self.job_id(stage, payload), stage, json.dumps(payload, sort_keys=True), now, now)
+                 for payload in payloads])
+            return self.connection.total_changes - n_jobs
+
+    @staticmethod
+    def _stage_condition(stage: Union[None, str, Iterable[str]]) -> Tuple[str, tuple]:
+        if stage is None:
+            return "", ()
+        stages = (stage,) if isinstance(stage, str) else tuple(stage)
+        return f"AND stage IN ({', '.join('?'*len(stages))})", stages
+
+    def claim(self, stage: Union[None, str, Iterable[str]] = None) -> Optional[Tuple[str, str, Dict]]:
+        """Next pending or lost job, as (job_id, stage, payload), leased to this worker"""
+        condition, parameters = self._stage_condition(stage)
+        # BEGIN IMMEDIATE takes the write lock, no other worker claims the same job
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            # Jobs which lost their worker too often are not tried again
+            self.connection.execute(
+                f"""
+                UPDATE pipeline_jobs
+                SET status = 'failed', error = 'Lease expired', updated_at = ?
+                WHERE status = 'running' AND lease_expires < ? AND attempts >= ? {condition}
+                """, (now, now, self.max_attempt) + parameters)
+            row = self.connection.execute(
+                f"""
+                SELECT job_id, stage, payload FROM pipeline_jobs
+                WHERE (status = 'pending' OR (status = 'running' AND lease_expires < ?)) {condition}
+                ORDER BY created_at, job_id
+                LIMIT 1
+                """, (now,) + parameters).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    """
+                    UPDATE pipeline_jobs
+                    SET status = 'running', attempts = attempts + 1, updated_at = ?,
+                        worker_id = ?, lease_expires = ?
+                    WHERE job_id = ?
+                    """, (now, self.worker_id, now + self.lease_seconds, row[0]))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def renew(self, job_id: str, connection=None) -> bool:
+        """Extend the lease of a job of this worker, False if it was lost"""
+        connection = self.connection if connection is None else connection
+        with connection:
+            return connection.execute(
+                """
+                UPDATE pipeline_jobs SET lease_expires = ?
+                WHERE job_id = ? AND worker_id = ? AND status = 'running'
+                """, (time.time() + self.lease_seconds, job_id, self.worker_id)).rowcount == 1
+
+    @contextmanager
+    def keep_lease(self, *job_ids: str):
+        """Renew the lease of job_ids from a thread for as long as the context runs"""
+        db_name = self.connection.execute("PRAGMA database_list").fetchone()[2]
+        if not db_name:
+            # In-memory databases are not shared, there is no other worker
+            yield
+            return
+        stop = threading.Event()
+        def renew():
+            connection = sqlite3.connect(db_name, timeout=60)
+            try:
+                while not stop.wait(self.lease_seconds/3):
+                    for job_id in job_ids:
+                        self.renew(job_id, connection)
+            finally:
+                connection.close()
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def mark_done(self, job_id: str):
+        """To be called within the transaction saving the results of the job"""
+        self.connection.execute(
+            """
+            UPDATE pipeline_jobs SET status = 'done', error = NULL, lease_expires = NULL, updated_at = ?
+            WHERE job_id = ?
+            """, (time.time(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        """Back to pending, or failed once max_attempt attempts were made.
+
+        Jobs since claimed by another worker, or done, are left as they are.
+        """
+        with self.connection:
+            self.connection.execute(
+                """
+                UPDATE pipeline_jobs
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    error = ?, lease_expires = NULL, updated_at = ?
+                WHERE job_id = ? AND worker_id = ? AND status = 'running'
+                """, (self.max_attempt, error, time.time(), job_id, self.worker_id))
+
+    def recover(self) -> int:
+        """Release all running jobs at once, when no worker is known to be alive"""
+        with self.connection:
+            return self.connection.execute(
+                """
+                UPDATE pipeline_jobs SET status = 'pending', lease_expires = NULL, updated_at = ?
+                WHERE status = 'running'
+                """, (time.time(),)).rowcount
+
+    def retry_failed(self, stage: Optional[str] = None) -> int:
+        condition, parameters = self._stage_condition(stage)
+        with self.connection:
+            return self.connection.execute(
+                f"""
+                UPDATE pipeline_jobs SET status = 'pending', attempts = 0, updated_at = ?
+                WHERE status = 'failed' {condition}
+                """, (time.time(),) + parameters).rowcount
+
+    def n_active(self, stage: Union[None, str, Iterable[str]] = None) -> int:
+        """Number of jobs pending or running"""
+        condition, parameters = self._stage_condition(stage)
+        return self.connection.execute(
+            f"SELECT COUNT(*) FROM pipeline_jobs WHERE status IN ('pending', 'running') {condition}",
+            parameters).fetchone()[0]
+
+    def status(self) -> pd.DataFrame:
+        """Number of jobs per stage and status"""
+        return pd.read_sql(
+            """
+            SELECT stage, status, COUNT(*) AS n_jobs
+            FROM pipeline_jobs
+            GROUP BY stage, status
+            ORDER BY stage, status
+            """, self.connection)
+
+    def workers(self) -> pd.DataFrame:
+        """Jobs running per worker, with the time left on their leases"""
+        return pd.read_sql(
+            """
+            SELECT worker_id, COUNT(*) AS n_jobs, MIN(lease_expires) - ? AS min_lease_left
+            FROM pipeline_jobs
+            WHERE status = 'running'
+            GROUP BY worker_id
+            """, self.connection, params=(time.time(),))
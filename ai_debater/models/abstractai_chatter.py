@@ -1,9 +1,21 @@
-from typing import Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 from abc import ABC, abstractmethod, abstractproperty
 import uuid
 from ai_debater.prompt_engineering import CoStar
+from ai_debater.models.response_cache import ResponseCache
+from ai_debater.models.response_log import ResponseLog
+from ai_debater.models.retry_policy import RetryPolicy, HedgePolicy, metrics, is_transient
+from ai_debater.models.rate_limiter import RateLimiter, estimate_tokens, estimate_messages_tokens
+from ai_debater.models.batch import BatchBackend, write_jsonl
 from typing import Optional, Union
 import pandas as pd
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
 
 import string
 def base_n(num,b=None,numerals=string.digits+string.ascii_letters):
@@ -13,11 +25,30 @@ def base_n(num,b=None,numerals=string.digits+string.ascii_letters):
         or (base_n(num // b, b, numerals).lstrip(numerals[0]) + numerals[num % b])
 
 class BaseAiChatter(ABC):
+    response_cache: Optional[ResponseCache] = None
+    rate_limiter: Optional[RateLimiter] = None
+    response_log: Optional[ResponseLog] = None
+    hedge_policy: Optional[HedgePolicy] = None
 
-    def initialise(self, costar: CoStar, max_attempt=10) -> None:
+    def initialise(self, costar: CoStar, max_attempt=10,
+                   response_cache: Optional[ResponseCache] = None,
+                   retry_policy: Optional[RetryPolicy] = None,
+                   rate_limiter: Optional[RateLimiter] = None,
+                   response_log: Optional[ResponseLog] = None,
+                   hedge_policy: Optional[HedgePolicy] = None) -> None:
         self.init_prompt = costar.generate_prompt()
         self._costar = costar
-        self._max_attempt = max_attempt
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempt=max_attempt)
+        self.retry_policy = retry_policy
+        if response_cache is not None:
+            self.response_cache = response_cache
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        if response_log is not None:
+            self.response_log = response_log
+        # Hedging is per role, e.g. judging only: None turns it off again
+        self.hedge_policy = hedge_policy
 
     def model_id(self) -> str:
         if not hasattr(self, '_model_id'):
@@ -26,20 +57,459 @@ class BaseAiChatter(ABC):
             self._model_id = base_n(uuid_int)
         return self._model_id
     
-    def answer_until_valid(self, messages: List[Dict[str,str]]) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
+    def answer_until_valid(self, messages: List[Dict[str,str]],
+                           stream: bool = False,
+                           on_token: Optional[Callable[[str], None]] = None,
+                           request_id: Optional[str] = None) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
         if not hasattr(self, '_costar'):
             raise NameError('Please initialise with costar')
-        attempt_i = 0
-        while attempt_i < self._max_attempt:
-            answer = self.answer(messages)
-            if self._costar.response_is_valid(answer):                  
-                return self._costar.response2output(answer)
+        policy = self.retry_policy
+        start = time.monotonic()
+        metrics.record(self.model_entity, calls=1)
+        refresh = False
+        for attempt_i in range(policy.max_attempt):
+            if policy.remaining(start) <= 0:
+                break
+            metrics.record(self.model_entity, attempts=1)
+            tic = time.monotonic()
+            checked = None
+            try:
+                if stream or on_token is not None:
+                    # Streamed tokens are forwarded as they come, they are never hedged
+                    answer = self._consume_stream(messages, refresh, on_token)
+                elif self.hedge_policy is not None:
+                    answer, *checked = self._hedged_answer(messages, refresh)
+                else:
+                    answer = self.answer(messages, refresh=refresh)
+            except Exception as error:
+                if not is_transient(error):
+                    raise
+                metrics.record(self.model_entity, transient_errors=1)
+                delay = policy.backoff(attempt_i, error)
+                if delay > policy.remaining(start):
+                    break
+                time.sleep(delay)
+                continue
+            metrics.record_latency(self.model_entity, time.monotonic() - tic)
+            valid, output = checked if checked else self._costar.validate_and_convert(answer)
+            self._log_response(request_id, messages, attempt_i, answer, valid)
+            if valid:
+                return output
+            metrics.record(self.model_entity, invalid_responses=1)
+            # Do not get the same invalid answer out of the cache again
+            refresh = True
+        metrics.record(self.model_entity, failures=1)
         return None
 
+    async def aanswer_until_valid(self, messages: List[Dict[str,str]],
+                                  request_id: Optional[str] = None) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
+        if not hasattr(self, '_costar'):
+            raise NameError('Please initialise with costar')
+        policy = self.retry_policy
+        start = time.monotonic()
+        metrics.record(self.model_entity, calls=1)
+        refresh = False
+        for attempt_i in range(policy.max_attempt):
+            if policy.remaining(start) <= 0:
+                break
+            metrics.record(self.model_entity, attempts=1)
+            tic = time.monotonic()
+            checked = None
+            try:
+                if self.hedge_policy is not None:
+                    answer, *checked = await self._ahedged_answer(messages, refresh)
+                else:
+                    answer = await self.aanswer(messages, refresh=refresh)
+            except Exception as error:
+                if not is_transient(error):
+                    raise
+                metrics.record(self.model_entity, transient_errors=1)
+                delay = policy.backoff(attempt_i, error)
+                if delay > policy.remaining(start):
+                    break
+                await asyncio.sleep(delay)
+                continue
+            metrics.record_latency(self.model_entity, time.monotonic() - tic)
+            valid, output = checked if checked else self._costar.validate_and_convert(answer)
+            self._log_response(request_id, messages, attempt_i, answer, valid)
+            if valid:
+                return output
+            metrics.record(self.model_entity, invalid_responses=1)
+            refresh = True
+        metrics.record(self.model_entity, failures=1)
+        return None
+
+    # Hedging: a request slower than the delay of the hedge policy is duplicated
+    def _observe(self, tic: float, last_call: Optional[Dict] = None):
+        # Only the first request is observed, an abandoned one for as long as it
+        # ran: the duplicates answering faster would bias the percentile down
+        if last_call is None or not last_call.get('cached'):
+            self.hedge_policy.observe(self.model_entity, time.monotonic() - tic)
+
+    def _checked_answer(self, messages: List[Dict[str,str]], refresh: bool) -> Tuple[str, bool, Any, Dict]:
+        answer = self.answer(messages, refresh=refresh)
+        valid, output = self._costar.validate_and_convert(answer)
+        return answer, valid, output, self.last_call
+
+    def _hedge_won(self, hedge_i: int, last_call: Dict, **left_over: int):
+        # The statistics of the call kept are the ones of the answer kept
+        self._last_call_var().set(last_call)
+        metrics.record(self.model_entity, hedge_wins=int(hedge_i > 0), **left_over)
+
+    def _hedged_answer(self, messages: List[Dict[str,str]], refresh: bool) -> Tuple[str, bool, Any]:
+        """answer, valid and output of the first valid answer among the hedged requests.
+
+        Threads can not be cancelled: the requests abandoned run to their end
+        in the background, their tokens are accounted as any other.
+        """
+        policy = self.hedge_policy
+        delay = policy.delay(self.model_entity)
+        tic = time.monotonic()
+        if delay is None:
+            answer, valid, output, last_call = self._checked_answer(messages, refresh)
+            self._observe(tic, last_call)
+            return answer, valid, output
+        results = queue.Queue()
+        def attempt(hedge_i: int, context: contextvars.Context):
+            try:
+                results.put((hedge_i, context.run(self._checked_answer, messages, refresh), None))
+            except Exception as error:
+                results.put((hedge_i, None, error))
+        def start(hedge_i: int):
+            threading.Thread(target=attempt, args=(hedge_i, contextvars.copy_context()),
+                             daemon=True).start()
+        start(0)
+        n_started, n_done, first_done = 1, 0, False
+        invalid, error = None, None
+        while n_done < n_started:
+            try:
+                hedge_i, result, attempt_error = results.get(
+                    timeout=delay if n_started <= policy.max_hedges else None)
+            except queue.Empty:
+                start(n_started)
+                n_started += 1
+                metrics.record(self.model_entity, hedges=1)
+                continue
+            n_done += 1
+            if attempt_error is not None:
+                error = attempt_error
+                first_done = first_done or hedge_i == 0
+                continue
+            answer, valid, output, last_call = result
+            if hedge_i == 0:
+                self._observe(tic, last_call)
+                first_done = True
+            if valid:
+                if not first_done:
+                    self._observe(tic)
+                self._hedge_won(hedge_i, last_call, hedges_abandoned=n_started - n_done)
+                return answer, valid, output
+            invalid = result
+        if invalid is None:
+            raise error
+        answer, valid, output, last_call = invalid
+        self._last_call_var().set(last_call)
+        return answer, valid, output
+
+    async def _ahedged_answer(self, messages: List[Dict[str,str]], refresh: bool) -> Tuple[str, bool, Any]:
+        """Asynchronous _hedged_answer, the requests abandoned are cancelled"""
+        policy = self.hedge_policy
+        delay = policy.delay(self.model_entity)
+        async def attempt():
+            answer = await self.aanswer(messages, refresh=refresh)
+            valid, output = self._costar.validate_and_convert(answer)
+            return answer, valid, output, self.last_call
+        tic = time.monotonic()
+        if delay is None:
+            answer, valid, output, last_call = await attempt()
+            self._observe(tic, last_call)
+            return answer, valid, output
+        tasks = [asyncio.ensure_future(attempt())]
+        pending = set(tasks)
+        invalid, error = None, None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if len(tasks) <= policy.max_hedges else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                tasks.append(asyncio.ensure_future(attempt()))
+                pending.add(tasks[-1])
+                metrics.record(self.model_entity, hedges=1)
+                continue
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                answer, valid, output, last_call = task.result()
+                if task is tasks[0]:
+                    self._observe(tic, last_call)
+                if valid:
+                    if tasks[0] in pending:
+                        self._observe(tic)
+                    for other in pending:
+                        other.cancel()
+                    self._hedge_won(tasks.index(task), last_call, hedges_cancelled=len(pending))
+                    return answer, valid, output
+                invalid = task.result()
+        if invalid is None:
+            raise error
+        answer, valid, output, last_call = invalid
+        self._last_call_var().set(last_call)
+        return answer, valid, output
+
+    def _log_response(self, request_id: Optional[str], messages: List[Dict[str,str]],
+                      attempt_i: int, answer: str, valid: bool, stats: Optional[Dict] = None):
+        if self.response_log is None:
+            return
+        if stats is None:
+            stats = self.last_call
+        self.response_log.log(request_id, type(self._costar).__name__, self.model_entity,
+                              ResponseCache.key(self.model_entity, self.init_prompt,
+                                                messages, self.generation_params),
+                              attempt_i, answer, valid,
+                              cached=stats.get('cached', False),
+                              latency=stats.get('latency'),
+                              prompt_tokens=stats.get('prompt_tokens'),
+                              completion_tokens=stats.get('completion_tokens'))
+
+    def answer_batch(self, requests: Dict[str, List[Dict[str,str]]],
+                     backend: Optional[BatchBackend] = None,
+                     poll_interval: float = 60.,
+                     workdir: str = 'results/batches',
+                     timeout: Optional[float] = 24*3600.,
+                     on_answer: Optional[Callable[[str, Any, Dict], None]] = None
+                     ) -> Dict[str, Optional[Union[pd.DataFrame, pd.Series, str]]]:
+        """Answer many requests through the batch api of the provider.
+
+        requests maps a request_id to its messages. Requests answered
+        invalidly, or not at all, are resubmitted in a follow-up batch, up to
+        retry_policy.max_attempt batches. Polling stops after timeout seconds
+        overall, the requests still pending then fail. on_answer is given the
+        request_id, output and call statistics of each valid answer as it comes.
+        Returns the output of each request, None for the ones that failed.
+        """
+        if not hasattr(self, '_costar'):
+            raise NameError('Please initialise with costar')
+        if backend is None:
+            backend = self.batch_backend()
+        os.makedirs(workdir, exist_ok=True)
+        outputs = dict.fromkeys(requests)
+        pending = dict(requests)
+        metrics.record(self.model_entity, calls=len(requests))
+        start = time.monotonic()
+        for attempt_i in range(self.retry_policy.max_attempt):
+            if not pending:
+                break
+            # Request ids may hold characters the providers refuse in custom ids
+            custom_ids = {f"request-{i}": request_id for i, request_id in enumerate(pending)}
+            path = os.path.join(workdir, f"{self.model_id()}-{uuid.uuid4().hex}.jsonl")
+            write_jsonl(path, [dict(custom_id=custom_id, body=self._batch_body(pending[request_id]))
+                               for custom_id, request_id in custom_ids.items()])
+            batch_id = backend.submit(path)
+            timed_out = False
+            while backend.status(batch_id) == 'in_progress':
+                if timeout is not None and time.monotonic() - start + poll_interval > timeout:
+                    timed_out = True
+                    break
+                time.sleep(poll_interval)
+            if timed_out:
+                break
+            results = backend.results(batch_id)
+            metrics.record(self.model_entity, attempts=len(pending))
+            for custom_id, request_id in custom_ids.items():
+                result = results.get(custom_id)
+                if result is None:
+                    continue
+                metrics.record_usage(self.model_entity, result.prompt_tokens,
+                                     result.completion_tokens, None)
+                valid, output = self._costar.validate_and_convert(result.text)
+                self._log_response(request_id, pending[request_id], attempt_i, result.text, valid,
+                                   stats=dict(prompt_tokens=result.prompt_tokens,
+                                              completion_tokens=result.completion_tokens))
+                if valid:
+                    outputs[request_id] = output
+                    if on_answer is not None:
+                        on_answer(request_id, output, dict(latency=None, prompt_tokens=result.prompt_tokens,
+                                                           completion_tokens=result.completion_tokens))
+                    del pending[request_id]
+                else:
+                    metrics.record(self.model_entity, invalid_responses=1)
+        metrics.record(self.model_entity, failures=len(pending))
+        return outputs
+
+    def batch_backend(self) -> BatchBackend:
+        raise NameError(f"{self.__class__.__name__} has no batch api")
+
+    def _batch_body(self, messages: List[Dict[str,str]]) -> Dict:
+        """Body of the chat request for messages, as sent in a batch"""
+        raise NameError(f"{self.__class__.__name__} has no batch api")
+
+    @property
+    def provider_name(self) -> str:
+        """Key of the provider limits, the chatter class by default"""
+        return self.__class__.__name__
+
+    @property
+    def last_call(self) -> Dict:
+        """Statistics of the last answer given in the current thread or task"""
+        return self._last_call_var().get({})
+
+    def _last_call_var(self) -> ContextVar:
+        # One variable per chatter, as chatters are shared between threads
+        return self.__dict__.setdefault('_last_call', ContextVar(f'last_call_{id(self)}'))
+
+    def _usage_var(self) -> ContextVar:
+        return self.__dict__.setdefault('_usage', ContextVar(f'usage_{id(self)}'))
+
+    def _record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                      cached_tokens: Optional[int] = None):
+        """Token usage reported by the provider for the call in progress.
+
+        cached_tokens are the prompt_tokens read from the provider prompt cache.
+        """
+        self._usage_var().set(dict(prompt_tokens=prompt_tokens,
+                                   completion_tokens=completion_tokens,
+                                   cached_tokens=cached_tokens))
+
+    def _record_call(self, start: float, first_token: Optional[float] = None,
+                     n_chunks: Optional[int] = None, cached: bool = False):
+        stats = dict(latency=time.monotonic() - start,
+                     time_to_first_token=None,
+                     tokens_per_second=None,
+                     cached=cached,
+                     prompt_tokens=None,
+                     completion_tokens=None,
+                     cached_tokens=None)
+        if not cached:
+            stats.update(self._usage_var().get({}))
+            metrics.record_usage(self.model_entity, stats['prompt_tokens'],
+                                 stats['completion_tokens'], stats['cached_tokens'])
+        if first_token is not None and not cached:
+            stats['time_to_first_token'] = first_token - start
+            generation_time = stats['latency'] - stats['time_to_first_token']
+            # Streamed chunks hold about one token each, if the provider gave no count
+            n_tokens = stats['completion_tokens'] or n_chunks
+            if n_tokens and generation_time > 0:
+                stats['tokens_per_second'] = n_tokens/generation_time
+        self._last_call_var().set(stats)
+
+    @property
+    def generation_params(self) -> Dict:
+        return {}
+
+    def _cache_key(self, messages: List[Dict[str,str]]) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return self.response_cache.key(self.model_entity, self.init_prompt,
+                                       messages, self.generation_params)
+
+    def _throttle(self, messages: List[Dict[str,str]]):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.model_entity,
+                                      estimate_messages_tokens(self.init_prompt, messages))
+
+    async def _athrottle(self, messages: List[Dict[str,str]]):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire(self.model_entity,
+                                             estimate_messages_tokens(self.init_prompt, messages))
+
+    def _consume(self, answer: str):
+        if self.rate_limiter is not None and answer:
+            self.rate_limiter.consume(self.model_entity, estimate_tokens(answer))
+
+    async def _aconsume(self, answer: str):
+        if self.rate_limiter is not None and answer:
+            await self.rate_limiter.aconsume(self.model_entity, estimate_tokens(answer))
+
+    def answer(self, messages: List[Dict[str,str]] = [], refresh: bool = False) -> str:
+        start = time.monotonic()
+        key = self._cache_key(messages)
+        if key is not None and not refresh:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record_call(start, cached=True)
+                return cached
+        self._throttle(messages)
+        self._usage_var().set({})
+        start = time.monotonic()
+        answer = self._answer(messages)
+        self._record_call(start)
+        self._consume(answer)
+        if key is not None and answer:
+            self.response_cache.put(key, self.model_entity, answer)
+        return answer
+
+    async def aanswer(self, messages: List[Dict[str,str]] = [], refresh: bool = False) -> str:
+        start = time.monotonic()
+        key = self._cache_key(messages)
+        if key is not None and not refresh:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record_call(start, cached=True)
+                return cached
+        await self._athrottle(messages)
+        self._usage_var().set({})
+        start = time.monotonic()
+        answer = await self._aanswer(messages)
+        self._record_call(start)
+        await self._aconsume(answer)
+        if key is not None and answer:
+            self.response_cache.put(key, self.model_entity, answer)
+        return answer
+
+    def answer_stream(self, messages: List[Dict[str,str]] = [], refresh: bool = False) -> Iterator[str]:
+        start = time.monotonic()
+        key = self._cache_key(messages)
+        if key is not None and not refresh:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                self._record_call(start, cached=True)
+                yield cached
+                return
+        self._throttle(messages)
+        self._usage_var().set({})
+        start = time.monotonic()
+        first_token = None
+        chunks = []
+        for chunk in self._answer_stream(messages):
+            if not chunk:
+                continue
+            if first_token is None:
+                first_token = time.monotonic()
+            chunks.append(chunk)
+            yield chunk
+        self._record_call(start, first_token=first_token, n_chunks=len(chunks))
+        answer = ''.join(chunks)
+        self._consume(answer)
+        if key is not None and answer:
+            self.response_cache.put(key, self.model_entity, answer)
+
+    def _consume_stream(self, messages: List[Dict[str,str]], refresh: bool,
+                        on_token: Optional[Callable[[str], None]]) -> str:
+        chunks = []
+        for chunk in self.answer_stream(messages, refresh=refresh):
+            if on_token is not None:
+                on_token(chunk)
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        # Fallback for chatters without a streaming api
+        yield self._answer(messages)
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        # Fallback for chatters without an asynchronous client.
+        # The thread runs in a copy of the context, the usage is brought back.
+        def answer():
+            return self._answer(messages), self._usage_var().get({})
+        answer, usage = await asyncio.to_thread(answer)
+        self._usage_var().set(usage)
+        return answer
+
     @abstractmethod
     def __init__(self, api_key: str): ...
     @abstractmethod
-    def answer(self, messages: List[Dict[str,str]]) -> str: ...
+    def _answer(self, messages: List[Dict[str,str]]) -> str: ...
     @abstractproperty
     def metainfo(self) -> Dict[str, str]: ...
     @abstractproperty
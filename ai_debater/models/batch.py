@@ -0,0 +1,193 @@
+from typing import Callable, Dict, List, Optional
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import io
+import json
+import uuid
+
+# States of a batch, as reported by BatchBackend.status
+BATCH_STATES = ('in_progress', 'completed', 'failed')
+
+@dataclass
+class BatchResult():
+    text: Optional[str]
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+def read_jsonl(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def write_jsonl(path: str, lines: List[Dict]):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + '\n')
+
+def chat_completion_results(output: str) -> Dict[str, BatchResult]:
+    """Results of an output file of chat completions, as OpenAI and Mistral return them"""
+    results = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        line = json.loads(line)
+        response = line.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+        body = response["body"]
+        text = body["choices"][0]["message"]["content"] if body.get("choices") else ''
+        usage = body.get("usage") or {}
+        results[line["custom_id"]] = BatchResult(text, usage.get("prompt_tokens"),
+                                                 usage.get("completion_tokens"))
+    return results
+
+class BatchBackend(ABC):
+    """Batch endpoint of a provider.
+
+    Requests are JSONL files of {"custom_id": ..., "body": ...} lines, the
+    body being the request the chatter would send to its chat endpoint.
+    """
+    @abstractmethod
+    def submit(self, path: str) -> str:
+        """Submit the requests of the JSONL file, returns the batch id"""
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """One of BATCH_STATES"""
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, BatchResult]:
+        """Result of each custom_id answered, failed requests may be missing"""
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, client):
+        self._client = client
+
+    def submit(self, path: str) -> str:
+        lines = [dict(custom_id=line["custom_id"], method="POST",
+                      url="/v1/chat/completions", body=line["body"])
+                 for line in read_jsonl(path)]
+        content = ''.join(json.dumps(line) + '\n' for line in lines).encode('utf-8')
+        batch_file = self._client.files.create(file=(path, io.BytesIO(content)), purpose="batch")
+        batch = self._client.batches.create(input_file_id=batch_file.id,
+                                            endpoint="/v1/chat/completions",
+                                            completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        status = self._client.batches.retrieve(batch_id).status
+        if status == 'completed':
+            return 'completed'
+        if status in ('failed', 'expired', 'cancelled'):
+            return 'failed'
+        return 'in_progress'
+
+    def results(self, batch_id: str) -> Dict[str, BatchResult]:
+        # Expired batches keep the output of the requests completed in time
+        output_file_id = self._client.batches.retrieve(batch_id).output_file_id
+        if output_file_id is None:
+            return {}
+        return chat_completion_results(self._client.files.content(output_file_id).text)
+
+class AnthropicBatchBackend(BatchBackend):
+    def __init__(self, client):
+        self._batches = client.messages.batches
+
+    def submit(self, path: str) -> str:
+        requests = [dict(custom_id=line["custom_id"], params=line["body"])
+                    for line in read_jsonl(path)]
+        return self._batches.create(requests=requests).id
+
+    def status(self, batch_id: str) -> str:
+        batch = self._batches.retrieve(batch_id)
+        if batch.processing_status != 'ended':
+            return 'in_progress'
+        return 'completed'
+
+    def results(self, batch_id: str) -> Dict[str, BatchResult]:
+        # Counted as the chat endpoint does, with the cached prompt tokens
+        from ai_debater.models.claude3ai_chatter import Claude3AiChatter
+        results = {}
+        for entry in self._batches.results(batch_id):
+            if entry.result.type != 'succeeded':
+                continue
+            message = entry.result.message
+            text = message.content[0].text if message.content else ''
+            prompt_tokens, completion_tokens, _ = Claude3AiChatter._completion2usage(message)
+            results[entry.custom_id] = BatchResult(text, prompt_tokens, completion_tokens)
+        return results
+
+class MistralBatchBackend(BatchBackend):
+    """Mistral batch jobs through the REST api, which the pinned SDK does not cover"""
+    endpoint = 'https://api.mistral.ai/v1'
+
+    def __init__(self, api_key: str, http_client=None):
+        if http_client is None:
+            from ai_debater.models.client_pool import get_client, http_client as new_http_client
+            http_client = get_client('mistralai-http', api_key, new_http_client)
+        self._http = http_client
+        self._headers = {"Authorization": f"Bearer {api_key}"}
+
+    def _request(self, method: str, url: str, **kwargs):
+        response = self._http.request(method, self.endpoint + url, headers=self._headers, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def submit(self, path: str) -> str:
+        lines = read_jsonl(path)
+        # The model is given per job rather than per request
+        models = {line["body"]["model"] for line in lines}
+        if len(models) != 1:
+            raise NameError(f"A Mistral batch is for a single model, got {models}")
+        content = ''.join(json.dumps(dict(custom_id=line["custom_id"],
+                                          body={k: v for k, v in line["body"].items() if k != "model"})) + '\n'
+                          for line in lines).encode('utf-8')
+        batch_file = self._request("POST", "/files", data={"purpose": "batch"},
+                                   files={"file": (path, content)}).json()
+        job = self._request("POST", "/batch/jobs",
+                            json={"input_files": [batch_file["id"]],
+                                  "endpoint": "/v1/chat/completions",
+                                  "model": models.pop()}).json()
+        return job["id"]
+
+    def _job(self, batch_id: str) -> Dict:
+        return self._request("GET", f"/batch/jobs/{batch_id}").json()
+
+    def status(self, batch_id: str) -> str:
+        status = self._job(batch_id)["status"]
+        if status == 'SUCCESS':
+            return 'completed'
+        if status in ('FAILED', 'TIMEOUT_EXCEEDED', 'CANCELLED'):
+            return 'failed'
+        return 'in_progress'
+
+    def results(self, batch_id: str) -> Dict[str, BatchResult]:
+        output_file = self._job(batch_id).get("output_file")
+        if output_file is None:
+            return {}
+        return chat_completion_results(self._request("GET", f"/files/{output_file}/content").text)
+
+class LocalBatchBackend(BatchBackend):
+    """Batches answered in process by respond(body), e.g. a fake model.
+
+    A batch reports in_progress for its first n_polls status calls.
+    """
+    def __init__(self, respond: Callable[[Dict], Optional[str]], n_polls: int = 1):
+        self.respond = respond
+        self.n_polls = n_polls
+        self._batches: Dict[str, Dict] = {}
+
+    def submit(self, path: str) -> str:
+        batch_id = uuid.uuid4().hex
+        self._batches[batch_id] = dict(lines=read_jsonl(path), polls=0)
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch = self._batches[batch_id]
+        batch['polls'] += 1
+        return 'completed' if batch['polls'] > self.n_polls else 'in_progress'
+
+    def results(self, batch_id: str) -> Dict[str, BatchResult]:
+        results = {}
+        for line in self._batches.pop(batch_id)['lines']:
+            text = self.respond(line["body"])
+            if text is not None:
+                results[line["custom_id"]] = BatchResult(text)
+        return results
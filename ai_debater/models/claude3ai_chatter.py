@@ -1,12 +1,20 @@
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import anthropic
 from datetime import datetime
 import os
 from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.client_pool import get_client, get_async_client, http_client, async_http_client
+from ai_debater.models.batch import BatchBackend, AnthropicBatchBackend
+
+# Prompt caching was in beta for the anthropic versions supported here
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
 
 class Claude3AiChatter(BaseAiChatter):
     def __init__(self, api_key: str):
-        self._client = anthropic.Anthropic(api_key = api_key)
+        self._client = get_client('anthropic', api_key,
+            lambda: anthropic.Anthropic(api_key = api_key, http_client=http_client()))
+        self._aclient_args = ('anthropic-async', api_key,
+            lambda: anthropic.AsyncAnthropic(api_key = api_key, http_client=async_http_client()))
         self.model = 'claude-3-opus-20240229'
         self._timestamp = datetime.now()
         
@@ -14,6 +22,10 @@ class Claude3AiChatter(BaseAiChatter):
     def model_entity(self) -> str:
         return self.__class__.__name__+'|'+self._model
 
+    @property
+    def _aclient(self):
+        return get_async_client(*self._aclient_args)
+
     @property
     def model(self) -> str:
         return self._model
@@ -31,23 +43,77 @@ class Claude3AiChatter(BaseAiChatter):
         }
 
 
-    def answer(self, messages: List[Dict[str,str]] = []) -> str:
-        messages = messages.copy()
+    @property
+    def generation_params(self) -> Dict:
+        return dict(max_tokens=2000)
+
+    def _system(self) -> List[Dict]:
+        # The static CoStar prompt is marked for the provider to cache it
+        return [{"type": "text", "text": self.init_prompt,
+                 "cache_control": {"type": "ephemeral"}}]
+
+    def _messages(self, messages: List[Dict[str,str]]) -> List[Dict[str,str]]:
         if not len(messages):
             messages = [dict(role='user',
                              content='Please fullfill your role')]
         # We need to replace all role: systems -> assistant:
         messages_claud = []
         for m in messages:
-            role = m["role"]
-            if role == "system":
+            m = m.copy()
+            if m["role"] == "system":
                 m["role"] = "assistant"
             messages_claud.append(m)
-        chat_completion = self._client.messages.create(
-            system = self.init_prompt,
-            max_tokens = 2000,
-            model=self._model,
-            messages=messages_claud)
+        return messages_claud
+
+    @staticmethod
+    def _completion2text(chat_completion) -> str:
         if chat_completion.content:
             return chat_completion.content[0].text
-        return ''
\ No newline at end of file
+        return ''
+
+    @staticmethod
+    def _completion2usage(chat_completion) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        usage = getattr(chat_completion, 'usage', None)
+        if usage is None:
+            return None, None, None
+        # input_tokens excludes the tokens read from or written to the cache
+        cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_creation = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        return usage.input_tokens + cache_read + cache_creation, usage.output_tokens, cache_read
+
+    def _answer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = self._client.messages.create(
+            system = self._system(),
+            extra_headers = PROMPT_CACHING_HEADERS,
+            **self.generation_params,
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = await self._aclient.messages.create(
+            system = self._system(),
+            extra_headers = PROMPT_CACHING_HEADERS,
+            **self.generation_params,
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    def batch_backend(self) -> BatchBackend:
+        return AnthropicBatchBackend(self._client)
+
+    def _batch_body(self, messages: List[Dict[str,str]]) -> Dict:
+        return dict(system=self._system(), **self.generation_params,
+                    model=self._model, messages=self._messages(messages))
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        with self._client.messages.stream(
+            system = self._system(),
+            extra_headers = PROMPT_CACHING_HEADERS,
+            **self.generation_params,
+            model=self._model,
+            messages=self._messages(messages)) as stream:
+            yield from stream.text_stream
+            self._record_usage(*self._completion2usage(stream.get_final_message()))
@@ -0,0 +1,65 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+
+# Maximum number of (keep-alive) connections per client
+DEFAULT_POOL_SIZE = int(os.environ.get('AI_DEBATER_POOL_SIZE', 32))
+
+_pool_size = DEFAULT_POOL_SIZE
+_clients: Dict[Tuple[str, str], Any] = {}
+# Async clients are bound to the event loop they first ran on, one set per loop
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], Any]]' = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def set_pool_size(pool_size: int):
+    """Size of the connection pools of clients created from now on"""
+    global _pool_size
+    _pool_size = pool_size
+
+def pool_size() -> int:
+    return _pool_size
+
+def _key(provider: str, credentials: Optional[str]) -> Tuple[str, str]:
+    # The credentials are only kept hashed
+    return (provider, hashlib.sha256(str(credentials).encode('utf-8')).hexdigest())
+
+def get_client(provider: str, credentials: Optional[str], factory: Callable[[], Any]) -> Any:
+    """Client shared by all chatters of a provider using the same credentials"""
+    key = _key(provider, credentials)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+def get_async_client(provider: str, credentials: Optional[str], factory: Callable[[], Any]) -> Any:
+    """Same as get_client, shared within the running event loop only"""
+    loop = asyncio.get_running_loop()
+    key = _key(provider, credentials)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = factory()
+        return clients[key]
+
+def clear_clients():
+    with _lock:
+        _clients.clear()
+        _async_clients.clear()
+
+def _httpx_limits():
+    import httpx
+    return httpx.Limits(max_connections=pool_size(),
+                        max_keepalive_connections=pool_size())
+
+def http_client():
+    import httpx
+    return httpx.Client(limits=_httpx_limits(),
+                        timeout=httpx.Timeout(600., connect=10.))
+
+def async_http_client():
+    import httpx
+    return httpx.AsyncClient(limits=_httpx_limits(),
+                             timeout=httpx.Timeout(600., connect=10.))
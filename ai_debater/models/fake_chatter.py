@@ -0,0 +1,200 @@
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+import asyncio
+import random
+import re
+import threading
+import time
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.batch import BatchBackend, LocalBatchBackend
+from ai_debater.models.rate_limiter import estimate_tokens, estimate_messages_tokens
+from ai_debater.prompt_engineering import TopicCreatorContext, JudgesContext, PublicContext
+
+class FakeProviderError(Exception):
+    """Error response of a fake provider, classified by its status_code as the real ones"""
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Fake provider error {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {'retry-after': str(retry_after)}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+@dataclass
+class FakeProfile():
+    """Behaviour of a fake provider, latencies in seconds"""
+    median_latency: float = 2.
+    latency_sigma: float = 0.5 # of the log-normal latency
+    time_to_first_token: float = 0.2 # share of the latency before the first token
+    error_rate: float = 0. # 500 errors
+    rate_limit_rate: float = 0. # 429 errors, besides those of max_concurrent
+    retry_after: Optional[float] = 1.
+    max_concurrent: Optional[int] = None # requests in flight before 429 errors
+    invalid_rate: float = 0. # answers not in the format of the CoStar
+    argument_words: int = 150
+
+# Stand-ins of the chatters of the package, by chatter class.
+# Orders of magnitude only, to be tuned to the latencies observed.
+FAKE_PROVIDERS = {
+    "OpenAIChatter": ('gpt-4', FakeProfile(median_latency=8., latency_sigma=0.4)),
+    "Claude3AiChatter": ('claude-3-opus-20240229', FakeProfile(median_latency=12., latency_sigma=0.5)),
+    "MistralAIChatter": ('mistral-large-latest', FakeProfile(median_latency=6., latency_sigma=0.6)),
+    "GeminiChatter": ('gemini-pro', FakeProfile(median_latency=4., latency_sigma=0.7)),
+}
+
+_CATEGORIES = re.findall(r'^<(\w+)>$', JudgesContext().response_format, flags=re.M)
+
+class FakeChatter(BaseAiChatter):
+    """Offline chatter answering each CoStar role, for load tests without api calls.
+
+    Latencies, errors and invalid answers are drawn from the profile;
+    time_scale shrinks all delays, e.g. 0.01 for a hundred times faster run.
+    """
+    def __init__(self, api_key: Optional[str] = None, model: str = 'fake',
+                 profile: Optional[FakeProfile] = None, time_scale: float = 1.,
+                 seed: Optional[int] = None, provider_name: Optional[str] = None):
+        self.model = model
+        # The chatter class stood in for, each has its own provider limit
+        self._provider_name = provider_name
+        self.profile = FakeProfile() if profile is None else profile
+        self.time_scale = time_scale
+        self._random = random.Random(seed)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._timestamp = datetime.now()
+
+    @classmethod
+    def provider(cls, model_class: str, time_scale: float = 1., seed: Optional[int] = None) -> 'FakeChatter':
+        """Stand-in of a chatter class of the package"""
+        model, profile = FAKE_PROVIDERS[model_class]
+        return cls(model=model, profile=profile, time_scale=time_scale, seed=seed,
+                   provider_name=model_class)
+
+    @property
+    def model_entity(self) -> str:
+        return self.__class__.__name__+'|'+self._model
+
+    @property
+    def provider_name(self) -> str:
+        if self._provider_name is None:
+            return super().provider_name
+        return self._provider_name
+
+    @property
+    def model(self) -> str:
+        return self._model
+    @model.setter
+    def model(self, model):
+        self._model = model
+
+    @property
+    def metainfo(self) -> Dict[str, Union[str, float]]:
+        return {
+            "model_class": self.__class__.__name__,
+            "model":self.model,
+            "model_entity":self.model_entity,
+            "creation_date":self._timestamp
+        }
+
+    # Answers of each role
+    def _words(self, n_words: int) -> str:
+        return ' '.join(self._random.choice(('debate', 'argument', 'evidence', 'point', 'claim',
+                                             'therefore', 'however', 'because', 'the', 'a'))
+                        for _ in range(n_words))
+
+    def _valid_answer(self, messages: List[Dict[str,str]]) -> str:
+        content = '\n'.join(message['content'] for message in messages)
+        if isinstance(self._costar, TopicCreatorContext):
+            return ''.join(f"<Topic><Subject>{self._words(8)}</Subject>"
+                           f"<Rational>{self._words(30)}</Rational></Topic>" for _ in range(10))
+        if isinstance(self._costar, JudgesContext):
+            team_ids = list(dict.fromkeys(re.findall(r'<Team_ID>(.*?)</Team_ID>', content)))
+            return ''.join(
+                f"<{category}>" + ''.join(
+                    f"<Team><Team_ID>{team_id}</Team_ID>"
+                    f"<Score max_score=\"100\">{self._random.randint(0, 100)}</Score>"
+                    f"<Rational>{self._words(20)}</Rational></Team>" for team_id in team_ids)
+                + f"</{category}>" for category in _CATEGORIES)
+        if isinstance(self._costar, PublicContext):
+            judgement_ids = list(dict.fromkeys(re.findall(r'<Judgement_ID>(.*?)</Judgement_ID>', content)))
+            return f"<Judgement_ID>{self._random.choice(judgement_ids)}</Judgement_ID>"
+        return self._words(self.profile.argument_words)
+
+    def _invalid_answer(self) -> str:
+        if isinstance(self._costar, (TopicCreatorContext, JudgesContext, PublicContext)):
+            return "<Topic><Subject>Unclosed"
+        return ''
+
+    def _plan(self, messages: List[Dict[str,str]]) -> Tuple[float, Optional[FakeProviderError], str]:
+        """Latency, error and answer of the next call, which is in flight until _exit"""
+        profile = self.profile
+        with self._lock:
+            over_limit = profile.max_concurrent is not None and self._in_flight >= profile.max_concurrent
+            self._in_flight += 1
+            latency = self._random.lognormvariate(0., profile.latency_sigma) \
+                * profile.median_latency*self.time_scale
+            draw = self._random.random()
+            retry_after = None if profile.retry_after is None else profile.retry_after*self.time_scale
+            if over_limit or draw < profile.rate_limit_rate:
+                return 0., FakeProviderError(429, retry_after), ''
+            if draw < profile.rate_limit_rate + profile.error_rate:
+                return latency, FakeProviderError(500), ''
+            if draw < profile.rate_limit_rate + profile.error_rate + profile.invalid_rate:
+                return latency, None, self._invalid_answer()
+            return latency, None, self._valid_answer(messages)
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _record(self, messages: List[Dict[str,str]], answer: str):
+        self._record_usage(estimate_messages_tokens(self.init_prompt, messages), estimate_tokens(answer))
+
+    def _answer(self, messages: List[Dict[str,str]]) -> str:
+        latency, error, answer = self._plan(messages)
+        try:
+            time.sleep(latency)
+        finally:
+            self._exit()
+        if error is not None:
+            raise error
+        self._record(messages, answer)
+        return answer
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        latency, error, answer = self._plan(messages)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            self._exit()
+        if error is not None:
+            raise error
+        self._record(messages, answer)
+        return answer
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        latency, error, answer = self._plan(messages)
+        first_token = latency*self.profile.time_to_first_token
+        try:
+            time.sleep(first_token)
+            if error is not None:
+                raise error
+            chunks = re.findall(r'\S+\s*', answer) or [answer]
+            for chunk in chunks:
+                yield chunk
+                time.sleep((latency - first_token)/len(chunks))
+        finally:
+            self._exit()
+        self._record(messages, answer)
+
+    def _batch_respond(self, body: Dict) -> Optional[str]:
+        # Batches have no latency of their own, failed requests are missing
+        _, error, answer = self._plan(body["messages"])
+        self._exit()
+        return None if error is not None else answer
+
+    def batch_backend(self) -> BatchBackend:
+        return LocalBatchBackend(self._batch_respond)
+
+    def _batch_body(self, messages: List[Dict[str,str]]) -> Dict:
+        return dict(model=self._model, messages=messages)
@@ -1,16 +1,22 @@
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import vertexai
 from vertexai.generative_models import GenerativeModel
 from vertexai.generative_models import Content, Part
 from datetime import datetime
 from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.client_pool import get_client, get_async_client
 import os 
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def _init_vertexai(project: str, location: str):
+    vertexai.init(project=project, location=location)
 
 class GeminiChatter(BaseAiChatter):
     def __init__(self, api_key: str = None):
-        vertexai.init(
-            project=os.environ.get('project_id'),
-            location='europe-west3')
+        self._project = os.environ.get('project_id')
+        self._location = 'europe-west3'
+        _init_vertexai(self._project, self._location)
         self.model = "gemini-pro"
         self._timestamp = datetime.now()
         
@@ -24,7 +30,14 @@ class GeminiChatter(BaseAiChatter):
     @model.setter
     def model(self, model):
         self._model = model
-        self._client = GenerativeModel(self.model)
+        self._client = get_client('vertexai-model', f'{self._project}@{self._location}/{model}',
+                                  lambda: GenerativeModel(model))
+
+    @property
+    def _aclient(self) -> GenerativeModel:
+        # The model keeps its async transport once used, one model per event loop
+        return get_async_client('vertexai-model', f'{self._project}@{self._location}/{self._model}',
+                                lambda: GenerativeModel(self._model))
 
     @property
     def metainfo(self) -> Dict[str, Union[str, float]]:
@@ -35,7 +48,7 @@ class GeminiChatter(BaseAiChatter):
             "creation_date":self._timestamp
         }
 
-    def answer(self, messages: List[Dict[str,str]] = []) -> str:
+    def _messages(self, messages: List[Dict[str,str]]) -> List[Content]:
         messages = messages.copy()
         if messages: # Because Gemini require alternance user - system
             insert_system_ok = messages[0]["role"] == "user"
@@ -44,11 +57,39 @@ class GeminiChatter(BaseAiChatter):
         if insert_system_ok:
             messages.insert(0, {"role": "model", "content": "Ok I understood my role"})
         messages.insert(0, {"role": "user", "content": self.init_prompt})
-        messages = [Content(role="user" if val["role"]=="user" else "model",
-                            parts=[Part.from_text(val["content"])]) 
-                            for val in messages]
-        chat_completion = self._client.generate_content(messages)
+        return [Content(role="user" if val["role"]=="user" else "model",
+                        parts=[Part.from_text(val["content"])])
+                        for val in messages]
+
+    @staticmethod
+    def _completion2text(chat_completion) -> str:
         if chat_completion.candidates:
             if chat_completion.candidates[0].content.parts:
                 return chat_completion.candidates[0].content.parts[0].text
-        return ''
\ No newline at end of file
+        return ''
+
+    @staticmethod
+    def _completion2usage(chat_completion) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        usage = getattr(chat_completion, 'usage_metadata', None)
+        if usage is None:
+            return None, None, None
+        return (usage.prompt_token_count, usage.candidates_token_count,
+                getattr(usage, 'cached_content_token_count', None))
+
+    def _answer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = self._client.generate_content(self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = await self._aclient.generate_content_async(self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        stream = self._client.generate_content(self._messages(messages), stream=True)
+        for chunk in stream:
+            # Each chunk holds the usage so far, the last one the total
+            if getattr(chunk, 'usage_metadata', None) is not None:
+                self._record_usage(*self._completion2usage(chunk))
+            yield self._completion2text(chunk)
@@ -1,19 +1,33 @@
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
 from mistralai.models.chat_completion import ChatMessage
 from datetime import datetime
 from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.client_pool import get_client, get_async_client, pool_size
+from ai_debater.models.batch import BatchBackend, MistralBatchBackend
 
 
 class MistralAIChatter(BaseAiChatter):
     def __init__(self, api_key: str):
-        self._client = MistralClient(api_key=api_key)
+        # The mistral clients build their own httpx pool, they are shared as a whole
+        self._client = get_client('mistralai', api_key,
+            lambda: MistralClient(api_key=api_key))
+        self._aclient_args = ('mistralai-async', api_key,
+            lambda: MistralAsyncClient(api_key=api_key, max_concurrent_requests=pool_size()))
+        # For the batch api, which the client does not cover
+        self._api_key = api_key
         self.model = "mistral-large-latest"
         self._timestamp = datetime.now()
         
     @property
     def model_entity(self) -> str:
         return self.__class__.__name__+'|'+self.model
+
+    @property
+    def _aclient(self):
+        return get_async_client(*self._aclient_args)
+
     @property
     def model(self) -> str:
         return self._model
@@ -31,13 +45,53 @@ class MistralAIChatter(BaseAiChatter):
         }
 
 
-    def answer(self, messages: List[Dict[str,str]] = []) -> str:
+    def _messages(self, messages: List[Dict[str,str]]) -> List[ChatMessage]:
+        # The static CoStar prompt comes first, for the provider to cache it
         messages = messages.copy()
         messages.insert(0, {"role": "user", "content": self.init_prompt})
-        messages = [ChatMessage(**m) for m in messages]
-        chat_completion = self._client.chat(
-            model=self._model,
-            messages=messages)
+        return [ChatMessage(**m) for m in messages]
+
+    @staticmethod
+    def _completion2text(chat_completion) -> str:
         if chat_completion.choices:
             return chat_completion.choices[0].message.content
-        return ''
\ No newline at end of file
+        return ''
+
+    @staticmethod
+    def _completion2usage(chat_completion) -> Tuple[Optional[int], Optional[int]]:
+        usage = getattr(chat_completion, 'usage', None)
+        if usage is None:
+            return None, None
+        return usage.prompt_tokens, usage.completion_tokens
+
+    def _answer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = self._client.chat(
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = await self._aclient.chat(
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    def batch_backend(self) -> BatchBackend:
+        return MistralBatchBackend(self._api_key)
+
+    def _batch_body(self, messages: List[Dict[str,str]]) -> Dict:
+        return dict(model=self._model,
+                    messages=[dict(role=m.role, content=m.content) for m in self._messages(messages)])
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        stream = self._client.chat_stream(
+            model=self._model,
+            messages=self._messages(messages))
+        for chunk in stream:
+            # The last chunk holds the usage of the whole completion
+            if getattr(chunk, 'usage', None) is not None:
+                self._record_usage(*self._completion2usage(chunk))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -1,12 +1,17 @@
-from typing import Dict, List, Union
-from openai import OpenAI
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from openai import OpenAI, AsyncOpenAI
 from datetime import datetime
 import os
 from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.client_pool import get_client, get_async_client, http_client, async_http_client
+from ai_debater.models.batch import BatchBackend, OpenAIBatchBackend
 
 class OpenAIChatter(BaseAiChatter):
     def __init__(self, api_key: str):
-        self._client = OpenAI(api_key = api_key)
+        self._client = get_client('openai', api_key,
+            lambda: OpenAI(api_key = api_key, http_client=http_client()))
+        self._aclient_args = ('openai-async', api_key,
+            lambda: AsyncOpenAI(api_key = api_key, http_client=async_http_client()))
         self.model = 'gpt-4'
         self._timestamp = datetime.now()
         
@@ -14,6 +19,10 @@ class OpenAIChatter(BaseAiChatter):
     def model_entity(self) -> str:
         return self.__class__.__name__+'|'+self._model
 
+    @property
+    def _aclient(self):
+        return get_async_client(*self._aclient_args)
+
     @property
     def model(self) -> str:
         return self._model
@@ -31,12 +40,56 @@ class OpenAIChatter(BaseAiChatter):
         }
 
 
-    def answer(self, messages: List[Dict[str,str]] = []) -> str:
+    def _messages(self, messages: List[Dict[str,str]]) -> List[Dict[str,str]]:
+        # The static CoStar prompt comes first, for the provider to cache it
         messages = messages.copy()
         messages.insert(0, {"role": "user", "content": self.init_prompt})
-        chat_completion = self._client.chat.completions.create(
-            model=self._model,
-            messages=messages)
+        return messages
+
+    @staticmethod
+    def _completion2text(chat_completion) -> str:
         if chat_completion.choices:
             return chat_completion.choices[0].message.content
-        return ''
\ No newline at end of file
+        return ''
+
+    @staticmethod
+    def _completion2usage(chat_completion) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        usage = getattr(chat_completion, 'usage', None)
+        if usage is None:
+            return None, None, None
+        # Prompts sharing a prefix of 1024+ tokens are cached by OpenAI without markers
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return usage.prompt_tokens, usage.completion_tokens, getattr(details, 'cached_tokens', None)
+
+    def _answer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = self._client.chat.completions.create(
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    async def _aanswer(self, messages: List[Dict[str,str]]) -> str:
+        chat_completion = await self._aclient.chat.completions.create(
+            model=self._model,
+            messages=self._messages(messages))
+        self._record_usage(*self._completion2usage(chat_completion))
+        return self._completion2text(chat_completion)
+
+    def batch_backend(self) -> BatchBackend:
+        return OpenAIBatchBackend(self._client)
+
+    def _batch_body(self, messages: List[Dict[str,str]]) -> Dict:
+        return dict(model=self._model, messages=self._messages(messages))
+
+    def _answer_stream(self, messages: List[Dict[str,str]]) -> Iterator[str]:
+        stream = self._client.chat.completions.create(
+            model=self._model,
+            messages=self._messages(messages),
+            stream=True,
+            stream_options={"include_usage": True})
+        for chunk in stream:
+            # The usage comes last, in a chunk without choices
+            if chunk.usage is not None:
+                self._record_usage(*self._completion2usage(chunk))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import asyncio
+import sqlite3
+import threading
+import time
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for english text
+    return len(text)//4 + 1
+
+def estimate_messages_tokens(init_prompt: str, messages: List[Dict[str, str]]) -> int:
+    return estimate_tokens(init_prompt) + sum(estimate_tokens(m["content"]) for m in messages)
+
+@dataclass
+class RateLimit():
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+class RateLimiter():
+    """Token buckets per model_entity for requests and tokens per minute.
+
+    Limits are looked up by model_entity (e.g. 'OpenAIChatter|gpt-4'),
+    then by chatter class (e.g. 'OpenAIChatter'). Each bucket holds at most
+    one minute of quota. A reservation may take the bucket below zero; the
+    caller then waits until the bucket is refilled, which keeps callers
+    served in order.
+
+    With shared_db, the buckets live in a SQLite file so that all processes
+    using the same file share the quota of an API key.
+    """
+    def __init__(self, limits: Dict[str, RateLimit], shared_db: Optional[str] = None):
+        self.limits = limits
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        if shared_db is not None:
+            self._connection = sqlite3.connect(shared_db, timeout=60,
+                                               isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    bucket TEXT PRIMARY KEY,
+                    level REAL,
+                    updated REAL
+                )
+                """)
+
+    def limit(self, model_entity: str) -> Optional[RateLimit]:
+        if model_entity in self.limits:
+            return self.limits[model_entity]
+        return self.limits.get(model_entity.split('|')[0])
+
+    def _buckets2reserve(self, model_entity: str, tokens: int) -> List[Tuple[str, float, float]]:
+        """(bucket, per minute rate, amount) of each bucket to draw from"""
+        limit = self.limit(model_entity)
+        if limit is None:
+            return []
+        buckets = []
+        if limit.requests_per_minute:
+            buckets.append((model_entity+':requests', limit.requests_per_minute, 1))
+        if limit.tokens_per_minute and tokens:
+            buckets.append((model_entity+':tokens', limit.tokens_per_minute, tokens))
+        return buckets
+
+    @staticmethod
+    def _draw(level: Optional[float], updated: float, now: float,
+              per_minute: float, amount: float) -> Tuple[float, float]:
+        """New level of the bucket and time to wait for it"""
+        rate = per_minute/60
+        if level is None:
+            level = per_minute
+        level = min(per_minute, level + (now - updated)*rate) - amount
+        return level, max(0., -level/rate)
+
+    def _reserve_local(self, buckets) -> float:
+        wait = 0.
+        with self._lock:
+            now = time.time()
+            for bucket, per_minute, amount in buckets:
+                level, updated = self._buckets.get(bucket, (None, now))
+                level, bucket_wait = self._draw(level, updated, now, per_minute, amount)
+                self._buckets[bucket] = (level, now)
+                wait = max(wait, bucket_wait)
+        return wait
+
+    def _reserve_shared(self, buckets) -> float:
+        wait = 0.
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock of the file across processes
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                for bucket, per_minute, amount in buckets:
+                    row = self._connection.execute(
+                        "SELECT level, updated FROM rate_limit_buckets WHERE bucket = ?",
+                        (bucket,)).fetchone()
+                    level, updated = row if row is not None else (None, now)
+                    level, bucket_wait = self._draw(level, updated, now, per_minute, amount)
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO rate_limit_buckets VALUES (?, ?, ?)",
+                        (bucket, level, now))
+                    wait = max(wait, bucket_wait)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return wait
+
+    def reserve(self, model_entity: str, tokens: int = 0, request: bool = True) -> float:
+        """Take a request and tokens out of the buckets, returns the seconds to wait"""
+        buckets = self._buckets2reserve(model_entity, tokens)
+        if not request:
+            buckets = [b for b in buckets if not b[0].endswith(':requests')]
+        if not buckets:
+            return 0.
+        if self._connection is not None:
+            return self._reserve_shared(buckets)
+        return self._reserve_local(buckets)
+
+    def acquire(self, model_entity: str, tokens: int = 0):
+        wait = self.reserve(model_entity, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def _areserve(self, model_entity: str, tokens: int = 0, request: bool = True) -> float:
+        if self._connection is None:
+            return self.reserve(model_entity, tokens, request)
+        # Another process may hold the lock of the file, it is waited for off the event loop
+        return await asyncio.to_thread(self.reserve, model_entity, tokens, request)
+
+    async def aacquire(self, model_entity: str, tokens: int = 0):
+        wait = await self._areserve(model_entity, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def consume(self, model_entity: str, tokens: int):
+        """Account for tokens known after the call, e.g. the completion"""
+        self.reserve(model_entity, tokens, request=False)
+
+    async def aconsume(self, model_entity: str, tokens: int):
+        await self._areserve(model_entity, tokens, request=False)
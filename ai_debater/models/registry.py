@@ -0,0 +1,55 @@
+from typing import Dict, List, NamedTuple, Optional, Type
+import importlib
+import os
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+
+class ChatterSpec(NamedTuple):
+    module: str
+    default_model: str
+    api_key_env: Optional[str] = None # environment variable of the api key
+
+# Chatters by class name. Their module, and so the SDK of the provider, is
+# only imported when a chatter of the class is created.
+CHATTERS: Dict[str, ChatterSpec] = {
+    "GeminiChatter": ChatterSpec('ai_debater.models.gemini_chatter', 'gemini-pro'),
+    "MistralAIChatter": ChatterSpec('ai_debater.models.mistralai_chatter', 'mistral-large-latest',
+                                    'MISTRAL_API_KEY'),
+    "OpenAIChatter": ChatterSpec('ai_debater.models.openai_chatter', 'gpt-4', 'OPENAI_API_KEY'),
+    "Claude3AiChatter": ChatterSpec('ai_debater.models.claude3ai_chatter', 'claude-3-opus-20240229',
+                                    'ANTHROPIC_API_KEY'),
+    "FakeChatter": ChatterSpec('ai_debater.models.fake_chatter', 'fake'),
+}
+
+def register(class_name: str, module: str, default_model: str, api_key_env: Optional[str] = None):
+    """Make a chatter class of another module creatable by name"""
+    CHATTERS[class_name] = ChatterSpec(module, default_model, api_key_env)
+
+def _split(name: str):
+    class_name, _, model = name.partition('|')
+    if class_name not in CHATTERS:
+        raise NameError(f"Unknown chatter {class_name}, expected one of {list(CHATTERS)}")
+    return class_name, model or CHATTERS[class_name].default_model
+
+def model_entity(name: str) -> str:
+    """model_entity of "Class" or "Class|model", without importing the chatter"""
+    return '|'.join(_split(name))
+
+def chatter_class(class_name: str) -> Type[BaseAiChatter]:
+    spec = CHATTERS[_split(class_name)[0]]
+    return getattr(importlib.import_module(spec.module), class_name.partition('|')[0])
+
+def create_chatter(name: str, api_key: Optional[str] = None) -> BaseAiChatter:
+    """Chatter of "Class" or "Class|model", with the api key of the environment by default"""
+    class_name, model = _split(name)
+    spec = CHATTERS[class_name]
+    if api_key is None and spec.api_key_env is not None:
+        api_key = os.environ.get(spec.api_key_env)
+    chatter = chatter_class(class_name)(api_key=api_key)
+    if chatter.model != model:
+        chatter.model = model
+    return chatter
+
+def create_chatters(names: List[str]) -> List[BaseAiChatter]:
+    if not names:
+        raise NameError("No model has been created")
+    return [create_chatter(name) for name in names]
@@ -0,0 +1,111 @@
+from typing import Dict, List, Optional
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+
+CACHE_MODES = ('read-write', 'read-only', 'bypass')
+
+class ResponseCache():
+    """Persistent cache of LLM responses keyed on the request content.
+
+    Modes:
+    * read-write: answers from the cache and stores new responses
+    * read-only: answers from the cache, never writes (not even access times)
+    * bypass: the cache is neither read nor written
+
+    Entries are evicted least-recently-used first once max_entries or
+    max_bytes (size of the stored responses) is exceeded.
+    """
+    def __init__(self, db_name='results/response_cache.db', mode='read-write',
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Chatters may be shared between the threads of a tournament
+        self.connection = sqlite3.connect(db_name, check_same_thread=False)
+        with self._lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    model_entity TEXT,
+                    response TEXT,
+                    size INTEGER,
+                    created_at REAL,
+                    last_access REAL
+                )
+                """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)")
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+    @mode.setter
+    def mode(self, mode: str):
+        if mode not in CACHE_MODES:
+            raise NameError(f"Unknown cache mode {mode}, expected one of {CACHE_MODES}")
+        self._mode = mode
+
+    @staticmethod
+    def key(model_entity: str, init_prompt: str,
+            messages: List[Dict[str, str]], params: Dict) -> str:
+        request = json.dumps(dict(model_entity=model_entity,
+                                  init_prompt=init_prompt,
+                                  messages=messages,
+                                  params=params),
+                             sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.mode == 'bypass':
+            return None
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT response FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.mode == 'read-write':
+                with self.connection:
+                    self.connection.execute(
+                        "UPDATE response_cache SET last_access = ? WHERE key = ?",
+                        (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, model_entity: str, response: str):
+        if self.mode != 'read-write':
+            return
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_entity, response, len(response.encode('utf-8')), now, now))
+            self._evict()
+
+    def _evict(self):
+        if self.max_entries is not None:
+            self.connection.execute(
+                """
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache
+                    ORDER BY last_access DESC
+                    LIMIT -1 OFFSET ?)
+                """, (self.max_entries,))
+        if self.max_bytes is not None:
+            self.connection.execute(
+                """
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM (
+                        SELECT
+                            key,
+                            SUM(size) OVER (ORDER BY last_access DESC, key) AS cumulated_size
+                        FROM response_cache)
+                    WHERE cumulated_size > ?)
+                """, (self.max_bytes,))
+
+    def clear(self):
+        with self._lock, self.connection:
+            self.connection.execute("DELETE FROM response_cache")
@@ -0,0 +1,66 @@
+from typing import Optional
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+class ResponseLog():
+    """Raw text of every response received by answer_until_valid.
+
+    One row per attempt, valid or not, with the request it answered
+    (e.g. a judgement_id), the stage (name of the CoStar), the hash of the
+    prompt, latency and token usage. Results can then be parsed again
+    offline, see ai_debater.reparse.
+    """
+    def __init__(self, db_name='results/dataset.db'):
+        self._lock = threading.Lock()
+        # Chatters may be shared between the threads of a tournament
+        self.connection = sqlite3.connect(db_name, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        with self._lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS raw_responses (
+                    response_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    request_id TEXT,
+                    stage TEXT,
+                    model_entity TEXT,
+                    prompt_hash TEXT,
+                    attempt INTEGER,
+                    response TEXT,
+                    is_valid INTEGER,
+                    cached INTEGER,
+                    latency REAL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    created_at REAL
+                )
+                """)
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_raw_responses_stage_request ON raw_responses (stage, request_id)")
+
+    def log(self, request_id: Optional[str], stage: str, model_entity: str, prompt_hash: str,
+            attempt: int, response: str, is_valid: bool, cached: bool = False,
+            latency: Optional[float] = None, prompt_tokens: Optional[int] = None,
+            completion_tokens: Optional[int] = None):
+        with self._lock, self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO raw_responses (
+                    request_id, stage, model_entity, prompt_hash, attempt, response, is_valid,
+                    cached, latency, prompt_tokens, completion_tokens, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (request_id, stage, model_entity, prompt_hash, attempt, response, int(is_valid),
+                 int(cached), latency, prompt_tokens, completion_tokens, time.time()))
+
+    def load(self, stage: Optional[str] = None) -> pd.DataFrame:
+        sql_statement = "SELECT * FROM raw_responses"
+        parameters = ()
+        if stage is not None:
+            sql_statement += " WHERE stage = ?"
+            parameters = (stage,)
+        with self._lock:
+            return pd.read_sql(sql_statement + " ORDER BY response_id", self.connection,
+                               params=parameters)
@@ -0,0 +1,164 @@
+from typing import Deque, Dict, Optional
+from dataclasses import dataclass, field, fields
+from collections import defaultdict, deque
+import email.utils
+import random
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Status codes worth a new attempt: rate limit, timeouts and server errors
+TRANSIENT_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+TRANSIENT_ERROR_NAMES = ('Timeout', 'Connection', 'RateLimit', 'Overloaded',
+                         'ServiceUnavailable', 'InternalServer', 'DeadlineExceeded',
+                         'ResourceExhausted')
+
+def status_code(error: BaseException) -> Optional[int]:
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if code is None:
+        # google.api_core exceptions
+        code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_transient(error: BaseException) -> bool:
+    if status_code(error) in TRANSIENT_STATUS_CODES:
+        return True
+    return any(name in type(error).__name__ for name in TRANSIENT_ERROR_NAMES)
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Delay in seconds requested by the provider, if any"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return float(value)/1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0., date.timestamp() - time.time())
+
+@dataclass
+class RetryPolicy():
+    max_attempt: int = 10
+    base_delay: float = 1.
+    max_delay: float = 60.
+    jitter: float = 1.
+    # Seconds for the whole call, retries included. Checked between attempts:
+    # an in-flight request is only bounded by the client timeout.
+    deadline: Optional[float] = None
+
+    def backoff(self, attempt_i: int, error: Optional[BaseException] = None) -> float:
+        if error is not None:
+            delay = retry_after(error)
+            if delay is not None:
+                return delay
+        # Exponential backoff with "full jitter"
+        delay = min(self.max_delay, self.base_delay*2**attempt_i)
+        return delay*(1 - self.jitter*random.random())
+
+    def remaining(self, start: float) -> float:
+        if self.deadline is None:
+            return float('inf')
+        return self.deadline - (time.monotonic() - start)
+
+@dataclass
+class HedgePolicy():
+    """Duplicate a request once it is slower than a percentile of the latencies seen.
+
+    The first valid answer is kept. Until min_samples latencies of the
+    model were seen, initial_delay is used, no hedging if it is None.
+    """
+    percentile: float = 95.
+    min_delay: float = 1. # seconds, no request is duplicated earlier
+    initial_delay: Optional[float] = None
+    min_samples: int = 20
+    window: int = 200 # latest latencies the percentile is computed on
+    max_hedges: int = 1 # duplicates per request
+    _latencies: Dict[str, Deque[float]] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def observe(self, model_entity: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault(model_entity, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, model_entity: str) -> Optional[float]:
+        """Seconds after which a request is duplicated, None for no hedging"""
+        with self._lock:
+            latencies = list(self._latencies.get(model_entity, ()))
+        if len(latencies) < self.min_samples:
+            return None if self.initial_delay is None else max(self.min_delay, self.initial_delay)
+        return max(self.min_delay, float(np.percentile(latencies, self.percentile)))
+
+@dataclass
+class ModelCounters():
+    calls: int = 0
+    attempts: int = 0
+    invalid_responses: int = 0
+    transient_errors: int = 0
+    failures: int = 0
+    total_latency: float = 0.
+    max_latency: float = 0.
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    hedges: int = 0 # duplicated requests
+    hedge_wins: int = 0 # answers given by a duplicate
+    hedges_cancelled: int = 0 # async requests cancelled once another answered
+    hedges_abandoned: int = 0 # threaded requests left running once another answered
+
+class ChatterMetrics():
+    def __init__(self):
+        self._counters: Dict[str, ModelCounters] = defaultdict(ModelCounters)
+        self._lock = threading.Lock()
+
+    def record(self, model_entity: str, **increments):
+        with self._lock:
+            counters = self._counters[model_entity]
+            for key, value in increments.items():
+                setattr(counters, key, getattr(counters, key) + value)
+
+    def record_latency(self, model_entity: str, latency: float):
+        with self._lock:
+            counters = self._counters[model_entity]
+            counters.total_latency += latency
+            counters.max_latency = max(counters.max_latency, latency)
+
+    def record_usage(self, model_entity: str, prompt_tokens: Optional[int],
+                     completion_tokens: Optional[int], cached_tokens: Optional[int]):
+        self.record(model_entity, prompt_tokens=prompt_tokens or 0,
+                    completion_tokens=completion_tokens or 0,
+                    cached_tokens=cached_tokens or 0)
+
+    def to_pandas(self) -> pd.DataFrame:
+        with self._lock:
+            # One row per model, each counter keeping its own dtype
+            metrics = pd.DataFrame([vars(counters).copy() for counters in self._counters.values()],
+                                   index=pd.Index(list(self._counters), name='model_entity'),
+                                   columns=[counter.name for counter in fields(ModelCounters)])
+        if not metrics.empty:
+            metrics['mean_latency'] = metrics.total_latency/metrics.attempts
+            metrics['cache_hit_ratio'] = metrics.cached_tokens/metrics.prompt_tokens.where(metrics.prompt_tokens > 0)
+        return metrics
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+# Shared by all chatters of the process
+metrics = ChatterMetrics()
@@ -0,0 +1,326 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from itertools import permutations
+import time
+import pandas as pd
+from ai_debater.io_database import IODataBase, insert_frame
+from ai_debater.job_queue import JobQueue
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.response_log import ResponseLog
+from ai_debater.models.registry import create_chatter, model_entity
+from ai_debater.context_strategy import ContextStrategy
+from ai_debater.debater_tools import debate, call_statistics, _discourse_id, TURN_STATISTICS
+from ai_debater.prompt_engineering import CoStar, TopicCreatorContext, DebaterContext, JudgesContext, PublicContext
+from ai_debater.prompt_interface import discourse2input, judgements_and_discourses2inputs
+from ai_debater.reparse import topics2frame
+
+# Stages in the order of the debate flow
+STAGES = ('topics', 'debate', 'judge', 'vote')
+# Stages of a single request per job, which may be run in batches:
+# the methods building the request and completing the job
+BATCH_STAGES = {
+    'judge': ('_judge_request', '_complete_judge'),
+    'vote': ('_vote_request', '_complete_vote'),
+}
+
+class Pipeline():
+    """Resumable runner of the debate flow over a persisted job queue.
+
+    Each topic generation, debate, judgement and vote is a job. The results
+    of a job are written in the transaction marking it done, so a job done
+    is never run again. Debates are checkpointed turn by turn and resumed
+    from their last turn.
+
+    Several pipelines, in processes or on machines with their own api keys,
+    may work on the same database: each job is leased to one worker_id and
+    taken over by another worker once the lease expired.
+
+    Models given by name, "Class|model", are only created when a job needs
+    them, so that enqueuing does not import the SDKs of the providers.
+    """
+    def __init__(self, result_manager: IODataBase, models: List[Union[BaseAiChatter, str]],
+                 response_log: Optional[ResponseLog] = None,
+                 n_round: int = 4,
+                 context: Optional[ContextStrategy] = None,
+                 max_attempt: int = 3,
+                 tournament_id: Optional[str] = None,
+                 worker_id: Optional[str] = None,
+                 lease_seconds: float = 900.):
+        self.result_manager = result_manager
+        self.connection = result_manager.connection
+        self.models: Dict[str, Optional[BaseAiChatter]] = {
+            model_entity(model) if isinstance(model, str) else model.model_entity:
+            None if isinstance(model, str) else model
+            for model in models}
+        self.response_log = response_log
+        self.n_round = n_round
+        self.context = context
+        self.tournament_id = tournament_id
+        self.queue = JobQueue(self.connection, max_attempt=max_attempt,
+                              worker_id=worker_id, lease_seconds=lease_seconds)
+        self._registered = set()
+
+    def _register(self, model: BaseAiChatter):
+        """Reuse the model_id of the model_entity, so that restarts resume the same work"""
+        if model.model_entity in self._registered:
+            return
+        self.result_manager.register_model(model)
+        self._registered.add(model.model_entity)
+
+    def model(self, model_entity: str, role: CoStar) -> BaseAiChatter:
+        if model_entity not in self.models:
+            raise NameError(f"No model given for {model_entity}")
+        model = self.models[model_entity]
+        if model is None:
+            model = self.models[model_entity] = create_chatter(model_entity)
+        self._register(model)
+        model.initialise(role, response_log=self.response_log)
+        return model
+
+    # Enqueuing, skipping the work already saved
+    def enqueue_topics(self) -> int:
+        topics = self.result_manager.load_topics()
+        done = set() if topics is None else set(topics.model_entity)
+        return self.queue.enqueue('topics', [dict(model_entity=entity)
+                                             for entity in self.models if entity not in done])
+
+    def enqueue_debates(self, topic_creators: Optional[List[str]] = None) -> int:
+        topics = self.result_manager.load_topics()
+        if topics is None:
+            return 0
+        if topic_creators is not None:
+            topics = topics.loc[topics.model_entity.isin(topic_creators)]
+        return self.queue.enqueue('debate', [
+            dict(topic_id=topic_id, prop=prop, oppo=oppo)
+            for topic_id in topics.topic_id
+            for prop, oppo in permutations(self.models, 2)
+            if not self.result_manager.is_debated(topic_id, prop, oppo)])
+
+    def enqueue_judgements(self) -> int:
+        competitions = self.result_manager.load_competitions()
+        if competitions is None:
+            return 0
+        return self.queue.enqueue('judge', [
+            dict(discourse_id=discourse_id, judge=judge)
+            for discourse_id in competitions.discourse_id
+            for judge in self.models
+            if not self.result_manager.is_judged(discourse_id, judge)])
+
+    def enqueue_votes(self) -> int:
+        judgements = self.result_manager.load_judgements()
+        if judgements is None:
+            return 0
+        return self.queue.enqueue('vote', [
+            dict(discourse_id=discourse_id, public=public)
+            for discourse_id in judgements.discourse_id.unique()
+            for public in self.models
+            if not self.result_manager.has_voted(discourse_id, public)])
+
+    def enqueue(self, stage: str, **kwargs) -> int:
+        enqueue = {'topics': self.enqueue_topics, 'debate': self.enqueue_debates,
+                   'judge': self.enqueue_judgements, 'vote': self.enqueue_votes}
+        if stage not in enqueue:
+            raise NameError(f"Unknown stage {stage}, expected one of {STAGES}")
+        return enqueue[stage](**kwargs)
+
+    # Jobs
+    def _complete(self, job_id: str, tables: Dict[str, pd.DataFrame], discourse_id: Optional[str] = None):
+        """Save the results and mark the job done, in one transaction"""
+        with self.connection:
+            for table_name, frame in tables.items():
+                insert_frame(self.connection, table_name, frame)
+            if discourse_id is not None:
+                self.connection.execute("DELETE FROM debate_checkpoints WHERE discourse_id = ?",
+                                        (discourse_id,))
+            self.queue.mark_done(job_id)
+
+    def _run_topics(self, job_id: str, model_entity: str):
+        model = self.model(model_entity, TopicCreatorContext())
+        topics = model.answer_until_valid([], request_id=model.model_id())
+        if topics is None:
+            raise NameError(f"{model_entity} gave no valid topics")
+        self._complete(job_id, {"topics": topics2frame({model.model_id(): topics})})
+
+    def _checkpoint(self, discourse_id: str, ith_argument: int, argument: str, turn_stats: Dict):
+        stats = [turn_stats.get(key) for key in TURN_STATISTICS]
+        with self.connection:
+            self.connection.execute(
+                f"""
+                INSERT OR REPLACE INTO debate_checkpoints
+                (discourse_id, ith_argument, Argument, {', '.join(TURN_STATISTICS)})
+                VALUES (?, ?, ?, {', '.join('?'*len(TURN_STATISTICS))})
+                """, (discourse_id, ith_argument, argument, *stats))
+
+    def _run_debate(self, job_id: str, topic_id: str, prop: str, oppo: str):
+        topic = pd.read_sql("SELECT * FROM topics WHERE topic_id = ?", self.connection,
+                            params=(topic_id,)).iloc[0]
+        prop = self.model(prop, DebaterContext())
+        oppo = self.model(oppo, DebaterContext())
+        discourse_id = _discourse_id(topic, prop, oppo)
+        checkpoints = pd.read_sql(
+            "SELECT * FROM debate_checkpoints WHERE discourse_id = ? ORDER BY ith_argument",
+            self.connection, params=(discourse_id,))
+        dim_discourse, fact_discourse = debate(
+            topic, prop, oppo, n_round=self.n_round,
+            tournament_id=self.tournament_id, context=self.context,
+            past_arguments=list(checkpoints.Argument),
+            past_turn_stats=checkpoints[TURN_STATISTICS].to_dict('records'),
+            on_turn=lambda ith_argument, argument, turn_stats:
+                self._checkpoint(discourse_id, ith_argument, argument, turn_stats))
+        self._complete(job_id, {"dim_discourse": dim_discourse.to_frame().transpose(),
+                                "fact_discourse": fact_discourse},
+                       discourse_id=discourse_id)
+
+    # Judge and vote jobs are a single request, answered one at a time or in batches
+    def _judge_request(self, discourse_id: str, judge: str) -> Tuple[BaseAiChatter, str, List[Dict], Dict]:
+        """Model, request_id and messages of a judge job, and what _complete_judge needs"""
+        judge = self.model(judge, JudgesContext())
+        judgement_id = judge.model_id()+':'+discourse_id
+        message = discourse2input(self.result_manager.load_discourse(discourse_id))
+        return judge, judgement_id, [message], dict(discourse_id=discourse_id)
+
+    def _complete_judge(self, job_id: str, judge: BaseAiChatter, judgement_id: str, result: pd.DataFrame,
+                        stats: Dict, discourse_id: str):
+        fact_judgements = result.copy().reset_index()
+        fact_judgements['judgement_id'] = judgement_id
+        dim_judgements = pd.Series({'judgement_id': judgement_id,
+                                    'discourse_id': discourse_id,
+                                    'model_id_judging': judge.model_id(),
+                                    **stats})
+        self._complete(job_id, {"dim_judgements": dim_judgements.to_frame().transpose(),
+                                "fact_judgements": fact_judgements})
+
+    def _vote_request(self, discourse_id: str, public: str) -> Tuple[BaseAiChatter, str, List[Dict], Dict]:
+        public = self.model(public, PublicContext())
+        public_voting_id = discourse_id+'|'+public.model_id()
+        inputs = judgements_and_discourses2inputs(
+            self.result_manager.load_judgements([discourse_id]),
+            self.result_manager.load_discourses([discourse_id]))
+        message, judgement_ids = inputs[discourse_id]
+        messages = [message,
+                    {'role': 'system', 'content': 'thank you for providing the information. In which format should I answer?'},
+                    {'role': 'user', 'content': 'Please give the judgement id as: <Judgement_ID></Judgement_ID>'}]
+        return public, public_voting_id, messages, dict(discourse_id=discourse_id, judgement_ids=judgement_ids)
+
+    def _complete_vote(self, job_id: str, public: BaseAiChatter, public_voting_id: str, result: pd.Series,
+                       stats: Dict, discourse_id: str, judgement_ids: List[str]):
+        fact_public = result.to_frame().transpose()
+        fact_public['public_voting_id'] = public_voting_id
+        dim_public = pd.Series({'public_voting_id': public_voting_id,
+                                'discourse_id': discourse_id,
+                                'public_model_id': public.model_id(),
+                                'judgement_ids': judgement_ids,
+                                **stats})
+        self._complete(job_id, {"dim_public": dim_public.to_frame().transpose(),
+                                "fact_public": fact_public})
+
+    def _run_request(self, job_id: str, stage: str, payload: Dict):
+        request, complete = BATCH_STAGES[stage]
+        model, request_id, messages, context = getattr(self, request)(**payload)
+        result = model.answer_until_valid(messages, request_id=request_id)
+        if result is None:
+            raise NameError(f"{model.model_entity} gave no valid answer to the {stage} job")
+        getattr(self, complete)(job_id, model, request_id, result, call_statistics(model), **context)
+
+    def _run_judge(self, job_id: str, discourse_id: str, judge: str):
+        self._run_request(job_id, 'judge', dict(discourse_id=discourse_id, judge=judge))
+
+    def _run_vote(self, job_id: str, discourse_id: str, public: str):
+        self._run_request(job_id, 'vote', dict(discourse_id=discourse_id, public=public))
+
+    def run_job(self, job_id: str, stage: str, payload: Dict):
+        run = {'topics': self._run_topics, 'debate': self._run_debate,
+               'judge': self._run_judge, 'vote': self._run_vote}
+        run[stage](job_id, **payload)
+
+    def _run_claimed(self, job_id: str, stage: str, payload: Dict):
+        try:
+            with self.queue.keep_lease(job_id):
+                self.run_job(job_id, stage, payload)
+        except Exception as error:
+            self.queue.fail(job_id, repr(error))
+
+    def run(self, stage: Optional[str] = None, max_jobs: Optional[int] = None) -> int:
+        """Run the pending jobs of stage (all stages by default), returns the number run"""
+        n_jobs = 0
+        while max_jobs is None or n_jobs < max_jobs:
+            job = self.queue.claim(stage)
+            if job is None:
+                break
+            self._run_claimed(*job)
+            n_jobs += 1
+        return n_jobs
+
+    def run_batch(self, stage: str, max_jobs: Optional[int] = None,
+                  poll_interval: float = 60., timeout: Optional[float] = 24*3600.) -> int:
+        """Run the pending jobs of stage, judge or vote, through the batch api of each model.
+
+        The jobs are claimed at once and leased until their batch ends; each
+        job is completed as its answer comes. Returns the number of jobs done.
+        """
+        if stage not in BATCH_STAGES:
+            raise NameError(f"No batch for the {stage} stage, expected one of {list(BATCH_STAGES)}")
+        request, complete = BATCH_STAGES[stage]
+        jobs = []
+        while max_jobs is None or len(jobs) < max_jobs:
+            job = self.queue.claim(stage)
+            if job is None:
+                break
+            jobs.append(job)
+        # Requests by model entity: request_id -> (job_id, messages, context)
+        batches: Dict[str, Dict[str, Tuple[str, List[Dict], Dict]]] = {}
+        for job_id, _, payload in jobs:
+            try:
+                model, request_id, messages, context = getattr(self, request)(**payload)
+            except Exception as error:
+                self.queue.fail(job_id, repr(error))
+                continue
+            batches.setdefault(model.model_entity, {})[request_id] = (job_id, messages, context)
+        n_done = 0
+        with self.queue.keep_lease(*[job_id for job_id, _, _ in jobs]):
+            for entity, requests in batches.items():
+                model = self.models[entity]
+                done = set()
+                def on_answer(request_id: str, result, stats: Dict):
+                    job_id, _, context = requests[request_id]
+                    try:
+                        getattr(self, complete)(job_id, model, request_id, result, stats, **context)
+                        done.add(request_id)
+                    except Exception as error:
+                        self.queue.fail(job_id, repr(error))
+                error = NameError(f"{entity} gave no valid answer to the {stage} job in its batches")
+                try:
+                    model.answer_batch({request_id: messages for request_id, (_, messages, _) in requests.items()},
+                                       poll_interval=poll_interval, timeout=timeout, on_answer=on_answer)
+                except Exception as batch_error:
+                    error = batch_error
+                # Failed jobs, already failed ones are left as they are
+                for request_id, (job_id, _, _) in requests.items():
+                    if request_id not in done:
+                        self.queue.fail(job_id, repr(error))
+                n_done += len(done)
+        return n_done
+
+    def work(self, stages: Iterable[str] = ('debate', 'judge', 'vote'),
+             poll_interval: float = 10., max_idle: Optional[float] = None) -> int:
+        """Worker mode: run the jobs of stages as they come, returns the number run.
+
+        While other workers still run jobs, the worker waits, to take over
+        the jobs of workers lost. It stops once no job of stages is pending
+        or running, or after max_idle seconds without a job.
+        """
+        stages = tuple(stages)
+        n_jobs = 0
+        idle_since = time.monotonic()
+        while True:
+            job = self.queue.claim(stages)
+            if job is not None:
+                self._run_claimed(*job)
+                n_jobs += 1
+                idle_since = time.monotonic()
+                continue
+            if self.queue.n_active(stages) == 0:
+                break
+            if max_idle is not None and time.monotonic() - idle_since > max_idle:
+                break
+            time.sleep(poll_interval)
+        return n_jobs
@@ -1,18 +1,31 @@
-from typing import Optional, Union
+from typing import List, Optional, Tuple, Union
 from dataclasses import dataclass, field
-import xmltodict
+from lxml import etree
 
 import pandas as pd
 
 from abc import ABC, abstractmethod
 
+# Responses are untrusted: no entity expansion nor network access
+_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+def parse_xml(xml: str) -> etree._Element:
+    return etree.fromstring(xml.encode('utf-8'), parser=_XML_PARSER)
+
 def xml_is_valid(xml: str) -> bool:
     try:
-        _ = xmltodict.parse(xml)
-    except xmltodict.expat.ExpatError:
+        _ = parse_xml(xml)
+    except etree.XMLSyntaxError:
         return False
     return True
 
+def element_text(element: Optional[etree._Element]) -> Optional[str]:
+    """Stripped text of an element and its children, None when empty"""
+    if element is None:
+        return None
+    text = ''.join(element.itertext()).strip()
+    return text if text else None
+
 @dataclass
 class CoStar(ABC):
     context: Optional[str] = field(default=None, init=False)
@@ -42,12 +55,20 @@ class CoStar(ABC):
     def wrap_xmlresponse(self, response: str) -> str:
         return f"""<?xml version="1.0"?><data>{response}</data>"""
     
-    def response_is_valid(self, response: str) -> bool:
+    def parse_response(self, response: str) -> etree._Element:
+        return parse_xml(self.wrap_xmlresponse(response))
+
+    def validate_and_convert(self, response: str) -> Tuple[bool, Optional[Union[pd.DataFrame, pd.Series, str]]]:
+        """Validity and output of a response, parsing it only once"""
         try:
-            self.response2output(response)
+            output = self.response2output(response)
         except Exception:
-            return False
-        return True
+            return False, None
+        return True, output
+
+    def response_is_valid(self, response: str) -> bool:
+        valid, _ = self.validate_and_convert(response)
+        return valid
 
     @abstractmethod
     def response2output(self, response: str) -> Optional[Union[pd.DataFrame, pd.Series, str]]: ...
@@ -89,8 +110,12 @@ Assume a readership with varying levels of experience in debate and a desire to
 """
     
     def response2output(self, response: str) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
-        data = xmltodict.parse(self.wrap_xmlresponse(response))
-        df = pd.DataFrame(data['data']).Topic.apply(pd.Series)
+        topics = self.parse_response(response).findall('Topic')
+        if not topics:
+            raise NameError("No topic in response")
+        df = pd.DataFrame({
+            "Subject": [element_text(topic.find('Subject')) for topic in topics],
+            "Rational": [element_text(topic.find('Rational')) for topic in topics]})
         df.index.name = 'ith_topic'
         return df
 
@@ -129,6 +154,46 @@ A one paragraph argument
         raise NameError("Response is empty")
 
 
+@dataclass
+class SummariserContext(CoStar):
+    context = \
+"""
+The context is a long debate between a proposing and an opposing team. The earliest arguments are replaced by a summary to keep the debate short.
+"""
+    objective = \
+"""
+Your objective is to summarise the debate so far: the previous summary, if any, followed by the new arguments.
+Keep the main arguments and rebuttals of each team, and which team made them.
+"""
+    style = \
+"""
+Write in a concise and neutral style, without taking side.
+"""
+    tone = \
+"""
+Maintain a factual tone.
+"""
+    audience = \
+"""
+The debaters, who will continue the debate from your summary.
+"""
+    input_format = \
+"""
+<Summary></Summary>
+<Argument><Team></Team><Text></Text></Argument>
+...
+<Argument><Team></Team><Text></Text></Argument>
+"""
+    response_format = \
+"""
+A summary of at most two paragraphs
+"""
+    def response2output(self, response: str) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
+        if len(response):
+            return response
+        raise NameError("Response is empty")
+
+
 @dataclass
 class JudgesContext(CoStar):
     context = \
@@ -209,10 +274,31 @@ Assume a readership with a background in debate or a keen interest in developing
 </TeamworkAndRoles>
 """
     def response2output(self, response: str) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
-        data = xmltodict.parse(self.wrap_xmlresponse(response))['data']
-        df = pd.DataFrame(data).loc['Team'].explode().apply(pd.Series)
-        df['Score'] = df.Score.apply(lambda x: float(x['#text'])/float(x['@max_score']))
-        df.index.name = 'Categories'
+        # Columns are filled in a single walk over the categories and their teams
+        categories: List[str] = []
+        team_ids: List[Optional[str]] = []
+        scores: List[float] = []
+        rationals: List[Optional[str]] = []
+        for category in self.parse_response(response):
+            if not isinstance(category.tag, str):
+                continue # comments and processing instructions
+            teams = category.findall('Team')
+            if not teams:
+                raise NameError(f"No team in {category.tag}")
+            category_team_ids = [element_text(team.find('Team_ID')) for team in teams]
+            # fact_judgements holds one score per category and team
+            if len(set(category_team_ids)) < len(category_team_ids):
+                raise NameError(f"Team scored twice in {category.tag}")
+            for team, team_id in zip(teams, category_team_ids):
+                score = team.find('Score')
+                categories.append(category.tag)
+                team_ids.append(team_id)
+                scores.append(float(score.text)/float(score.get('max_score')))
+                rationals.append(element_text(team.find('Rational')))
+        if not categories:
+            raise NameError("No category in response")
+        df = pd.DataFrame({"Team_ID": team_ids, "Score": scores, "Rational": rationals},
+                          index=pd.Index(categories, name='Categories'))
         return df
 
 @dataclass
@@ -244,7 +330,8 @@ Your objective is to evaluate which judge judgment is most appropriate.
 <Judgement_ID></Judgement_ID>
 """
     def response2output(self, response: str) -> Optional[Union[pd.DataFrame, pd.Series, str]]:
-        data = xmltodict.parse(self.wrap_xmlresponse(response))['data']
-        df = pd.Series(data)
-        df = pd.Series(data=df.loc["Judgement_ID"], index=["Judgement_ID"])
+        judgement_id = self.parse_response(response).find("Judgement_ID")
+        if judgement_id is None:
+            raise NameError("No Judgement_ID in response")
+        df = pd.Series(data=element_text(judgement_id), index=["Judgement_ID"])
         return df
\ No newline at end of file
@@ -1,5 +1,6 @@
-from typing import List, Dict,Tuple
+from typing import List, Dict, Optional, Tuple
 import numpy as np
+import pandas as pd
 
 def topic2message(topic) -> Dict[str, str]:
     return {"role": "user", 
@@ -15,44 +16,72 @@ def discourse2messages(discourse: List[str], for_opponent: bool = False) -> List
         messages.append({"role": role, "content": d})
     return messages
 
+def _as_text(column: pd.Series) -> pd.Series:
+    # Same formatting as an f-string of each value
+    return column.astype(object).map(str)
+
+def discourses2inputs(discourses: pd.DataFrame) -> pd.Series:
+    """Judge input text of each discourse, indexed by discourse_id"""
+    discourses = discourses.sort_values(by=['discourse_id', 'ith_argument'], kind='stable')
+    arguments = "<Argument>" \
+        + "<Number>" + _as_text(discourses.ith_argument) + "</Number>" \
+        + "<Team_ID>" + _as_text(discourses.model_speaking) + "</Team_ID>" \
+        + "<Text>" + _as_text(discourses.Argument) + "</Text>" \
+        + "</Argument>\n"
+    texts = arguments.groupby(discourses.discourse_id, sort=False).agg(''.join)
+    return "<Discourse>\n" + texts + "</Discourse>\n"
+
 def discourse2input(discourse) -> Dict[str,str]:
     assert discourse.discourse_id.unique().shape[0]==1, 'Too many discourses'
-    message = "<Discourse>\n"
-    for _, row in discourse.sort_values(by='ith_argument').iterrows():
-        message += "<Argument>"
-        message += f"<Number>{row.ith_argument}</Number>"
-        message += f"<Team_ID>{row.model_speaking}</Team_ID>"
-        message += f"<Text>{row.Argument}</Text>"
-        message +="</Argument>\n"
-    message += "</Discourse>\n"
     return {"role": "user", 
-            "content": message}
+            "content": discourses2inputs(discourse).iloc[0]}
+
+def judgements2verdicts(judgements: pd.DataFrame) -> pd.Series:
+    """Verdict text of each judgement, indexed by judgement_id"""
+    if judgements.duplicated(["judgement_id", "Categories", "Team_ID"]).any():
+        raise NameError("Too many values")
+    judgements = judgements.sort_values(by=["judgement_id", "Categories", "Team_ID"], kind='stable')
+    teams = "<Team_ID>" + _as_text(judgements.Team_ID) + "</Team_ID>" \
+        + "<Score>" + _as_text(judgements.Score) + "</Score>" \
+        + "<Rational>" + _as_text(judgements.Rational) + "</Rational>"
+    categories = teams.groupby([judgements.judgement_id, judgements.Categories], sort=False).agg(''.join)
+    categories_name = categories.index.get_level_values("Categories")
+    categories = "<" + categories_name + ">" + "<Team>" + categories + "</Team>" + "</" + categories_name + ">\n"
+    verdicts = categories.groupby(level="judgement_id", sort=False).agg(''.join)
+    return "<Verdict>" + "<Judgement_ID>" + verdicts.index + "</Judgement_ID>" + verdicts + "</Verdict>"
 
-def judgement_and_discourse2input(discourse_id, result_manager) -> Tuple[Dict[str, str], List[str]]:
-    judgements = result_manager.load_judgements()
+def judgements_and_discourses2inputs(judgements: pd.DataFrame, discourses: pd.DataFrame,
+                                     judges: Optional[np.ndarray] = None) -> Dict[str, Tuple[Dict[str, str], np.ndarray]]:
+    """Public input and judgement ids of every judged discourse, built in one pass.
+
+    judgements as returned by IODataBase.load_judgements and discourses by
+    IODataBase.load_discourses, restricted to the discourses of interest.
+    Every discourse is expected to be judged by all judges, by default the
+    ones of judgements.
+    """
+    if judges is None:
+        judges = judgements.judge_entity.unique()
+    discourse_judges = judgements.drop_duplicates(["discourse_id", "judge_entity"])
+    discourse_judges = discourse_judges.groupby("discourse_id", sort=False).judge_entity.agg(list)
+    if not all(len(j) == len(judges) and np.all(judges == np.array(j)) for j in discourse_judges):
+        raise AssertionError("Problem with the judges")
+    verdicts = judgements2verdicts(judgements)
+    texts = discourses2inputs(discourses)
+    judgement_ids = judgements.drop_duplicates("judgement_id")
+    judgement_ids = judgement_ids.groupby("discourse_id", sort=False).judgement_id.agg(list)
+    inputs = {}
+    for discourse_id, ids in judgement_ids.items():
+        ids = np.asarray(ids, dtype=object)
+        text = texts.loc[discourse_id] + "".join(verdicts.loc[ids])
+        inputs[discourse_id] = ({"role": "user", "content": text}, ids)
+    return inputs
+
+def judgement_and_discourse2input(discourse_id, result_manager, judgements=None, discourse=None) -> Tuple[Dict[str, str], List[str]]:
+    if judgements is None:
+        judgements = result_manager.load_judgements(discourse_ids=[discourse_id])
     judges = judgements.judge_entity.unique()
-    selection = judgements.loc[judgements.discourse_id==discourse_id]
-    assert np.all(judges == selection.judge_entity.unique()), "Problem with the judges"
-    judgement_ids = selection.judgement_id.unique()
-    discourse = result_manager.load_discourse(discourse_id)
-    text = discourse2input(discourse)['content']
-    for judgement_id in judgement_ids:
-        selection = selection.loc[selection.judgement_id == selection.judgement_id.iloc[0]]
-        text += "<Verdict>"
-        text += f"<Judgement_ID>{judgement_id}</Judgement_ID>"
-        for cat, row in selection.loc[:,["Categories","Team_ID","Score", "Rational"]].groupby("Categories"):
-            text += f"<{cat}>"
-            text += "<Team>"
-            for team, score in row.groupby("Team_ID"):
-                text += f"<Team_ID>{team}</Team_ID>"
-                for key in ["Score", "Rational"]:
-                    val = score.loc[:,key].values
-                    if len(val)!=1:
-                        raise NameError("Too many values")
-                    val = val[0]
-                    text += f"<{key}>{val}</{key}>"
-            text += "</Team>"
-            text += f"</{cat}>\n"
-        text += "</Verdict>"
-    return {"role": "user", 
-            "content": text}, judgement_ids
+    judgements = judgements.loc[judgements.discourse_id == discourse_id]
+    if discourse is None:
+        discourse = result_manager.load_discourse(discourse_id)
+    discourse = discourse.loc[discourse.discourse_id == discourse_id]
+    return judgements_and_discourses2inputs(judgements, discourse, judges=judges)[discourse_id]
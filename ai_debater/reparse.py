@@ -0,0 +1,119 @@
+from typing import Dict, Iterable, Union
+import warnings
+import pandas as pd
+from ai_debater.io_database import IODataBase, frame2rows, insert_frame
+from ai_debater.models.response_log import ResponseLog
+from ai_debater.prompt_engineering import CoStar, TopicCreatorContext, JudgesContext, PublicContext
+
+def parse_responses(responses: pd.DataFrame, costar: CoStar) -> Dict[str, Union[pd.DataFrame, pd.Series]]:
+    """Output of the latest response of each request that costar parses as valid.
+
+    Responses that were invalid when received are parsed again as well,
+    so that a fixed parser recovers the requests that failed.
+    """
+    outputs = {}
+    # Newest first: the first valid response of a request is kept
+    for request_id, response in zip(responses.request_id.values[::-1],
+                                    responses.response.values[::-1]):
+        if request_id is None or request_id in outputs:
+            continue
+        valid, output = costar.validate_and_convert(response)
+        if valid:
+            outputs[request_id] = output
+    return outputs
+
+def topics2frame(topics: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Topics table from the topics created by each model_id"""
+    topics = pd.concat(topics)
+    topics.index.names = ['model_id', topics.index.names[-1]]
+    topics = topics.reset_index()
+    topics['topic_id'] = topics['model_id'] + '-' + topics['ith_topic'].astype(str)
+    return topics
+
+def judgements2frame(judgements: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """fact_judgements table from the output of each judgement_id"""
+    fact_judgements = pd.concat(judgements, names=['judgement_id']).reset_index()
+    return fact_judgements[['judgement_id', 'Categories', 'Team_ID', 'Score', 'Rational']]
+
+def votes2frame(votes: Dict[str, pd.Series]) -> pd.DataFrame:
+    """fact_public table from the output of each public_voting_id"""
+    fact_public = pd.DataFrame(votes).transpose()
+    fact_public.index.name = 'public_voting_id'
+    return fact_public.reset_index()
+
+def replace_rows(connection, table_name: str, key: str, frame: pd.DataFrame):
+    """Replace the rows of table_name for the keys found in frame, in one transaction"""
+    with connection:
+        connection.executemany(f"DELETE FROM '{table_name}' WHERE {key} = ?",
+                               [(k,) for k in frame[key].unique()])
+        insert_frame(connection, table_name, frame)
+
+def update_topics(connection, topics: pd.DataFrame):
+    """Update the topics of the model_ids found in topics in place, in one transaction.
+
+    dim_discourse refers to the topic_ids: they are upserted rather than
+    deleted and inserted again, and a topic no longer parsed is only
+    dropped if no debate was held on it.
+    """
+    columns = ', '.join(f'"{c}"' for c in topics.columns)
+    updates = ', '.join(f'"{c}" = excluded."{c}"' for c in topics.columns if c != 'topic_id')
+    model_ids = list(topics.model_id.unique())
+    selected = ', '.join('?'*len(model_ids))
+    with connection:
+        stale = {row[0] for row in connection.execute(
+            f"SELECT topic_id FROM topics WHERE model_id IN ({selected})", model_ids)} - set(topics.topic_id)
+        connection.executemany(
+            f"""
+            INSERT INTO topics ({columns}) VALUES ({', '.join('?'*topics.shape[1])})
+            ON CONFLICT (topic_id) DO UPDATE SET {updates}
+            """, frame2rows(topics))
+        debated = {row[0] for row in connection.execute(
+            f"SELECT DISTINCT topic_id FROM dim_discourse WHERE topic_id IN ({', '.join('?'*len(stale))})",
+            list(stale))}
+        if debated:
+            warnings.warn(f"{len(debated)} topics no longer parsed are kept, debates were held on them")
+        connection.executemany("DELETE FROM topics WHERE topic_id = ?", [(t,) for t in stale - debated])
+
+def _known_ids(result_manager: IODataBase, table_name: str, key: str) -> Iterable[str]:
+    return {row[0] for row in result_manager.connection.execute(f"SELECT {key} FROM '{table_name}'")}
+
+def _reparse(result_manager: IODataBase, response_log: ResponseLog, costar: CoStar,
+             dim_table: str, key: str) -> Dict[str, Union[pd.DataFrame, pd.Series]]:
+    # Only results whose dimension was saved can be regenerated
+    responses = response_log.load(type(costar).__name__)
+    responses = responses.loc[responses.request_id.isin(_known_ids(result_manager, dim_table, key))]
+    return parse_responses(responses, costar)
+
+def reparse_topics(result_manager: IODataBase, response_log: ResponseLog) -> pd.DataFrame:
+    outputs = _reparse(result_manager, response_log, TopicCreatorContext(), 'model_infos', 'model_id')
+    if not outputs:
+        return pd.DataFrame()
+    topics = topics2frame(outputs)
+    update_topics(result_manager.connection, topics)
+    return topics
+
+def reparse_judgements(result_manager: IODataBase, response_log: ResponseLog) -> pd.DataFrame:
+    outputs = _reparse(result_manager, response_log, JudgesContext(), 'dim_judgements', 'judgement_id')
+    if not outputs:
+        return pd.DataFrame()
+    fact_judgements = judgements2frame(outputs)
+    replace_rows(result_manager.connection, 'fact_judgements', 'judgement_id', fact_judgements)
+    return fact_judgements
+
+def reparse_public(result_manager: IODataBase, response_log: ResponseLog) -> pd.DataFrame:
+    outputs = _reparse(result_manager, response_log, PublicContext(), 'dim_public', 'public_voting_id')
+    if not outputs:
+        return pd.DataFrame()
+    fact_public = votes2frame(outputs)
+    replace_rows(result_manager.connection, 'fact_public', 'public_voting_id', fact_public)
+    return fact_public
+
+def reparse_all(result_manager: IODataBase, response_log: ResponseLog) -> Dict[str, int]:
+    """Regenerate topics, fact_judgements and fact_public from the logged responses.
+
+    No model is called: the results are derived again from the raw text
+    stored by the chatters. Returns the number of rows written per table.
+    """
+    return {"topics": reparse_topics(result_manager, response_log).shape[0],
+            "fact_judgements": reparse_judgements(result_manager, response_log).shape[0],
+            "fact_public": reparse_public(result_manager, response_log).shape[0]}
@@ -0,0 +1,161 @@
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import permutations, product
+import threading
+import uuid
+import pandas as pd
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.debater_tools import debate, save_debate
+from ai_debater.io_database import ResultsWriter
+from ai_debater.context_strategy import ContextStrategy
+
+# Number of debates a provider may take part in at the same time.
+# Turns of a debate are sequential, so it is as well the number of
+# requests in flight towards the provider.
+DEFAULT_PROVIDER_LIMITS = {
+    "OpenAIChatter": 8,
+    "MistralAIChatter": 4,
+    "Claude3AiChatter": 4,
+    "GeminiChatter": 4,
+}
+
+class Tournament():
+    def __init__(self, connection,
+                 provider_limits: Optional[Dict[str, int]] = None,
+                 max_workers: int = 16,
+                 n_round: int = 4,
+                 stream: bool = False,
+                 on_token: Optional[Callable[[str, int, str], None]] = None,
+                 tournament_id: Optional[str] = None,
+                 context: Optional[ContextStrategy] = None):
+        self.connection = connection
+        # Saved with each debate, to account usage per tournament
+        self.tournament_id = uuid.uuid4().hex if tournament_id is None else tournament_id
+        self.provider_limits = DEFAULT_PROVIDER_LIMITS.copy()
+        if provider_limits is not None:
+            self.provider_limits.update(provider_limits)
+        if any(limit < 1 for limit in self.provider_limits.values()):
+            raise NameError("Provider limits must allow at least one debate")
+        self.max_workers = max_workers
+        self.n_round = n_round
+        self.stream = stream
+        self.on_token = on_token
+        self.context = context
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+
+    @staticmethod
+    def provider(model: BaseAiChatter) -> str:
+        return model.provider_name
+
+    def _semaphore(self, provider: str) -> threading.Semaphore:
+        with self._semaphores_lock:
+            if provider not in self._semaphores:
+                limit = self.provider_limits.get(provider, 1)
+                self._semaphores[provider] = threading.BoundedSemaphore(limit)
+            return self._semaphores[provider]
+
+    def _try_acquire(self, providers: List[str]) -> bool:
+        """Take a slot of every provider, or none of them"""
+        taken = []
+        for provider in providers:
+            if not self._semaphore(provider).acquire(blocking=False):
+                for provider in taken:
+                    self._semaphore(provider).release()
+                return False
+            taken.append(provider)
+        return True
+
+    def _debate(self, topic: pd.Series, prop: BaseAiChatter, oppo: BaseAiChatter, providers: List[str]):
+        try:
+            return debate(topic, prop, oppo, n_round=self.n_round,
+                          stream=self.stream, on_token=self.on_token,
+                          tournament_id=self.tournament_id, context=self.context)
+        finally:
+            for provider in providers:
+                self._semaphore(provider).release()
+
+    def run(self, topics: pd.DataFrame, models: List[BaseAiChatter],
+            skip: Optional[Callable[[pd.Series, BaseAiChatter, BaseAiChatter], bool]] = None,
+            on_done: Optional[Callable[[pd.Series], None]] = None) -> pd.DataFrame:
+        """Debate every topic between every ordered pair of models.
+
+        Debates run on a thread pool, whereas their results are written
+        to the database from the calling thread only, one debate at a time.
+        Returns one row per pairing with its discourse_id or the error raised.
+        A debate is reported, to on_done as well, once it is committed: with
+        a ResultsWriter, when the batch holding it is flushed.
+        """
+        pairings = [(topic, prop, oppo)
+                    for (_, topic), (prop, oppo) in product(topics.iterrows(), permutations(models, 2))
+                    if skip is None or not skip(topic, prop, oppo)]
+        report = []
+        unsaved = {} # on_saved of the debates not committed yet, by discourse_id
+        def reporter(status: pd.Series, discourse_id: Optional[str] = None):
+            def on_saved(error: Optional[BaseException]):
+                unsaved.pop(discourse_id, None)
+                if error is None:
+                    status['discourse_id'] = discourse_id
+                else:
+                    status['error'] = repr(error)
+                report.append(status)
+                if on_done is not None:
+                    on_done(status)
+            return on_saved
+        def on_debated(future, topic: pd.Series, prop: BaseAiChatter, oppo: BaseAiChatter):
+            status = pd.Series(dict(topic_id=topic.topic_id,
+                                    model_proposing_entity=prop.model_entity,
+                                    model_opposing_entity=oppo.model_entity,
+                                    discourse_id=None,
+                                    error=None))
+            try:
+                dim_discourse, fact_discourse = future.result()
+            except Exception as error:
+                reporter(status)(error)
+                return
+            discourse_id = dim_discourse.discourse_id
+            unsaved[discourse_id] = reporter(status, discourse_id)
+            try:
+                save_debate(dim_discourse, fact_discourse, self.connection,
+                            on_saved=unsaved[discourse_id])
+            except Exception:
+                pass # reported to each debate of the failed transaction
+        # A debate is submitted only once both of its providers have a free
+        # slot, so that debates waiting for a busy provider never hold a
+        # worker while debates between idle providers could run.
+        waiting = [(topic, prop, oppo, sorted({self.provider(prop), self.provider(oppo)}))
+                   for topic, prop, oppo in pairings]
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while waiting or futures:
+                still_waiting = []
+                for topic, prop, oppo, providers in waiting:
+                    if len(futures) < self.max_workers and self._try_acquire(providers):
+                        future = executor.submit(self._debate, topic, prop, oppo, providers)
+                        futures[future] = (topic, prop, oppo)
+                    else:
+                        still_waiting.append((topic, prop, oppo, providers))
+                waiting = still_waiting
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_debated(future, *futures.pop(future))
+        flush_error = None
+        if isinstance(self.connection, ResultsWriter):
+            try:
+                self.connection.flush()
+            except Exception as error:
+                flush_error = error
+        for on_saved in list(unsaved.values()):
+            on_saved(flush_error or NameError("Debate not written"))
+        return pd.DataFrame(report, columns=['topic_id', 'model_proposing_entity',
+                                             'model_opposing_entity', 'discourse_id', 'error'])
+
+def run_tournament(topics: pd.DataFrame, models: List[BaseAiChatter], connection,
+                   n_round=4, max_workers=16, provider_limits=None,
+                   skip=None, on_done=None, stream=False, on_token=None,
+                   tournament_id=None, context=None) -> pd.DataFrame:
+    tournament = Tournament(connection, provider_limits=provider_limits,
+                            max_workers=max_workers, n_round=n_round,
+                            stream=stream, on_token=on_token,
+                            tournament_id=tournament_id, context=context)
+    return tournament.run(topics, models, skip=skip, on_done=on_done)
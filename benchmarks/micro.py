@@ -0,0 +1,155 @@
+"""Micro-benchmarks of the CPU side hot paths, with regression thresholds.
+
+In the style of asv: each time_* function is timed on a synthetic database
+(generated once and kept in benchmarks/.data) after its setup_* function,
+if any. The best of --repeat runs is compared to benchmarks/thresholds.json;
+a benchmark slower than its threshold fails the run.
+
+    python benchmarks/micro.py                       # check against the thresholds
+    python benchmarks/micro.py --preset medium -k load
+    python benchmarks/micro.py --update-thresholds   # after an intended change
+"""
+from typing import Callable, Dict, Optional
+import argparse
+import json
+import os
+import sys
+import timeit
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+from ai_debater.io_database import IODataBase
+from ai_debater.prompt_engineering import JudgesContext
+from ai_debater.prompt_interface import discourse2input, judgement_and_discourse2input, judgements_and_discourses2inputs
+from synthetic_db import PRESETS, CATEGORIES, generate
+
+THRESHOLDS = os.path.join(BENCHMARKS_DIR, 'thresholds.json')
+# Margin given to the timings measured by --update-thresholds, for the
+# thresholds to hold on slower machines and noisy runs
+THRESHOLD_MARGIN = 3.
+
+class State():
+    """What the benchmarks share: the database and a few ids out of it"""
+    def __init__(self, db_name: str):
+        self.result_manager = IODataBase(db_name)
+        competitions = self.result_manager.load_competitions()
+        self.discourse_id = competitions.discourse_id.iloc[len(competitions)//2]
+        self.discourse_ids = list(competitions.discourse_id.iloc[:100])
+        self.judges = self.result_manager.load_judgements([self.discourse_id]).judge_entity.unique()
+        self.judges_context = JudgesContext()
+        self.judgement_response = ''.join(
+            f"<{category}>"
+            + ''.join(f"<Team><Team_ID>{team}</Team_ID><Score max_score=\"100\">{score}</Score>"
+                      f"<Rational>Because the evidence given was convincing</Rational></Team>"
+                      for team, score in (('model0', 71), ('model1', 64)))
+            + f"</{category}>" for category in CATEGORIES)
+
+# Benchmarks, by name: (function of the state, setup of the state or None)
+def time_load_topics(state: State):
+    state.result_manager.load_topics()
+
+def time_load_competitions(state: State):
+    state.result_manager.load_competitions()
+
+def time_load_discourse(state: State):
+    state.result_manager.load_discourse(state.discourse_id)
+
+def time_load_discourses(state: State):
+    state.result_manager.load_discourses(state.discourse_ids)
+
+def time_load_judgements(state: State):
+    state.result_manager.load_judgements(state.discourse_ids)
+
+def time_load_judgements_for_analyses(state: State):
+    state.result_manager.load_judgements_for_analyses()
+
+def time_load_votes_for_analyses(state: State):
+    state.result_manager.load_votes_for_analyses()
+
+def time_load_usage(state: State):
+    state.result_manager.load_usage()
+
+def setup_discourse2input(state: State):
+    state.discourse = state.result_manager.load_discourse(state.discourse_id)
+
+def time_discourse2input(state: State):
+    discourse2input(state.discourse)
+
+def time_judgement_and_discourse2input(state: State):
+    judgement_and_discourse2input(state.discourse_id, state.result_manager)
+
+def setup_judgements_and_discourses2inputs(state: State):
+    state.judgements = state.result_manager.load_judgements(state.discourse_ids)
+    state.discourses = state.result_manager.load_discourses(state.discourse_ids)
+
+def time_judgements_and_discourses2inputs(state: State):
+    judgements_and_discourses2inputs(state.judgements, state.discourses, judges=state.judges)
+
+def time_judges_response2output(state: State):
+    state.judges_context.response2output(state.judgement_response)
+
+def benchmarks() -> Dict[str, Callable[[State], None]]:
+    return {name[len('time_'):]: function for name, function in globals().items()
+            if name.startswith('time_') and callable(function)}
+
+def database(preset: str) -> str:
+    db_name = os.path.join(BENCHMARKS_DIR, '.data', f'{preset}.db')
+    if not os.path.exists(db_name):
+        os.makedirs(os.path.dirname(db_name), exist_ok=True)
+        generate(db_name, **PRESETS[preset])
+    return db_name
+
+def measure(function: Callable[[State], None], state: State, repeat: int) -> float:
+    """Best time of a call, over repeat runs of enough calls to last ~0.2s"""
+    timer = timeit.Timer(lambda: function(state))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number))/number
+
+def run(preset: str = 'small', pattern: Optional[str] = None, repeat: int = 5) -> pd.DataFrame:
+    state = State(database(preset))
+    timings = {}
+    for name, function in benchmarks().items():
+        if pattern is not None and pattern not in name:
+            continue
+        setup = globals().get('setup_' + name)
+        if setup is not None:
+            setup(state)
+        timings[name] = measure(function, state, repeat)
+    return pd.DataFrame({'seconds': pd.Series(timings)})
+
+def load_thresholds() -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(THRESHOLDS):
+        return {}
+    with open(THRESHOLDS) as f:
+        return json.load(f)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preset', choices=list(PRESETS), default='small')
+    parser.add_argument('-k', dest='pattern', default=None, help='only the benchmarks whose name contains it')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--update-thresholds', action='store_true')
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    timings = run(args.preset, args.pattern, args.repeat)
+    thresholds = load_thresholds()
+    if args.update_thresholds:
+        thresholds.setdefault(args.preset, {}).update(
+            {name: float(f"{seconds*THRESHOLD_MARGIN:.3g}") for name, seconds in timings.seconds.items()})
+        with open(THRESHOLDS, 'w') as f:
+            json.dump(thresholds, f, indent=2, sort_keys=True)
+            f.write('\n')
+    timings['threshold'] = timings.index.map(thresholds.get(args.preset, {}))
+    timings['ratio'] = timings.seconds/timings.threshold
+    timings['regression'] = timings.ratio > 1
+    print(timings.to_string(float_format=lambda x: f"{x:.3g}"))
+    if timings.regression.any():
+        print(f"Slower than their threshold: {', '.join(timings.index[timings.regression])}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
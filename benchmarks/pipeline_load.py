@@ -0,0 +1,234 @@
+"""End-to-end load benchmark of the debate flow against fake providers.
+
+Runs topic generation, the debates, judging and voting with FakeChatter
+stand-ins of the four providers, and reports the throughput of each stage,
+the p50/p99 latency of the calls and the time spent writing to the database.
+
+    python benchmarks/pipeline_load.py --n-topics 4 --time-scale 0.01
+"""
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ai_debater.debater_tools import call_statistics
+from ai_debater.io_database import IODataBase, ResultsWriter
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.fake_chatter import FakeChatter, FAKE_PROVIDERS
+from ai_debater.models.retry_policy import RetryPolicy, HedgePolicy, metrics
+from ai_debater.prompt_engineering import TopicCreatorContext, DebaterContext, JudgesContext, PublicContext
+from ai_debater.prompt_interface import discourses2inputs, judgements_and_discourses2inputs
+from ai_debater.reparse import topics2frame
+from ai_debater.tournament import run_tournament
+
+class TimedWriter(ResultsWriter):
+    """ResultsWriter accounting the time spent in the database"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_time = 0.
+        self.n_flushes = 0
+
+    def flush(self):
+        with self._lock:
+            tic = time.perf_counter()
+            super().flush()
+            self.write_time += time.perf_counter() - tic
+            self.n_flushes += 1
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--providers', nargs='+', choices=list(FAKE_PROVIDERS), default=list(FAKE_PROVIDERS))
+    parser.add_argument('--n-topics', type=int, default=2, help='topics debated per topic creator')
+    parser.add_argument('--n-round', type=int, default=4)
+    parser.add_argument('--max-workers', type=int, default=32)
+    parser.add_argument('--provider-limit', type=int, default=8, help='debates at once per provider')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='factor of all fake latencies')
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.02)
+    parser.add_argument('--invalid-rate', type=float, default=0.02)
+    parser.add_argument('--max-concurrent', type=int, default=None, help='requests in flight per provider before 429s')
+    parser.add_argument('--hedge-percentile', type=float, default=None,
+                        help='duplicate the judge and vote calls slower than this latency percentile')
+    parser.add_argument('--db', default=None, help='database to write, a temporary one by default')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    return parser.parse_args(argv)
+
+def build_models(args: argparse.Namespace) -> List[FakeChatter]:
+    models = []
+    for seed, model_class in enumerate(args.providers):
+        model = FakeChatter.provider(model_class, time_scale=args.time_scale, seed=seed)
+        model.profile = dataclasses.replace(model.profile, error_rate=args.error_rate,
+                                            rate_limit_rate=args.rate_limit_rate,
+                                            invalid_rate=args.invalid_rate,
+                                            max_concurrent=args.max_concurrent)
+        models.append(model)
+    return models
+
+def initialise(models: List[BaseAiChatter], role, args: argparse.Namespace,
+               hedge_policy: Optional[HedgePolicy] = None):
+    # Backoffs shrink with the latencies, for a run at scale to stay comparable
+    retry_policy = RetryPolicy(max_attempt=10, base_delay=args.time_scale, max_delay=60*args.time_scale)
+    for model in models:
+        model.initialise(role, retry_policy=retry_policy, hedge_policy=hedge_policy)
+
+def hedge_policy(args: argparse.Namespace) -> Optional[HedgePolicy]:
+    # One policy per stage, the latencies of judging and voting differ
+    if args.hedge_percentile is None:
+        return None
+    return HedgePolicy(percentile=args.hedge_percentile, min_delay=0.)
+
+def answer(model: BaseAiChatter, messages: List[Dict[str,str]], request_id: str) -> Tuple:
+    # The statistics of the call are only known in the thread answering
+    return model.answer_until_valid(messages, request_id=request_id), call_statistics(model)
+
+def generate_topics(models, writer: TimedWriter, args: argparse.Namespace) -> pd.DataFrame:
+    initialise(models, TopicCreatorContext(), args)
+    model_infos = pd.DataFrame([model.metainfo | {'model_id': model.model_id()} for model in models])
+    writer.write({"model_infos": model_infos})
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        outputs = dict(zip([model.model_id() for model in models],
+                           executor.map(lambda model: model.answer_until_valid([], request_id=model.model_id()),
+                                        models)))
+    topics = topics2frame({model_id: output for model_id, output in outputs.items() if output is not None})
+    writer.write({"topics": topics})
+    return topics.groupby('model_id').head(args.n_topics)
+
+def judge(models, result_manager: IODataBase, writer: TimedWriter, args: argparse.Namespace) -> int:
+    initialise(models, JudgesContext(), args, hedge_policy(args))
+    inputs = discourses2inputs(result_manager.load_discourses())
+    n_judgements = 0
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {executor.submit(answer, judge, [{"role": "user", "content": text}],
+                                   judge.model_id()+':'+discourse_id): (discourse_id, judge)
+                   for discourse_id, text in inputs.items() for judge in models}
+        for future in as_completed(futures):
+            discourse_id, judge = futures[future]
+            result, stats = future.result()
+            if result is None:
+                continue
+            judgement_id = judge.model_id()+':'+discourse_id
+            fact_judgements = result.copy().reset_index()
+            fact_judgements['judgement_id'] = judgement_id
+            dim_judgements = pd.Series({'judgement_id': judgement_id, 'discourse_id': discourse_id,
+                                        'model_id_judging': judge.model_id(), **stats})
+            writer.write({"dim_judgements": dim_judgements.to_frame().transpose(),
+                          "fact_judgements": fact_judgements})
+            n_judgements += 1
+    return n_judgements
+
+def vote(models, result_manager: IODataBase, writer: TimedWriter, args: argparse.Namespace) -> int:
+    initialise(models, PublicContext(), args, hedge_policy(args))
+    judgements = result_manager.load_judgements()
+    # Only the discourses judged by every judge are voted on
+    n_judges = judgements.groupby('discourse_id').judge_entity.nunique()
+    discourse_ids = list(n_judges.index[n_judges == len(models)])
+    # Judgements were saved as they completed, the judges are put back in one order
+    judgements = judgements.loc[judgements.discourse_id.isin(discourse_ids)] \
+        .sort_values(['discourse_id', 'judge_entity'], kind='stable')
+    inputs = judgements_and_discourses2inputs(judgements, result_manager.load_discourses(discourse_ids),
+                                              judges=np.sort(judgements.judge_entity.unique()))
+    n_votes = 0
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {}
+        for discourse_id, (message, judgement_ids) in inputs.items():
+            messages = [message,
+                        {'role': 'system', 'content': 'thank you for providing the information. In which format should I answer?'},
+                        {'role': 'user', 'content': 'Please give the judgement id as: <Judgement_ID></Judgement_ID>'}]
+            for public in models:
+                future = executor.submit(answer, public, messages, discourse_id+'|'+public.model_id())
+                futures[future] = (discourse_id, judgement_ids, public)
+        for future in as_completed(futures):
+            discourse_id, judgement_ids, public = futures[future]
+            result, stats = future.result()
+            if result is None:
+                continue
+            public_voting_id = discourse_id+'|'+public.model_id()
+            fact_public = result.to_frame().transpose()
+            fact_public['public_voting_id'] = public_voting_id
+            dim_public = pd.Series({'public_voting_id': public_voting_id, 'discourse_id': discourse_id,
+                                    'public_model_id': public.model_id(), 'judgement_ids': judgement_ids,
+                                    **stats})
+            writer.write({"dim_public": dim_public.to_frame().transpose(), "fact_public": fact_public})
+            n_votes += 1
+    return n_votes
+
+def latency_percentiles(result_manager: IODataBase) -> pd.DataFrame:
+    latencies = pd.read_sql("SELECT stage, latency FROM usage_calls", result_manager.connection,
+                            dtype={'latency': float})
+    percentiles = latencies.groupby('stage').latency.quantile([0.5, 0.99]).unstack()
+    percentiles.columns = ['p50_latency', 'p99_latency']
+    return percentiles
+
+def run(args: argparse.Namespace) -> Dict:
+    db_name = args.db if args.db is not None else os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    result_manager = IODataBase(db_name)
+    models = build_models(args)
+    metrics.reset()
+    stages = {}
+    with TimedWriter(result_manager.connection, flush_interval=None) as writer:
+        tic = time.perf_counter()
+        topics = generate_topics(models, writer, args)
+        writer.flush()
+        stages['topics'] = dict(n=len(topics), seconds=time.perf_counter() - tic)
+
+        tic = time.perf_counter()
+        initialise(models, DebaterContext(), args)
+        report = run_tournament(topics, models, writer, n_round=args.n_round,
+                                max_workers=args.max_workers,
+                                provider_limits={provider: args.provider_limit
+                                                 for provider in args.providers})
+        stages['debate'] = dict(n=int(report.error.isna().sum()), seconds=time.perf_counter() - tic)
+
+        tic = time.perf_counter()
+        n_judgements = judge(models, result_manager, writer, args)
+        writer.flush()
+        stages['judge'] = dict(n=n_judgements, seconds=time.perf_counter() - tic)
+
+        tic = time.perf_counter()
+        n_votes = vote(models, result_manager, writer, args)
+        writer.flush()
+        stages['vote'] = dict(n=n_votes, seconds=time.perf_counter() - tic)
+    for stage in stages.values():
+        stage['per_hour'] = 3600*stage['n']/stage['seconds'] if stage['seconds'] > 0 else None
+    counters = metrics.to_pandas()
+    return dict(
+        db=db_name,
+        time_scale=args.time_scale,
+        stages=stages,
+        debates_per_hour=stages['debate']['per_hour'],
+        # At the latencies of the profiles, i.e. without the time_scale
+        debates_per_hour_unscaled=stages['debate']['per_hour']*args.time_scale,
+        latency=latency_percentiles(result_manager).to_dict(orient='index'),
+        db_write_seconds=writer.write_time,
+        db_flushes=writer.n_flushes,
+        transient_errors=int(counters.transient_errors.sum()),
+        invalid_responses=int(counters.invalid_responses.sum()),
+        failures=int(counters.failures.sum()),
+        hedges=int(counters.hedges.sum()),
+        hedge_wins=int(counters.hedge_wins.sum()),
+        hedges_cancelled=int(counters.hedges_cancelled.sum()),
+        hedges_abandoned=int(counters.hedges_abandoned.sum()))
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(pd.DataFrame(report['stages']).transpose().to_string())
+    print(pd.DataFrame(report['latency']).transpose().to_string())
+    for key in ('debates_per_hour', 'debates_per_hour_unscaled', 'db_write_seconds', 'db_flushes',
+                'transient_errors', 'invalid_responses', 'failures', 'hedges', 'hedge_wins',
+                'hedges_cancelled', 'hedges_abandoned'):
+        print(f"{key}: {report[key]}")
+
+if __name__ == '__main__':
+    main()
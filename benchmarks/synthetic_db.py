@@ -0,0 +1,165 @@
+"""Synthetic results databases, in the schema of IODataBase, at any scale.
+
+Every debate is judged by every model and voted on by every model, as in
+the notebook. Texts are random words of fixed lengths.
+
+    python benchmarks/synthetic_db.py results/synthetic.db --preset large
+"""
+from typing import Dict, Iterator, List
+from datetime import datetime
+from itertools import permutations
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ai_debater.io_database import IODataBase, insert_frame
+
+MODEL_ENTITIES = ['GeminiChatter|gemini-pro', 'MistralAIChatter|mistral-large-latest',
+                  'OpenAIChatter|gpt-4', 'Claude3AiChatter|claude-3-opus-20240229']
+CATEGORIES = ['ReasoningAndEvidence', 'ListeningAndResponse', 'OrganisationAndPrioritisation',
+              'ExpressionAndDelivery', 'TeamworkAndRoles']
+WORDS = np.array(['debate', 'argument', 'evidence', 'point', 'claim', 'therefore',
+                  'however', 'because', 'the', 'a', 'policy', 'society'])
+
+# Scales of the generated databases; fact_judgements holds
+# n_debates*n_models*len(CATEGORIES)*2 rows
+PRESETS = {
+    'small': dict(n_topics=100, n_debates=1_000, n_round=4),
+    'medium': dict(n_topics=1_000, n_debates=10_000, n_round=4),
+    'large': dict(n_topics=10_000, n_debates=100_000, n_round=4),
+}
+
+def _texts(rng: np.random.Generator, n: int, n_words: int) -> List[str]:
+    words = WORDS[rng.integers(0, len(WORDS), size=(n, n_words))]
+    return [' '.join(row) for row in words]
+
+def _chunks(n: int, chunk_size: int) -> Iterator[slice]:
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(n, start + chunk_size))
+
+def generate(db_name: str, n_topics: int = 100, n_debates: int = 1_000, n_round: int = 4,
+             argument_words: int = 60, seed: int = 0, chunk_size: int = 5_000) -> Dict[str, int]:
+    """Write a synthetic database to db_name, returns the number of rows per table"""
+    if os.path.exists(db_name):
+        raise NameError(f"{db_name} exists already")
+    rng = np.random.default_rng(seed)
+    result_manager = IODataBase(db_name)
+    connection = result_manager.connection
+    n_rows = {}
+    def write(table_name: str, frame: pd.DataFrame):
+        with connection:
+            insert_frame(connection, table_name, frame)
+        n_rows[table_name] = n_rows.get(table_name, 0) + len(frame)
+
+    model_ids = np.array([f"model{i}" for i in range(len(MODEL_ENTITIES))], dtype=object)
+    write("model_infos", pd.DataFrame({
+        "model_id": model_ids,
+        "model_class": [entity.split('|')[0] for entity in MODEL_ENTITIES],
+        "model": [entity.split('|')[1] for entity in MODEL_ENTITIES],
+        "model_entity": MODEL_ENTITIES,
+        "creation_date": datetime(2024, 3, 1)}))
+
+    creators = model_ids[np.arange(n_topics) % len(model_ids)]
+    ith_topic = np.arange(n_topics) // len(model_ids)
+    topic_ids = np.array([f"{m}-{i}" for m, i in zip(creators, ith_topic)], dtype=object)
+    for part in _chunks(n_topics, chunk_size):
+        write("topics", pd.DataFrame({
+            "topic_id": topic_ids[part], "model_id": creators[part], "ith_topic": ith_topic[part],
+            "Subject": _texts(rng, part.stop - part.start, 8),
+            "Rational": _texts(rng, part.stop - part.start, 30)}))
+
+    # Distinct (topic, proposing, opposing) triplets
+    pairs = np.array(list(permutations(range(len(model_ids)), 2)))
+    if n_debates > n_topics*len(pairs):
+        raise NameError(f"At most {n_topics*len(pairs)} debates for {n_topics} topics")
+    picked = np.sort(rng.choice(n_topics*len(pairs), size=n_debates, replace=False))
+    debate_topics = topic_ids[picked // len(pairs)]
+    proposing = model_ids[pairs[picked % len(pairs), 0]]
+    opposing = model_ids[pairs[picked % len(pairs), 1]]
+    discourse_ids = debate_topics + ':' + proposing + '-vs-' + opposing
+
+    n_arguments = 2*n_round
+    for part in _chunks(n_debates, chunk_size):
+        n = part.stop - part.start
+        write("dim_discourse", pd.DataFrame({
+            "discourse_id": discourse_ids[part], "model_proposing": proposing[part],
+            "model_opposing": opposing[part], "topic_id": debate_topics[part],
+            "tournament_id": "synthetic"}))
+        ith_argument = np.tile(np.arange(n_arguments), n)
+        discourse_id = np.repeat(discourse_ids[part], n_arguments)
+        write("fact_discourse", pd.DataFrame({
+            "argument_id": discourse_id + ith_argument.astype(str),
+            "discourse_id": discourse_id,
+            "ith_argument": ith_argument,
+            "Argument": _texts(rng, n*n_arguments, argument_words),
+            "model_speaking": np.where(ith_argument % 2 == 0,
+                                       np.repeat(proposing[part], n_arguments),
+                                       np.repeat(opposing[part], n_arguments)),
+            "latency": rng.lognormal(1.5, 0.5, n*n_arguments),
+            "time_to_first_token": None,
+            "tokens_per_second": None,
+            "prompt_tokens": rng.integers(300, 3000, n*n_arguments),
+            "completion_tokens": rng.integers(100, 400, n*n_arguments)}))
+
+        # Every model judges every debate
+        judge = np.tile(model_ids, n)
+        judged = np.repeat(discourse_ids[part], len(model_ids))
+        judgement_ids = judge + ':' + judged
+        write("dim_judgements", pd.DataFrame({
+            "judgement_id": judgement_ids, "discourse_id": judged, "model_id_judging": judge,
+            "latency": rng.lognormal(2., 0.5, len(judge)),
+            "prompt_tokens": rng.integers(2000, 6000, len(judge)),
+            "completion_tokens": rng.integers(300, 800, len(judge))}))
+        n_scores = len(CATEGORIES)*2
+        teams = np.stack([np.repeat(proposing[part], len(model_ids)),
+                          np.repeat(opposing[part], len(model_ids))], axis=1)
+        write("fact_judgements", pd.DataFrame({
+            "judgement_id": np.repeat(judgement_ids, n_scores),
+            "Categories": np.tile(np.repeat(CATEGORIES, 2), len(judgement_ids)),
+            "Team_ID": np.tile(teams, len(CATEGORIES)).ravel(),
+            "Score": rng.integers(0, 101, len(judgement_ids)*n_scores)/100,
+            "Rational": _texts(rng, len(judgement_ids)*n_scores, 20)}))
+
+        # Every model votes on every debate, among its judgements
+        public = np.tile(model_ids, n)
+        voted = np.repeat(discourse_ids[part], len(model_ids))
+        ids = judgement_ids.reshape(n, len(model_ids))
+        dim_public = pd.DataFrame({
+            "public_voting_id": voted + '|' + public, "discourse_id": voted,
+            "public_model_id": public,
+            "judgement_ids": [ids[i // len(model_ids)] for i in range(len(public))],
+            "latency": rng.lognormal(1., 0.5, len(public)),
+            "prompt_tokens": rng.integers(5000, 12000, len(public)),
+            "completion_tokens": rng.integers(5, 20, len(public))})
+        write("dim_public", dim_public)
+        write("fact_public", pd.DataFrame({
+            "public_voting_id": dim_public.public_voting_id,
+            "Judgement_ID": ids[np.arange(len(public)) // len(model_ids),
+                                rng.integers(0, len(model_ids), len(public))]}))
+    return n_rows
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_name')
+    parser.add_argument('--preset', choices=list(PRESETS), default='small')
+    parser.add_argument('--n-topics', type=int, default=None)
+    parser.add_argument('--n-debates', type=int, default=None)
+    parser.add_argument('--n-round', type=int, default=None)
+    parser.add_argument('--argument-words', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = PRESETS[args.preset].copy()
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    n_rows = generate(args.db_name, argument_words=args.argument_words, seed=args.seed, **scale)
+    print(pd.Series(n_rows).to_string())
+
+if __name__ == '__main__':
+    main()
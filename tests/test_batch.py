@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+import time
+import pandas as pd
+import pytest
+from ai_debater.io_database import IODataBase
+from ai_debater.models.batch import AnthropicBatchBackend, LocalBatchBackend
+from ai_debater.models.fake_chatter import FakeChatter, FakeProfile
+from ai_debater.models.retry_policy import RetryPolicy
+from ai_debater.pipeline import Pipeline
+from ai_debater.prompt_engineering import PublicContext
+
+VALID = "<Judgement_ID>a</Judgement_ID>"
+INVALID = "<Judgement_ID>a"
+
+class Responder():
+    """respond of a LocalBatchBackend, answering each request by the answers given for it in turn"""
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = {}
+
+    def __call__(self, body):
+        content = body["messages"][-1]["content"]
+        ith = self.calls.get(content, 0)
+        self.calls[content] = ith + 1
+        answers = self.answers[content]
+        return answers[min(ith, len(answers) - 1)]
+
+def chatter(max_attempt=3) -> FakeChatter:
+    model = FakeChatter(seed=0)
+    model.initialise(PublicContext(), retry_policy=RetryPolicy(max_attempt=max_attempt))
+    return model
+
+def requests(*contents):
+    return {content: [{"role": "user", "content": content}] for content in contents}
+
+def test_submit(tmp_path):
+    responder = Responder({"r1": [VALID], "r2": [VALID]})
+    answered = {}
+    outputs = chatter().answer_batch(requests("r1", "r2"), backend=LocalBatchBackend(responder),
+                                     poll_interval=0., workdir=str(tmp_path),
+                                     on_answer=lambda request_id, output, stats: answered.update({request_id: stats}))
+    assert {request_id: output.Judgement_ID for request_id, output in outputs.items()} == {"r1": "a", "r2": "a"}
+    assert set(answered) == {"r1", "r2"}
+    assert responder.calls == {"r1": 1, "r2": 1}
+
+def test_invalid_answers_are_resubmitted(tmp_path):
+    responder = Responder({"r1": [INVALID, VALID], "r2": [VALID]})
+    outputs = chatter().answer_batch(requests("r1", "r2"), backend=LocalBatchBackend(responder),
+                                     poll_interval=0., workdir=str(tmp_path))
+    assert outputs["r1"] is not None and outputs["r2"] is not None
+    # Only the invalid answer is asked again
+    assert responder.calls == {"r1": 2, "r2": 1}
+
+def test_missing_results(tmp_path):
+    responder = Responder({"r1": [None], "r2": [VALID]})
+    outputs = chatter(max_attempt=3).answer_batch(requests("r1", "r2"), backend=LocalBatchBackend(responder),
+                                                  poll_interval=0., workdir=str(tmp_path))
+    assert outputs["r1"] is None and outputs["r2"] is not None
+    assert responder.calls == {"r1": 3, "r2": 1}
+
+def test_polling_is_bounded(tmp_path):
+    responder = Responder({"r1": [VALID]})
+    tic = time.monotonic()
+    outputs = chatter().answer_batch(requests("r1"), backend=LocalBatchBackend(responder, n_polls=10**9),
+                                     poll_interval=0.01, timeout=0.1, workdir=str(tmp_path))
+    assert outputs == {"r1": None}
+    assert time.monotonic() - tic < 1.
+
+def test_pipeline_judges_in_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    profile = FakeProfile(median_latency=0.001, latency_sigma=0.)
+    models = [FakeChatter(model=f"fake{i}", profile=profile, seed=i) for i in range(2)]
+    result_manager = IODataBase(str(tmp_path/'results.db'))
+    pipeline = Pipeline(result_manager, models, n_round=1)
+    for stage in ('topics', 'debate'):
+        pipeline.enqueue(stage)
+        pipeline.run(stage)
+    n_judgements = pipeline.enqueue('judge')
+    assert n_judgements > 0
+    assert pipeline.run_batch('judge', poll_interval=0.) == n_judgements
+    status = pipeline.queue.status()
+    assert status.loc[status.stage == 'judge', 'status'].tolist() == ['done']
+    judgements = result_manager.load_judgements()
+    assert judgements.judgement_id.nunique() == n_judgements
+    # Batches have token counts but no latency
+    dim_judgements = pd.read_sql("SELECT * FROM dim_judgements", result_manager.connection)
+    assert dim_judgements.latency.isna().all()
+
+    n_votes = pipeline.enqueue('vote')
+    assert pipeline.run_batch('vote', poll_interval=0.) == n_votes
+    assert len(result_manager.load_votes_for_analyses()) == n_votes
+
+def test_stage_without_batch(tmp_path):
+    pipeline = Pipeline(IODataBase(str(tmp_path/'results.db')), [FakeChatter()])
+    with pytest.raises(NameError):
+        pipeline.run_batch('debate')
+
+def test_anthropic_results_count_the_cached_tokens():
+    pytest.importorskip('anthropic')
+    usage = SimpleNamespace(input_tokens=10, output_tokens=5,
+                            cache_creation_input_tokens=100, cache_read_input_tokens=1000)
+    entry = SimpleNamespace(custom_id='r1', result=SimpleNamespace(
+        type='succeeded', message=SimpleNamespace(content=[SimpleNamespace(text=VALID)], usage=usage)))
+    batches = SimpleNamespace(results=lambda batch_id: [entry])
+    backend = AnthropicBatchBackend(SimpleNamespace(messages=SimpleNamespace(batches=batches)))
+    result = backend.results('batch')['r1']
+    assert (result.text, result.prompt_tokens, result.completion_tokens) == (VALID, 1110, 5)
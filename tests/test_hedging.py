@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+import pytest
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.retry_policy import HedgePolicy, metrics
+from ai_debater.prompt_engineering import PublicContext
+
+VALID = "<Judgement_ID>a</Judgement_ID>"
+
+class SlowFirstChatter(BaseAiChatter):
+    """Chatter whose first request is slow, the duplicates answering at once"""
+    model_entity = 'SlowFirstChatter|test'
+    metainfo = {}
+
+    def __init__(self, slow: float = 0.5):
+        self.slow = slow
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    def _latency(self) -> float:
+        with self._lock:
+            self.n_requests += 1
+            return self.slow if self.n_requests == 1 else 0.
+
+    def _answer(self, messages):
+        time.sleep(self._latency())
+        return VALID
+
+    async def _aanswer(self, messages):
+        await asyncio.sleep(self._latency())
+        return VALID
+
+def test_delay_is_a_percentile_of_the_latencies():
+    policy = HedgePolicy(percentile=90., min_delay=0., min_samples=10, window=100)
+    assert policy.delay('m') is None
+    assert HedgePolicy(initial_delay=0.5, min_delay=1.).delay('m') == 1.
+    for latency in range(1, 10):
+        policy.observe('m', float(latency))
+    assert policy.delay('m') is None
+    policy.observe('m', 10.)
+    assert policy.delay('m') == pytest.approx(9.1)
+    assert policy.delay('other') is None
+    # Only the latest latencies count
+    for _ in range(100):
+        policy.observe('m', 1.)
+    assert policy.delay('m') == 1.
+    policy.min_delay = 2.
+    assert policy.delay('m') == 2.
+
+def test_initialise_resets_the_policy():
+    model = SlowFirstChatter()
+    model.initialise(PublicContext(), hedge_policy=HedgePolicy())
+    assert model.hedge_policy is not None
+    model.initialise(PublicContext())
+    assert model.hedge_policy is None
+
+def hedged_chatter() -> SlowFirstChatter:
+    metrics.reset()
+    model = SlowFirstChatter()
+    model.initialise(PublicContext(), hedge_policy=HedgePolicy(initial_delay=0.05, min_delay=0.))
+    return model
+
+def counters(model: BaseAiChatter) -> dict:
+    return metrics.to_pandas().loc[model.model_entity, ['hedges', 'hedge_wins', 'hedges_cancelled',
+                                                        'hedges_abandoned']].to_dict()
+
+def test_threaded_hedge_abandons_the_slow_request():
+    model = hedged_chatter()
+    tic = time.monotonic()
+    assert model.answer_until_valid([]).Judgement_ID == 'a'
+    assert time.monotonic() - tic < model.slow
+    assert counters(model) == dict(hedges=1, hedge_wins=1, hedges_cancelled=0, hedges_abandoned=1)
+    # Only the first request is observed, the duplicate is not
+    assert len(model.hedge_policy._latencies[model.model_entity]) == 1
+
+def test_async_hedge_cancels_the_slow_request():
+    model = hedged_chatter()
+    tic = time.monotonic()
+    assert asyncio.run(model.aanswer_until_valid([])).Judgement_ID == 'a'
+    assert time.monotonic() - tic < model.slow
+    assert counters(model) == dict(hedges=1, hedge_wins=1, hedges_cancelled=1, hedges_abandoned=0)
+
+def test_fast_answer_is_not_hedged():
+    model = hedged_chatter()
+    model.n_requests = 1
+    assert model.answer_until_valid([]).Judgement_ID == 'a'
+    assert counters(model) == dict(hedges=0, hedge_wins=0, hedges_cancelled=0, hedges_abandoned=0)
@@ -0,0 +1,160 @@
+import sqlite3
+import warnings
+import pandas as pd
+import pytest
+from ai_debater.io_database import IODataBase, SCHEMA_VERSION, TABLES
+from ai_debater.models.fake_chatter import FakeChatter
+
+def legacy_db(path) -> str:
+    """Database as saved by DataFrame.to_sql before the schema was versioned"""
+    db_name = str(path / 'legacy.db')
+    connection = sqlite3.connect(db_name)
+    # The notebook saved the model_infos again on each run
+    pd.DataFrame({'model_id': ['m1', 'm2', 'm1'],
+                  'model_class': ['OpenAIChatter', 'GeminiChatter', 'OpenAIChatter'],
+                  'model': ['gpt-4', 'gemini-pro', 'gpt-4'],
+                  'model_entity': ['OpenAIChatter|gpt-4', 'GeminiChatter|gemini-pro', 'OpenAIChatter|gpt-4'],
+                  'creation_date': ['2024-03-01', '2024-03-01', '2024-03-02']}) \
+        .to_sql('model_infos', connection, index=False)
+    pd.DataFrame({'model_id': ['m1'], 'ith_topic': [0], 'topic_id': ['t1'],
+                  'Subject': ['subject'], 'Rational': ['rational']}) \
+        .to_sql('topics', connection, index=False)
+    pd.DataFrame({'discourse_id': ['d1'], 'model_proposing': ['m1'], 'model_opposing': ['m2'],
+                  'topic_id': ['t1']}) \
+        .to_sql('dim_discourse', connection, index=False)
+    pd.DataFrame({'judgement_id': ['j1'], 'discourse_id': ['d1'], 'model_id_judging': ['m1']}) \
+        .to_sql('dim_judgements', connection, index=False)
+    # A judgement saved twice
+    pd.DataFrame({'judgement_id': ['j1', 'j1', 'j1'], 'Categories': ['Logic', 'Logic', 'Logic'],
+                  'Team_ID': ['a', 'b', 'a'], 'Score': [5., 7., 5.], 'Rational': ['r', 'r', 'r']}) \
+        .to_sql('fact_judgements', connection, index=False)
+    connection.close()
+    return db_name
+
+def primary_key(connection, table_name) -> list:
+    columns = connection.execute(f"PRAGMA table_info('{table_name}')").fetchall()
+    return [name for _, name, _, _, _, pk in sorted(columns, key=lambda column: column[5]) if pk]
+
+def test_upgrade_unversioned(tmp_path):
+    with pytest.warns(UserWarning) as record:
+        result_manager = IODataBase(legacy_db(tmp_path))
+    assert sorted(str(warning.message) for warning in record) == [
+        "1 rows of fact_judgements duplicating a key were dropped",
+        "1 rows of model_infos duplicating a key were dropped"]
+    connection = result_manager.connection
+    assert result_manager.schema_version == SCHEMA_VERSION
+    assert set(TABLES) <= set(result_manager.table_names.tbl_name)
+    # The first row of a key is kept
+    model_infos = pd.read_sql("SELECT * FROM model_infos ORDER BY model_id", connection)
+    assert list(model_infos.model_id) == ['m1', 'm2']
+    assert model_infos.creation_date[0] == '2024-03-01'
+    fact_judgements = pd.read_sql("SELECT * FROM fact_judgements ORDER BY Team_ID", connection)
+    assert list(fact_judgements.Team_ID) == ['a', 'b']
+    assert primary_key(connection, 'model_infos') == ['model_id']
+    assert primary_key(connection, 'fact_judgements') == ['judgement_id', 'Categories', 'Team_ID']
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute("INSERT INTO model_infos (model_id) VALUES ('m1')")
+    # The rows copied are accounted in the score aggregates
+    stats = result_manager.load_judge_score_stats()
+    assert list(stats.n_scores) == [2] and list(stats.mean_score) == [6.]
+
+def test_current_database_is_left_as_is(tmp_path):
+    db_name = legacy_db(tmp_path)
+    with pytest.warns(UserWarning):
+        IODataBase(db_name).connection.close()
+    connection = sqlite3.connect(db_name)
+    before = {table_name: pd.read_sql(f"SELECT * FROM '{table_name}'", connection) for table_name in TABLES}
+    connection.close()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result_manager = IODataBase(db_name)
+    assert result_manager.schema_version == SCHEMA_VERSION
+    for table_name, table in before.items():
+        pd.testing.assert_frame_equal(pd.read_sql(f"SELECT * FROM '{table_name}'", result_manager.connection),
+                                      table)
+
+def test_newer_database_is_refused(tmp_path):
+    db_name = str(tmp_path / 'newer.db')
+    connection = sqlite3.connect(db_name)
+    connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    connection.close()
+    with pytest.raises(NameError):
+        IODataBase(db_name)
+
+def test_model_is_registered_once(tmp_path):
+    result_manager = IODataBase(str(tmp_path/'results.db'))
+    model_id = result_manager.register_model(FakeChatter(model='m'))
+    # A later run creates the chatter again, with a new model_id of its own
+    model = FakeChatter(model='m')
+    assert model.model_id() != model_id
+    assert result_manager.register_model(model) == model.model_id() == model_id
+    result_manager.register_model(FakeChatter(model='other'))
+    model_infos = pd.read_sql("SELECT * FROM model_infos", result_manager.connection)
+    assert sorted(model_infos.model_entity) == ['FakeChatter|m', 'FakeChatter|other']
+
+def score_stats(result_manager: IODataBase) -> pd.DataFrame:
+    stats = result_manager.load_judge_score_stats()
+    # A single score, or equal ones, have no standard deviation
+    stats['std_score'] = stats.std_score.fillna(0.)
+    return stats.sort_values(['judge_entity', 'Categories']).reset_index(drop=True)
+
+def recomputed_score_stats(result_manager: IODataBase) -> pd.DataFrame:
+    scores = pd.read_sql(
+        """
+        SELECT judge.model_entity AS judge_entity, fact.Categories, fact.Score
+        FROM 'fact_judgements' AS fact
+        JOIN 'dim_judgements' AS dim
+            USING (judgement_id)
+        LEFT JOIN 'model_infos' AS judge
+            ON dim.model_id_judging = judge.model_id
+        WHERE fact.Score IS NOT NULL
+        """, result_manager.connection)
+    scores = scores.groupby(['judge_entity', 'Categories']).Score
+    return pd.DataFrame({'n_scores': scores.count(), 'mean_score': scores.mean(),
+                         'std_score': scores.std(ddof=0), 'min_score': scores.min(),
+                         'max_score': scores.max()}).reset_index()
+
+JUDGEMENT_WRITES = [
+    "INSERT INTO dim_judgements (judgement_id, model_id_judging) VALUES ('j1', 'm1')",
+    "INSERT INTO fact_judgements VALUES ('j1', 'Logic', 'a', 5, ''), ('j1', 'Logic', 'b', 9, ''),"
+    " ('j1', 'Style', 'a', 2, '')",
+    # Scores written before their judgement
+    "INSERT INTO fact_judgements VALUES ('j2', 'Logic', 'a', 1, ''), ('j2', 'Logic', 'b', NULL, '')",
+    "INSERT INTO dim_judgements (judgement_id, model_id_judging) VALUES ('j2', 'm1')",
+    "INSERT INTO dim_judgements (judgement_id, model_id_judging) VALUES ('j3', 'm2')",
+    "INSERT INTO fact_judgements VALUES ('j3', 'Logic', 'a', 4, ''), ('j3', 'Logic', 'b', 6, '')",
+    # Updates of the max, the min, a NULL score and scores left as they are
+    "UPDATE fact_judgements SET Score = 3 WHERE judgement_id = 'j1' AND Team_ID = 'b'",
+    "UPDATE fact_judgements SET Score = 8 WHERE judgement_id = 'j2' AND Team_ID = 'a'",
+    "UPDATE fact_judgements SET Score = 7 WHERE Score IS NULL",
+    "UPDATE fact_judgements SET Team_ID = 'c' WHERE judgement_id = 'j1' AND Team_ID = 'a'",
+    "UPDATE fact_judgements SET Categories = 'Style' WHERE judgement_id = 'j3' AND Team_ID = 'a'",
+    # Scores moved to a judgement not written yet
+    "UPDATE fact_judgements SET judgement_id = 'j4' WHERE judgement_id = 'j2'",
+    "UPDATE dim_judgements SET model_id_judging = 'm2' WHERE judgement_id = 'j1'",
+    # Deletes of scores, then of whole judgements
+    "DELETE FROM fact_judgements WHERE Score = (SELECT MAX(Score) FROM fact_judgements)",
+    "DELETE FROM dim_judgements WHERE judgement_id = 'j3'",
+    "INSERT INTO dim_judgements (judgement_id, model_id_judging) VALUES ('j3', 'm1')",
+    "DELETE FROM fact_judgements WHERE judgement_id = 'j1'",
+    "DELETE FROM dim_judgements",
+]
+
+def test_judge_score_stats_follow_the_judgements(tmp_path):
+    result_manager = IODataBase(str(tmp_path / 'stats.db'))
+    connection = result_manager.connection
+    with connection:
+        connection.execute("INSERT INTO model_infos (model_id, model_entity) VALUES ('m1', 'J|1'), ('m2', 'J|2')")
+    for sql_statement in JUDGEMENT_WRITES:
+        with connection:
+            connection.execute(sql_statement)
+        pd.testing.assert_frame_equal(score_stats(result_manager), recomputed_score_stats(result_manager),
+                                      check_dtype=False, obj=sql_statement)
+    assert connection.execute("SELECT COUNT(*) FROM judge_score_stats").fetchone()[0] == 0
+    # Rebuilding gives back what the triggers kept
+    with connection:
+        connection.executemany("INSERT INTO dim_judgements (judgement_id, model_id_judging) VALUES (?, ?)",
+                               [('j3', 'm2'), ('j4', 'm1')])
+    stats = score_stats(result_manager)
+    result_manager.rebuild_judge_score_stats()
+    pd.testing.assert_frame_equal(score_stats(result_manager), stats)
@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import time
+import pandas as pd
+import pytest
+from ai_debater.io_database import IODataBase
+from ai_debater.job_queue import JobQueue
+from ai_debater.models.fake_chatter import FakeChatter, FakeProfile
+from ai_debater.pipeline import Pipeline
+from ai_debater.prompt_engineering import DebaterContext
+
+def queue(db_name: str, worker_id: str, **kwargs) -> JobQueue:
+    # One connection per worker, as separate processes would have
+    return JobQueue(sqlite3.connect(db_name, timeout=60, check_same_thread=False),
+                    worker_id=worker_id, **kwargs)
+
+@pytest.fixture
+def db_name(tmp_path) -> str:
+    db_name = str(tmp_path/'results.db')
+    IODataBase(db_name).connection.close()
+    return db_name
+
+def status(job_queue: JobQueue, job_id: str):
+    return job_queue.connection.execute(
+        "SELECT status, attempts, worker_id FROM pipeline_jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+def test_enqueue_twice(db_name):
+    job_queue = queue(db_name, 'w1')
+    assert job_queue.enqueue('judge', [{'discourse_id': 'd1'}, {'discourse_id': 'd2'}]) == 2
+    assert job_queue.enqueue('judge', [{'discourse_id': 'd2'}, {'discourse_id': 'd3'}]) == 1
+    assert job_queue.n_active('judge') == 3
+
+def test_workers_never_claim_the_same_job(db_name):
+    queue(db_name, 'w0').enqueue('judge', [{'discourse_id': f'd{i}'} for i in range(200)])
+    def claim_all(worker_id: str):
+        job_queue = queue(db_name, worker_id)
+        claimed = []
+        while (job := job_queue.claim('judge')) is not None:
+            claimed.append(job[0])
+        return claimed
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        claimed = list(executor.map(claim_all, [f'w{i}' for i in range(4)]))
+    job_ids = [job_id for worker_claimed in claimed for job_id in worker_claimed]
+    assert len(job_ids) == len(set(job_ids)) == 200
+
+def test_expired_lease_is_reclaimed(db_name):
+    lost = queue(db_name, 'lost', lease_seconds=0.05)
+    other = queue(db_name, 'other', lease_seconds=60.)
+    lost.enqueue('judge', [{'discourse_id': 'd1'}])
+    job_id, _, _ = lost.claim()
+    assert other.claim() is None
+    time.sleep(0.1)
+    assert other.claim()[0] == job_id
+    assert status(other, job_id) == ('running', 2, 'other')
+    # The worker which lost the job can neither keep nor fail it
+    assert not lost.renew(job_id)
+    lost.fail(job_id, 'late')
+    assert status(other, job_id) == ('running', 2, 'other')
+
+def test_job_losing_its_worker_too_often_fails(db_name):
+    job_queue = queue(db_name, 'w1', max_attempt=2, lease_seconds=0.01)
+    job_queue.enqueue('judge', [{'discourse_id': 'd1'}])
+    for _ in range(2):
+        job_id, _, _ = job_queue.claim()
+        time.sleep(0.02)
+    assert job_queue.claim() is None
+    assert status(job_queue, job_id)[0] == 'failed'
+
+def test_heartbeat_keeps_the_lease(db_name):
+    worker = queue(db_name, 'w1', lease_seconds=0.3)
+    other = queue(db_name, 'w2')
+    worker.enqueue('judge', [{'discourse_id': 'd1'}])
+    job_id, _, _ = worker.claim()
+    with worker.keep_lease(job_id):
+        time.sleep(0.9)
+        assert other.claim() is None
+    time.sleep(0.4)
+    assert other.claim()[0] == job_id
+
+def test_recover_and_retry_failed(db_name):
+    job_queue = queue(db_name, 'w1', max_attempt=1)
+    job_queue.enqueue('judge', [{'discourse_id': 'd1'}, {'discourse_id': 'd2'}])
+    first, _, _ = job_queue.claim()
+    second, _, _ = job_queue.claim()
+    job_queue.fail(first, 'error')
+    assert status(job_queue, first)[:2] == ('failed', 1)
+    # A restart after a crash releases the jobs left running
+    assert job_queue.recover() == 1
+    assert status(job_queue, second)[0] == 'pending'
+    assert job_queue.retry_failed('judge') == 1
+    assert status(job_queue, first)[:2] == ('pending', 0)
+    assert job_queue.n_active() == 2
+
+class Interrupted(Exception):
+    pass
+
+class Turns():
+    """request_id of the debate turns asked, shared by the debaters"""
+    def __init__(self):
+        self.request_ids = []
+        self.fail_after = None
+
+class TurnCountingChatter(FakeChatter):
+    def __init__(self, turns: Turns, **kwargs):
+        super().__init__(**kwargs)
+        self.turns = turns
+
+    def answer_until_valid(self, messages, stream=False, on_token=None, request_id=None):
+        if isinstance(self._costar, DebaterContext):
+            if self.turns.fail_after is not None and len(self.turns.request_ids) >= self.turns.fail_after:
+                raise Interrupted()
+            self.turns.request_ids.append(request_id)
+        return super().answer_until_valid(messages, stream=stream, on_token=on_token, request_id=request_id)
+
+def test_interrupted_debate_resumes_from_its_checkpoints(db_name):
+    turns = Turns()
+    profile = FakeProfile(median_latency=0.001, latency_sigma=0.)
+    models = [TurnCountingChatter(turns, model=f"fake{i}", profile=profile, seed=i) for i in range(2)]
+    result_manager = IODataBase(db_name)
+    pipeline = Pipeline(result_manager, models, n_round=2)
+    pipeline.enqueue('topics')
+    pipeline.run('topics')
+    pipeline.enqueue('debate')
+
+    turns.fail_after = 3
+    assert pipeline.run('debate', max_jobs=1) == 1
+    discourse_id = turns.request_ids[0][:-1]
+    checkpoints = pd.read_sql("SELECT * FROM debate_checkpoints", result_manager.connection)
+    assert list(checkpoints.ith_argument) == [0, 1, 2]
+    assert pipeline.queue.status().set_index(['stage', 'status']).n_jobs.get(('debate', 'done')) is None
+
+    turns.request_ids, turns.fail_after = [], None
+    assert pipeline.run('debate', max_jobs=1) == 1
+    # Only the last turn is asked again
+    assert turns.request_ids == [discourse_id+'3']
+    arguments = pd.read_sql("SELECT Argument FROM fact_discourse WHERE discourse_id = ? ORDER BY ith_argument",
+                            result_manager.connection, params=(discourse_id,)).Argument
+    assert list(arguments[:3]) == list(checkpoints.Argument)
+    assert len(arguments) == 4
+    assert result_manager.connection.execute("SELECT COUNT(*) FROM debate_checkpoints").fetchone()[0] == 0
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+import asyncio
+import sqlite3
+import pytest
+from ai_debater.models import rate_limiter
+from ai_debater.models.rate_limiter import RateLimit, RateLimiter
+
+class Clock():
+    """time.time and time.sleep of the rate limiter, sleeping moves the time on"""
+    def __init__(self):
+        self.now = 1000.
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, 'time', SimpleNamespace(time=clock.time, sleep=clock.sleep))
+    return clock
+
+LIMITS = {'OpenAIChatter': RateLimit(requests_per_minute=60, tokens_per_minute=600)}
+
+def test_requests_bucket(clock):
+    limiter = RateLimiter(LIMITS)
+    # The bucket starts full, with a minute of quota
+    assert [limiter.reserve('OpenAIChatter|gpt-4') for _ in range(60)] == [0.]*60
+    assert limiter.reserve('OpenAIChatter|gpt-4') == pytest.approx(1.)
+    # Callers queue up behind the ones already waiting
+    assert limiter.reserve('OpenAIChatter|gpt-4') == pytest.approx(2.)
+
+def test_bucket_refills(clock):
+    limiter = RateLimiter(LIMITS)
+    for _ in range(60):
+        limiter.acquire('OpenAIChatter|gpt-4')
+    assert clock.sleeps == []
+    limiter.acquire('OpenAIChatter|gpt-4')
+    assert clock.sleeps == [pytest.approx(1.)]
+    clock.now += 10.
+    assert [limiter.reserve('OpenAIChatter|gpt-4') for _ in range(10)] == [0.]*10
+    assert limiter.reserve('OpenAIChatter|gpt-4') > 0.
+    # Never more than a minute of quota, however long idle
+    clock.now += 3600.
+    assert sum(limiter.reserve('OpenAIChatter|gpt-4') == 0. for _ in range(100)) == 60
+
+def test_tokens_bucket(clock):
+    limiter = RateLimiter(LIMITS)
+    assert limiter.reserve('OpenAIChatter|gpt-4', tokens=500) == 0.
+    # 10 tokens per second
+    limiter.consume('OpenAIChatter|gpt-4', 150)
+    assert limiter.reserve('OpenAIChatter|gpt-4', tokens=0) == 0.
+    assert limiter.reserve('OpenAIChatter|gpt-4', tokens=20) == pytest.approx(7.)
+
+def test_limits_by_model_then_class(clock):
+    limiter = RateLimiter({'OpenAIChatter': RateLimit(requests_per_minute=1),
+                           'OpenAIChatter|gpt-4': RateLimit(requests_per_minute=2)})
+    assert limiter.limit('OpenAIChatter|gpt-4').requests_per_minute == 2
+    assert limiter.limit('OpenAIChatter|gpt-3.5').requests_per_minute == 1
+    assert limiter.limit('GeminiChatter|gemini-pro') is None
+    assert [limiter.reserve('GeminiChatter|gemini-pro') for _ in range(100)] == [0.]*100
+    # Each model has its own buckets
+    limiter.reserve('OpenAIChatter|gpt-3.5')
+    assert limiter.reserve('OpenAIChatter|gpt-4') == 0.
+
+def test_shared_bucket(clock, tmp_path):
+    shared_db = str(tmp_path/'rate_limits.db')
+    limiters = [RateLimiter(LIMITS, shared_db=shared_db) for _ in range(2)]
+    for i in range(60):
+        assert limiters[i % 2].reserve('OpenAIChatter|gpt-4') == 0.
+    # The quota is spent for both, as for processes sharing an api key
+    assert limiters[0].reserve('OpenAIChatter|gpt-4') == pytest.approx(1.)
+    assert limiters[1].reserve('OpenAIChatter|gpt-4') == pytest.approx(2.)
+    clock.now += 30.
+    assert limiters[1].reserve('OpenAIChatter|gpt-4') == 0.
+
+def test_shared_bucket_waits_off_the_event_loop(tmp_path):
+    shared_db = str(tmp_path/'rate_limits.db')
+    limiter = RateLimiter(LIMITS, shared_db=shared_db)
+    # Another process holding the lock of the buckets
+    other = sqlite3.connect(shared_db, isolation_level=None, check_same_thread=False)
+    other.execute("BEGIN IMMEDIATE")
+    async def run():
+        ticks = 0
+        acquire = asyncio.create_task(limiter.aacquire('OpenAIChatter|gpt-4', tokens=10))
+        asyncio.get_running_loop().call_later(0.3, other.execute, "COMMIT")
+        while not acquire.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        await acquire
+        await limiter.aconsume('OpenAIChatter|gpt-4', 10)
+        return ticks
+    assert asyncio.run(run()) >= 10
+    level, = other.execute(
+        "SELECT level FROM rate_limit_buckets WHERE bucket = 'OpenAIChatter|gpt-4:tokens'").fetchone()
+    assert level == pytest.approx(580., abs=1.)
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+from ai_debater.io_database import IODataBase, write_frames
+from ai_debater.models.response_log import ResponseLog
+from ai_debater.reparse import reparse_topics
+
+def topics_response(*subjects: str) -> str:
+    return ''.join(f"<Topic><Subject>{s}</Subject><Rational>r</Rational></Topic>" for s in subjects)
+
+@pytest.fixture
+def databases(tmp_path):
+    db_name = str(tmp_path/'results.db')
+    result_manager, response_log = IODataBase(db_name), ResponseLog(db_name)
+    with result_manager.connection:
+        result_manager.connection.execute("INSERT INTO model_infos (model_id) VALUES ('m')")
+    response_log.log('m', 'TopicCreatorContext', 'J|j', 'hash', 0, topics_response('a', 'b'), True)
+    reparse_topics(result_manager, response_log)
+    # The parser now finds a single topic, renamed, in the same response
+    response_log.log('m', 'TopicCreatorContext', 'J|j', 'hash', 1, topics_response('a2'), True)
+    return result_manager, response_log
+
+def topics(result_manager: IODataBase) -> dict:
+    return dict(result_manager.connection.execute("SELECT topic_id, Subject FROM topics ORDER BY topic_id"))
+
+def test_topics_are_updated_in_place(databases):
+    result_manager, response_log = databases
+    assert topics(result_manager) == {'m-0': 'a', 'm-1': 'b'}
+    reparse_topics(result_manager, response_log)
+    assert topics(result_manager) == {'m-0': 'a2'}
+
+def test_debated_topics_are_kept(databases):
+    result_manager, response_log = databases
+    write_frames(result_manager.connection, {'dim_discourse': pd.DataFrame([
+        dict(discourse_id='d0', topic_id='m-0'), dict(discourse_id='d1', topic_id='m-1')])})
+    with pytest.warns(UserWarning, match="1 topics"):
+        reparse_topics(result_manager, response_log)
+    assert topics(result_manager) == {'m-0': 'a2', 'm-1': 'b'}
+    # No debate lost its topic
+    assert result_manager.connection.execute(
+        "SELECT COUNT(*) FROM dim_discourse LEFT JOIN topics USING (topic_id) WHERE topics.topic_id IS NULL"
+        ).fetchone()[0] == 0
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+import pytest
+from ai_debater.models import response_cache
+from ai_debater.models.response_cache import ResponseCache
+
+MESSAGES = [{"role": "user", "content": "Is the debate over?"}]
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Accesses one second apart, the LRU order does not depend on the clock resolution
+    clock = SimpleNamespace(now=1000.)
+    def time():
+        clock.now += 1.
+        return clock.now
+    monkeypatch.setattr(response_cache, 'time', SimpleNamespace(time=time))
+    return clock
+
+def cache(tmp_path, **kwargs) -> ResponseCache:
+    return ResponseCache(str(tmp_path/'cache.db'), **kwargs)
+
+def test_key_is_stable():
+    key = ResponseCache.key('OpenAIChatter|gpt-4', 'prompt', MESSAGES, {'temperature': 0.})
+    # Keys are persisted: the same request must give the same key in later versions
+    assert key == 'b262d3b1fb886c6f015bbeb46d86b61ce5c056a92cd644aed70c8fa6f9fdef7f'
+    assert key == ResponseCache.key('OpenAIChatter|gpt-4', 'prompt',
+                                    [{"content": "Is the debate over?", "role": "user"}], {'temperature': 0.})
+    assert key != ResponseCache.key('OpenAIChatter|gpt-4', 'prompt', MESSAGES, {'temperature': 1.})
+    assert key != ResponseCache.key('OpenAIChatter|gpt-4', 'other prompt', MESSAGES, {'temperature': 0.})
+    assert key != ResponseCache.key('GeminiChatter|gemini-pro', 'prompt', MESSAGES, {'temperature': 0.})
+
+def test_least_recently_used_are_evicted(tmp_path, clock):
+    responses = cache(tmp_path, max_entries=2)
+    responses.put('a', 'model', 'answer a')
+    responses.put('b', 'model', 'answer b')
+    assert responses.get('a') == 'answer a'
+    responses.put('c', 'model', 'answer c')
+    assert responses.get('b') is None
+    assert responses.get('a') == 'answer a' and responses.get('c') == 'answer c'
+
+def test_evicted_above_max_bytes(tmp_path, clock):
+    responses = cache(tmp_path, max_bytes=10)
+    responses.put('a', 'model', 'a'*4)
+    responses.put('b', 'model', 'b'*4)
+    responses.get('a')
+    responses.put('c', 'model', 'c'*4)
+    assert [responses.get(key) for key in 'abc'] == ['a'*4, None, 'c'*4]
+    responses.put('d', 'model', 'd'*11)
+    assert [responses.get(key) for key in 'abcd'] == [None]*4
+
+def test_modes(tmp_path, clock):
+    responses = cache(tmp_path, max_entries=2)
+    responses.put('a', 'model', 'answer a')
+    responses.put('b', 'model', 'answer b')
+    responses.mode = 'read-only'
+    responses.put('c', 'model', 'answer c')
+    # Reads do not refresh the access times
+    assert responses.get('a') == 'answer a'
+    assert responses.get('c') is None
+    responses.mode = 'bypass'
+    assert responses.get('a') is None
+    responses.mode = 'read-write'
+    responses.put('c', 'model', 'answer c')
+    assert responses.get('a') is None and responses.get('b') == 'answer b'
+    with pytest.raises(NameError):
+        responses.mode = 'write-only'
@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+import email.utils
+import time
+import pytest
+from ai_debater.models import abstractai_chatter
+from ai_debater.models.abstractai_chatter import BaseAiChatter
+from ai_debater.models.fake_chatter import FakeProviderError
+from ai_debater.models.retry_policy import RetryPolicy, ChatterMetrics, retry_after, is_transient
+from ai_debater.prompt_engineering import PublicContext
+
+VALID = "<Judgement_ID>a</Judgement_ID>"
+
+class ScriptedChatter(BaseAiChatter):
+    """Chatter giving, or raising, its replies in turn"""
+    model_entity = 'ScriptedChatter|test'
+    metainfo = {}
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+
+    def _answer(self, messages):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+def error_with(headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+@pytest.mark.parametrize("headers, delay", [
+    ({'retry-after': '2'}, 2.),
+    ({'retry-after': '0.5'}, 0.5),
+    ({'retry-after-ms': '1500', 'retry-after': '9'}, 1.5),
+    ({'retry-after-ms': 'soon', 'retry-after': '3'}, 3.),
+    ({'retry-after': 'soon'}, None),
+    ({'retry-after': ''}, None),
+    ({}, None),
+])
+def test_retry_after(headers, delay):
+    assert retry_after(error_with(headers)) == delay
+
+def test_retry_after_date():
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert retry_after(error_with({'retry-after': date})) == pytest.approx(30., abs=1.5)
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert retry_after(error_with({'retry-after': past})) == 0.
+
+def test_backoff_within_its_jitter():
+    policy = RetryPolicy(base_delay=1., max_delay=10., jitter=0.5)
+    for attempt_i in range(6):
+        ceiling = min(10., 2.**attempt_i)
+        delays = [policy.backoff(attempt_i) for _ in range(200)]
+        assert all(ceiling*0.5 <= delay <= ceiling for delay in delays)
+        # Jittered, not all the same
+        assert len(set(delays)) > 1
+    assert RetryPolicy(base_delay=1., max_delay=60., jitter=0.).backoff(3) == 8.
+
+def test_backoff_honours_retry_after():
+    policy = RetryPolicy(base_delay=1., max_delay=2.)
+    assert policy.backoff(0, FakeProviderError(429, retry_after=7.)) == 7.
+    assert policy.backoff(0, FakeProviderError(500)) <= 1.
+
+def test_transient_errors():
+    assert is_transient(FakeProviderError(429))
+    assert is_transient(FakeProviderError(503))
+    assert not is_transient(FakeProviderError(400))
+    assert not is_transient(ValueError())
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(abstractai_chatter, 'time', SimpleNamespace(monotonic=time.monotonic, sleep=sleeps.append))
+    return sleeps
+
+def chatter(replies, **policy) -> ScriptedChatter:
+    model = ScriptedChatter(replies)
+    model.initialise(PublicContext(), retry_policy=RetryPolicy(**policy))
+    return model
+
+def test_answer_waits_as_asked(sleeps):
+    model = chatter([FakeProviderError(429, retry_after=2.5), FakeProviderError(500), VALID],
+                    max_attempt=3, base_delay=0.1, jitter=0.)
+    assert model.answer_until_valid([]).Judgement_ID == 'a'
+    assert sleeps == [2.5, 0.2]
+
+def test_answer_gives_up_at_the_deadline(sleeps):
+    model = chatter([FakeProviderError(429, retry_after=5.), VALID], deadline=1.)
+    assert model.answer_until_valid([]) is None
+    assert sleeps == []
+
+def test_answer_raises_other_errors(sleeps):
+    model = chatter([FakeProviderError(400), VALID])
+    with pytest.raises(FakeProviderError):
+        model.answer_until_valid([])
+
+def test_metrics_keep_integer_counters():
+    metrics = ChatterMetrics()
+    metrics.record('ScriptedChatter|test', calls=1, attempts=2, transient_errors=1)
+    metrics.record_latency('ScriptedChatter|test', 0.5)
+    counters = metrics.to_pandas()
+    assert counters.transient_errors.dtype == 'int64' and counters.hedges.dtype == 'int64'
+    assert counters.total_latency.dtype == 'float64'
+    assert counters.loc['ScriptedChatter|test', 'mean_latency'] == 0.25
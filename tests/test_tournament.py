@@ -0,0 +1,57 @@
+from collections import Counter
+import threading
+import time
+import pandas as pd
+import pytest
+from ai_debater import tournament
+from ai_debater.io_database import IODataBase
+from ai_debater.models.fake_chatter import FakeChatter, FakeProfile
+from ai_debater.prompt_engineering import DebaterContext
+from ai_debater.tournament import Tournament
+
+class Debates():
+    """debate of the tournament, recording the debates started and their providers in flight"""
+    def __init__(self):
+        self.started = []
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, topic, prop, oppo, **kwargs):
+        providers = {prop.provider_name, oppo.provider_name}
+        with self._lock:
+            self.started.append((prop.model, oppo.model))
+            for provider in providers:
+                self.in_flight[provider] += 1
+                self.max_in_flight[provider] = max(self.max_in_flight[provider], self.in_flight[provider])
+        time.sleep(0.05)
+        with self._lock:
+            for provider in providers:
+                self.in_flight[provider] -= 1
+        return self.debate(topic, prop, oppo, **kwargs)
+
+@pytest.fixture
+def debates(monkeypatch) -> Debates:
+    debates = Debates()
+    debates.debate = tournament.debate
+    monkeypatch.setattr(tournament, 'debate', debates)
+    return debates
+
+def test_busy_provider_does_not_hold_the_workers(debates):
+    profile = FakeProfile(median_latency=0.001, latency_sigma=0.)
+    models = [FakeChatter(model=model, profile=profile, seed=i, provider_name=provider)
+              for i, (model, provider) in enumerate([('p1', 'P'), ('p2', 'P'), ('q', 'Q'), ('r', 'R')])]
+    for model in models:
+        model.initialise(DebaterContext())
+    topics = pd.DataFrame([dict(topic_id='t0', Subject='s', Rational='r')])
+    result_manager = IODataBase(':memory:')
+    report = Tournament(result_manager.connection, provider_limits={'P': 1, 'Q': 1, 'R': 1},
+                        max_workers=2, n_round=1).run(topics, models)
+    assert len(report) == 12 and report.error.isna().all()
+    assert set(debates.max_in_flight.values()) == {1}
+    # The debate between the idle providers runs along the first one of P
+    assert set(debates.started[:2]) == {('p1', 'p2'), ('q', 'r')}
+
+def test_provider_limits_allow_a_debate():
+    with pytest.raises(NameError):
+        Tournament(None, provider_limits={'OpenAIChatter': 0})